@@ -0,0 +1,337 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Generator of production-sized synthetic databases, for the benchmarks and
+the load tests. The database only depends on the counts and on the seed:
+  python -m engine.bench.dataset PATH [--players N] [--games N]
+                                      [--seed N] [--actions] [--force]
+
+The players join the games with a skewed (zipf) distribution, a few
+players are in many games. The games are in the lobby, in progress or
+ended, with a mix of extensions, and have a state per player turn whose
+size grows with the game turn. The rows are inserted with executemany, in
+one transaction per table.
+"""
+
+import argparse
+import bisect
+import datetime
+import hashlib
+import itertools
+import os
+import pickle
+import random
+import sqlite3
+import sys
+import time
+import engine.db
+from engine.bench.serializer import make_state
+
+DEFAULT_PLAYERS = 100000
+DEFAULT_GAMES = 50000
+
+# the players get the same password, to log in from the load tests
+PASSWORD = 'bench'
+
+# exponent of the zipf distribution of the players in the games
+PLAYERS_SKEW = 1.1
+
+# part of the games in the lobby, in progress, ended
+GAMES_STATUS = (('lobby', 0.15), ('running', 0.6), ('ended', 0.25))
+
+PRIVATE_RATIO = 0.15
+
+# the actions played by a player during a turn, the states of the late
+# turns hold more actions and are larger
+ACTIONS_PER_TURN = 8
+
+# distinct states encoded per number of players, the states rows share
+# these blobs
+BLOBS_PER_PLAYERS = 10
+
+# rows given to each executemany
+CHUNK_SIZE = 10000
+
+START_DATE = datetime.datetime(2013, 1, 1)
+
+def email(player_id):
+    """ return: email of a generated player """
+    return 'player{}@bench.test'.format(player_id)
+
+def pass_hash(email_, password):
+    """ return: the password hash stored by DBInterface.create_player """
+    return hashlib.sha1((email_[:2] + password).encode('utf-8')).hexdigest()
+
+def _chunked(rows):
+    """ yield lists of at most CHUNK_SIZE rows of an iterable """
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_SIZE))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+class _Blobs(object):
+    """ encoded states of increasing sizes, BLOBS_PER_PLAYERS for each
+    number of players, the last ones are the end of game states.
+    """
+    def __init__(self, max_turn):
+        self._max_actions = max_turn * ACTIONS_PER_TURN
+        self._blobs = {}
+        for num_players in range(2, 7):
+            self._blobs[num_players] = [
+                engine.db.encode_state(make_state(
+                    num_players, self._num_actions(num_players, i)))
+                for i in range(BLOBS_PER_PLAYERS)]
+        self.actions = [pickle.dumps(action) for action
+                        in make_state(2, ACTIONS_PER_TURN).cur_actions]
+
+    def _num_actions(self, num_players, index):
+        """ return: actions in the index-th state of num_players games """
+        return (self._max_actions * num_players * index
+                // (BLOBS_PER_PLAYERS - 1))
+
+    def get(self, num_players, turn, max_turn):
+        """ return: the blob of a state of a game turn """
+        index = min(BLOBS_PER_PLAYERS - 1,
+                    turn * (BLOBS_PER_PLAYERS - 1) // max_turn)
+        return self._blobs[num_players][index]
+
+class Generator(object):
+    """
+    Fill an empty database, call the insert methods in order: players,
+    games, then the states.
+    """
+    def __init__(self, conn, num_players, num_games, seed=0, actions=False,
+                 max_turn=9):
+        self._conn = conn
+        self.num_players = num_players
+        self.num_games = num_games
+        self._rand = random.Random(seed)
+        self._actions = actions
+        self._max_turn = max_turn
+        self._blobs = _Blobs(max_turn)
+        # game id -> (num_players, status, cur_turn)
+        self._games = {}
+        self.counts = {}
+
+    def _insert(self, table, sql, rows):
+        """ insert rows in one transaction """
+        count = 0
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute('BEGIN;')
+            for chunk in _chunked(rows):
+                cursor.executemany(sql, chunk)
+                count += len(chunk)
+            cursor.execute('COMMIT;')
+        finally:
+            cursor.close()
+        self.counts[table] = self.counts.get(table, 0) + count
+
+    def insert_players(self):
+        """ insert the players, ids from 1 to num_players """
+        cursor = self._conn.execute('SELECT diff FROM timezones;')
+        timezones = [diff for (diff, ) in cursor.fetchall()]
+        # every generated email starts with 'pl'
+        password = pass_hash(email(1), PASSWORD)
+        rand = self._rand
+        self._insert('players',
+                     ('INSERT INTO players (id, name, email, password, '
+                      'timezone) VALUES (?, ?, ?, ?, ?);'),
+                     ((player_id, 'player {}'.format(player_id),
+                       email(player_id), password, rand.choice(timezones))
+                      for player_id in range(1, self.num_players + 1)))
+
+    def _pick_players(self, cum_weights, count):
+        """ return: count distinct players ids, following the zipf
+        distribution of cum_weights
+        """
+        players = []
+        total = cum_weights[-1]
+        while len(players) < count:
+            player_id = 1 + bisect.bisect(cum_weights,
+                                          self._rand.random() * total)
+            if player_id not in players:
+                players.append(player_id)
+        return players
+
+    def insert_games(self):
+        """ insert the games, with their players and extensions """
+        rand = self._rand
+        cum_weights = list(itertools.accumulate(
+            1 / rank ** PLAYERS_SKEW
+            for rank in range(1, self.num_players + 1)))
+        cursor = self._conn.execute('SELECT id, name FROM extensions;')
+        extensions = sorted(cursor.fetchall())
+        statuses = [status for status, _ in GAMES_STATUS]
+        weights = [weight for _, weight in GAMES_STATUS]
+
+        games = []
+        games_players = []
+        games_extensions = []
+        for game_id in range(1, self.num_games + 1):
+            num_players = rand.randint(2, 6)
+            status = rand.choices(statuses, weights)[0]
+            started = status != 'lobby'
+            ended = status == 'ended'
+            if status == 'lobby':
+                cur_turn = 0
+                # players still missing
+                joined = rand.randint(1, num_players)
+            else:
+                cur_turn = (self._max_turn if ended
+                            else rand.randint(1, self._max_turn))
+                joined = num_players
+            private = rand.random() < PRIVATE_RATIO
+            start_date = START_DATE + datetime.timedelta(
+                seconds=rand.randrange(365 * 86400))
+            last_play = None
+            if started:
+                last_play = start_date + datetime.timedelta(
+                    seconds=rand.randrange(cur_turn * 7 * 86400))
+            players = self._pick_players(cum_weights, joined)
+            games.append((game_id, 'game {}'.format(game_id), started, ended,
+                          rand.randint(1, 4), private,
+                          'secret' if private else '', start_date, last_play,
+                          num_players, players[0], cur_turn))
+            games_players.extend((game_id, player_id)
+                                 for player_id in players)
+            for (ext_id, name) in rand.sample(extensions,
+                                              rand.randint(0, 4)):
+                if name != 'small_galaxy' or num_players == 3:
+                    games_extensions.append((game_id, ext_id))
+            self._games[game_id] = (num_players, status, cur_turn)
+
+        self._insert('games',
+                     ('INSERT INTO games (id, name, started, ended, level, '
+                      'private, password, start_date, last_play, '
+                      'num_players, creator_id, cur_turn) '
+                      'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);'), games)
+        self._insert('games_players',
+                     ('INSERT INTO games_players (game_id, player_id) '
+                      'VALUES (?, ?);'), games_players)
+        self._insert('games_extensions',
+                     ('INSERT INTO games_extensions (game_id, extension_id) '
+                      'VALUES (?, ?);'), games_extensions)
+
+    def _states(self):
+        """ yield (game_id, blob) of the states, one per player turn, in
+        the order of the games
+        """
+        for game_id, (num_players, status, cur_turn) in self._games.items():
+            if status == 'lobby':
+                # the initial state
+                yield (game_id, self._blobs.get(num_players, 0,
+                                                self._max_turn))
+                continue
+            for turn in range(1, cur_turn + 1):
+                blob = self._blobs.get(num_players, turn, self._max_turn)
+                for _ in range(num_players):
+                    yield (game_id, blob)
+
+    def insert_states(self):
+        """ insert the states, all snapshots, and with actions the actions
+        log of the games
+        """
+        self._insert('state',
+                     'INSERT INTO state (game_id, pickle) VALUES (?, ?);',
+                     self._states())
+        if not self._actions:
+            return
+
+        def actions():
+            """ yield the actions of the states, in the order of the games """
+            cursor = self._conn.execute('SELECT game_id, id FROM state '
+                                        'ORDER BY game_id, id;')
+            seq = 0
+            last_game = None
+            for (game_id, state_id) in cursor:
+                if game_id != last_game:
+                    (seq, last_game) = (0, game_id)
+                for action in self._blobs.actions:
+                    seq += 1
+                    yield (game_id, seq, state_id, action)
+
+        self._insert('actions',
+                     ('INSERT INTO actions (game_id, seq, state_id, pickle) '
+                      'VALUES (?, ?, ?, ?);'), actions())
+
+def generate(path, num_players=DEFAULT_PLAYERS, num_games=DEFAULT_GAMES,
+             seed=0, actions=False):
+    """ create a database and fill it.
+    args:
+     path (str): database file, must not exist
+     num_players (int)
+     num_games (int)
+     seed (int): the same seed and counts give the same database
+     actions (bool): also fill the actions log
+    return: {table name (str): inserted rows (int)}
+    """
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    # the schema of the server, with its migrations applied
+    db = engine.db.DBInterface(db_path=path)
+    del db
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute('PRAGMA journal_mode = wal;')
+        conn.execute('PRAGMA synchronous = off;')
+        generator = Generator(conn, num_players, num_games, seed, actions)
+        generator.insert_players()
+        generator.insert_games()
+        generator.insert_states()
+        conn.execute('ANALYZE;')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE);')
+    finally:
+        conn.close()
+    return generator.counts
+
+def main(argv=None):
+    """ parse the command line and generate the database """
+    parser = argparse.ArgumentParser(description=('generate a synthetic '
+                                                  'database'))
+    parser.add_argument('path', help='database file to create')
+    parser.add_argument('--players', type=int, default=DEFAULT_PLAYERS)
+    parser.add_argument('--games', type=int, default=DEFAULT_GAMES)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--actions', action='store_true',
+                        help='also fill the actions log')
+    parser.add_argument('--force', action='store_true',
+                        help='overwrite the database file')
+    args = parser.parse_args(argv)
+
+    if args.force:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+    start = time.perf_counter()
+    try:
+        counts = generate(args.path, args.players, args.games, args.seed,
+                          args.actions)
+    except FileExistsError:
+        print('{} already exists, use --force to overwrite it'.format(
+            args.path))
+        return 1
+    for table, count in sorted(counts.items()):
+        print('{:<20}{:>12}'.format(table, count))
+    print('generated in {:.1f}s, {} bytes'.format(
+        time.perf_counter() - start, os.path.getsize(args.path)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,290 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of the DBInterface and GamesManager hot paths against synthetic
+databases of several scales. The results are written as JSON and compared
+with a baseline, a benchmark slower than its baseline by more than the
+threshold is a regression:
+  python -m engine.bench.hot_paths [--scales small,medium] [--number N]
+                                   [--output FILE] [--baseline FILE]
+                                   [--threshold RATIO]
+the exit status is 1 if a regression is found.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import engine.bench.dataset as dataset
+import engine.db
+from engine.bench.serializer import make_state
+from engine.db import DB_STATUS
+from engine.game_manager import GamesManager
+
+# name -> (number of players, number of games), tiny is a smoke test
+SCALES = {'tiny': (10, 20),
+          'small': (100, 200),
+          'medium': (1000, 2000),
+          'large': (10000, 5000),
+          'production': (dataset.DEFAULT_PLAYERS, dataset.DEFAULT_GAMES)}
+
+# actions in the small and large states
+SMALL_STATE_ACTIONS = 10
+LARGE_STATE_ACTIONS = 1000
+
+# a benchmark median slower than the baseline by more than this ratio is a
+# regression
+DEFAULT_THRESHOLD = 0.25
+
+def _check(result):
+    """ raise if a DBInterface or GamesManager call failed """
+    if result[0] not in (True, DB_STATUS.OK):
+        raise RuntimeError('Benchmarked call failed: {!r}'.format(result))
+
+class Context(object):
+    """ what the benchmarks work on """
+    def __init__(self, gm, db, players_ids, games_ids, seed):
+        self.gm = gm
+        self.db = db
+        self.players_ids = players_ids
+        self.games_ids = games_ids
+        self.rand = random.Random(seed)
+        # games and states saved by the save_state benchmarks, built once
+        self.saved_games = [db.load_game(game_id)[1]
+                            for game_id in games_ids[:20]]
+        self.states = {'small': make_state(6, SMALL_STATE_ACTIONS),
+                       'large': make_state(6, LARGE_STATE_ACTIONS)}
+        self.states_ids = {}
+
+    def game(self):
+        """ return: a random game id """
+        return self.rand.choice(self.games_ids)
+
+    def player(self):
+        """ return: a random player id """
+        return self.rand.choice(self.players_ids)
+
+def bench_create_game(ctx):
+    """ GamesManager.create_game of a three players game """
+    players = ctx.rand.sample(ctx.players_ids, 3)
+    if not ctx.gm.create_game(players[0], 'bench', 2, False, '', 3, players,
+                              {}):
+        raise RuntimeError('Benchmarked call failed: create_game')
+
+def bench_load_game_cold(ctx):
+    """ GamesManager.load_game, from the database """
+    _check(ctx.gm.load_game(ctx.game(), force=True))
+
+def bench_load_game_warm(ctx):
+    """ GamesManager.load_game, from memory """
+    _check(ctx.gm.load_game(ctx.games_ids[0]))
+
+def bench_get_my_games(ctx):
+    """ GamesManager.get_my_games """
+    _check(ctx.gm.get_my_games(ctx.player()))
+
+def bench_get_pub_priv_games(ctx):
+    """ GamesManager.get_pub_priv_games """
+    _check(ctx.gm.get_pub_priv_games())
+
+def _save_state(ctx, size):
+    """ DBInterface.save_state of a state of ctx.states """
+    game = ctx.rand.choice(ctx.saved_games)
+    game.cur_state = ctx.states[size]
+    (status, state_id) = ctx.db.save_state(game)
+    _check((status, ))
+    ctx.states_ids.setdefault(size, []).append(state_id)
+
+def bench_save_state_small(ctx):
+    """ DBInterface.save_state of a small state """
+    _save_state(ctx, 'small')
+
+def bench_save_state_large(ctx):
+    """ DBInterface.save_state of a large state """
+    _save_state(ctx, 'large')
+
+def bench_load_state_small(ctx):
+    """ DBInterface.load_state of a small state """
+    _check(ctx.db.load_state(ctx.rand.choice(ctx.states_ids['small'])))
+
+def bench_load_state_large(ctx):
+    """ DBInterface.load_state of a large state """
+    _check(ctx.db.load_state(ctx.rand.choice(ctx.states_ids['large'])))
+
+def bench_auth_player(ctx):
+    """ GamesManager.auth_player """
+    player_id = ctx.player()
+    if ctx.gm.auth_player(dataset.email(player_id), dataset.PASSWORD) != (
+            True, True, player_id):
+        raise RuntimeError('Benchmarked call failed: auth_player')
+
+# in running order, the load_state ones load the states saved before
+BENCHMARKS = [('create_game', bench_create_game),
+              ('load_game_cold', bench_load_game_cold),
+              ('load_game_warm', bench_load_game_warm),
+              ('get_my_games', bench_get_my_games),
+              ('get_pub_priv_games', bench_get_pub_priv_games),
+              ('save_state_small', bench_save_state_small),
+              ('save_state_large', bench_save_state_large),
+              ('load_state_small', bench_load_state_small),
+              ('load_state_large', bench_load_state_large),
+              ('auth_player', bench_auth_player)]
+
+def time_calls(fun, ctx, number):
+    """ time number calls of fun(ctx), after a warm-up call.
+    return: {'number', 'min_ms', 'median_ms', 'mean_ms', 'p95_ms'}
+    """
+    fun(ctx)
+    durations = []
+    for _ in range(number):
+        start = time.perf_counter()
+        fun(ctx)
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    return {'number': number,
+            'min_ms': durations[0],
+            'median_ms': statistics.median(durations),
+            'mean_ms': statistics.mean(durations),
+            'p95_ms': durations[min(len(durations) - 1,
+                                    int(len(durations) * 0.95))]}
+
+def run_scale(scale, number, seed=0, names=None):
+    """ generate a database of a scale in a temporary directory, see
+    engine.bench.dataset, and run the benchmarks on it.
+    args:
+     scale (str): key of SCALES
+     number (int): timed calls per benchmark
+     seed (int)
+     names [str, ...]: benchmarks to run, None for all
+    return: {benchmark name (str): timings, see time_calls}
+    """
+    (num_players, num_games) = SCALES[scale]
+    with tempfile.TemporaryDirectory(prefix='ecbb-bench-') as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'eclipse.db')
+        dataset.generate(db_path, num_players, num_games, seed)
+        players_ids = list(range(1, num_players + 1))
+        games_ids = list(range(1, num_games + 1))
+        db = engine.db.DBInterface(db_path=db_path)
+        gm = GamesManager(db_settings={'db_path': db_path})
+        try:
+            ctx = Context(gm, db, players_ids, games_ids, seed)
+            results = {}
+            for name, fun in BENCHMARKS:
+                if names is None or name in names:
+                    results[name] = time_calls(fun, ctx, number)
+                elif name.startswith('save_state'):
+                    # states for the load_state benchmarks
+                    fun(ctx)
+            return results
+        finally:
+            gm.close()
+
+def run(scales, number, seed=0, names=None):
+    """ run the benchmarks at several scales.
+    return: the JSON document of the results:
+            {'meta': {...}, 'results': {scale: {benchmark: timings}}}
+    """
+    results = {}
+    for scale in scales:
+        results[scale] = run_scale(scale, number, seed, names)
+    return {'meta': {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'python': platform.python_version(),
+                     'sqlite': sqlite3.sqlite_version,
+                     'platform': platform.platform(),
+                     'number': number,
+                     'seed': seed},
+            'results': results}
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """ compare the medians of the results with a baseline.
+    args:
+     results, baseline: JSON documents returned by run
+     threshold (float): allowed slowdown ratio
+    return: [(scale, benchmark, baseline median, median, ratio,
+              regression (bool)), ...] for the benchmarks in both
+    """
+    rows = []
+    for scale, benchmarks in sorted(results['results'].items()):
+        base = baseline['results'].get(scale, {})
+        for name, timings in sorted(benchmarks.items()):
+            if name not in base:
+                continue
+            before = base[name]['median_ms']
+            after = timings['median_ms']
+            ratio = after / before if before > 0 else float('inf')
+            rows.append((scale, name, before, after, ratio,
+                         ratio > 1 + threshold))
+    return rows
+
+def main(argv=None):
+    """ parse the command line, run and compare the benchmarks """
+    parser = argparse.ArgumentParser(description=('benchmark the DB and the '
+                                                  'games manager'))
+    parser.add_argument('--scales', default='small',
+                        help='comma separated, among {}'.format(
+                            ', '.join(sorted(SCALES))))
+    parser.add_argument('--benchmarks', default=None,
+                        help='comma separated, default to all')
+    parser.add_argument('--number', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None,
+                        help='write the results in this JSON file')
+    parser.add_argument('--baseline', default=None,
+                        help='JSON file of previous results to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    scales = args.scales.split(',')
+    for scale in scales:
+        if scale not in SCALES:
+            parser.error('unknown scale {!r}'.format(scale))
+    names = None if args.benchmarks is None else args.benchmarks.split(',')
+
+    results = run(scales, args.number, args.seed, names)
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    print('{:<8}{:<20}{:>12}{:>12}{:>12}'.format('scale', 'benchmark',
+                                                 'median ms', 'p95 ms',
+                                                 'min ms'))
+    for scale, benchmarks in sorted(results['results'].items()):
+        for name, timings in sorted(benchmarks.items()):
+            print('{:<8}{:<20}{:>12.3f}{:>12.3f}{:>12.3f}'.format(
+                scale, name, timings['median_ms'], timings['p95_ms'],
+                timings['min_ms']))
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as baseline:
+        rows = compare(results, json.load(baseline), args.threshold)
+    print('\n{:<8}{:<20}{:>12}{:>12}{:>8}'.format('scale', 'benchmark',
+                                                  'baseline', 'median',
+                                                  'ratio'))
+    for scale, name, before, after, ratio, regression in rows:
+        print('{:<8}{:<20}{:>12.3f}{:>12.3f}{:>8.2f}{}'.format(
+            scale, name, before, after, ratio,
+            '  REGRESSION' if regression else ''))
+    return 1 if any(row[-1] for row in rows) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of the states serialization, pickle against the binary
+serializer, with and without compression:
+  python -m engine.bench.serializer [--actions N] [--number N]
+"""
+
+import argparse
+import sys
+import timeit
+import engine.db
+from engine.data_types import Action, GameState
+from engine.db import STATE_CODECS, STATE_SERIALIZERS
+
+_RACES = ['terran', 'hydran', 'planta', 'orion', 'mechanema', 'eridani']
+
+def make_state(num_players=6, num_actions=200):
+    """ build a state looking like a mid-game state.
+    args:
+     num_players (int)
+     num_actions (int): number of actions in cur_actions
+    return: GameState object
+    """
+    state = GameState(num_players)
+    state.cur_turn = 5
+    for player_id in range(1, num_players + 1):
+        state.add_player(player_id, 'player {}'.format(player_id),
+                         _RACES[:num_players])
+    state.players_order = list(state.players)
+    state.cur_actions = [Action(i, 'zone {}'.format(i),
+                                'zone {}'.format(i + 1))
+                         for i in range(num_actions)]
+    return state
+
+def run(state, number):
+    """ time the encoding and decoding of a state.
+    args:
+     state (GameState object)
+     number (int): number of encodings/decodings timed
+    return: [(serializer name, codec name, size in bytes,
+              encoding time in ms, decoding time in ms), ...]
+    """
+    results = []
+    for serializer in ('PICKLE', 'BINARY'):
+        for codec in ('NONE', 'ZLIB', 'LZMA'):
+            args = (state, getattr(STATE_CODECS, codec),
+                    getattr(STATE_SERIALIZERS, serializer))
+            blob = engine.db.encode_state(*args)
+            encode = timeit.timeit(lambda: engine.db.encode_state(*args),
+                                   number=number)
+            decode = timeit.timeit(lambda: engine.db.decode_state(blob),
+                                   number=number)
+            results.append((serializer.lower(), codec.lower(), len(blob),
+                            encode * 1000 / number, decode * 1000 / number))
+    return results
+
+def main(argv=None):
+    """ parse the command line and print the results """
+    parser = argparse.ArgumentParser(description='benchmark the serializers')
+    parser.add_argument('--actions', type=int, default=200)
+    parser.add_argument('--number', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    state = make_state(num_actions=args.actions)
+    print('{:<12}{:<8}{:>10}{:>14}{:>14}'.format('serializer', 'codec',
+                                                'bytes', 'encode (ms)',
+                                                'decode (ms)'))
+    for result in run(state, args.number):
+        print('{:<12}{:<8}{:>10}{:>14.4f}{:>14.4f}'.format(*result))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import OrderedDict
+import logging
+import threading
+import engine.db
+
+def state_size(game):
+    """ approximate memory used by a game: the memory used by its state, as
+    estimated by the DB when the state was last saved or loaded, see
+    engine.db.state_memory_size. a state never written to nor read from
+    the DB is serialized once here.
+    args: game (Game object)
+    return: size in bytes (int)
+    """
+    if game.cur_state is None:
+        return 0
+    if game.state_bytes is None:
+        game.state_bytes = engine.db.state_memory_size(engine.db.encode_state(
+            game.cur_state, engine.db.STATE_CODECS.NONE))
+    return game.state_bytes
+
+class GamesCache(object):
+    """
+    The games loaded in memory, accessed by their id, with least recently
+    used eviction.
+
+    Two limits, None for no limit:
+     -max_games: number of games in memory
+     -max_bytes: approximate memory used by the games, the size of a game
+      is computed by sizeof when it is put in the cache (or resized)
+
+    Some games are never evicted:
+     -the pinned ones, a game is pinned during a player turn and unpinned
+      once the turn is saved. pins are counted, a game pinned twice must be
+      unpinned twice.
+     -the dirty ones which can't be written back: before being evicted a
+      dirty game is given to write_back(game), which returns True when the
+      game has been saved. write_back is called without the cache lock
+      held, the other games are accessed while it saves the game.
+
+    When only pinned/unsavable games remain the limits are exceeded.
+
+    attributes:
+      self.hits (int): get of a game in memory
+      self.misses (int): get of a game not in memory
+      self.evictions (int): games removed to respect the limits
+      self.write_backs (int): dirty games saved before their eviction
+    """
+    def __init__(self, max_games=None, max_bytes=None, write_back=None,
+                 sizeof=state_size):
+        self._logger = logging.getLogger('ecbb.cache')
+        self.max_games = max_games
+        self.max_bytes = max_bytes
+        self._write_back = write_back
+        self._sizeof = sizeof
+
+        # game_id -> game, least recently used first
+        self._games = OrderedDict()
+        # game_id -> size in bytes
+        self._sizes = {}
+        self._bytes = 0
+        # game_id -> pin count
+        self._pins = {}
+        self._dirty = set()
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.write_backs = 0
+
+    def __len__(self):
+        return len(self._games)
+
+    def __contains__(self, game_id):
+        """ do not count as a hit/miss, nor change the eviction order """
+        return game_id in self._games
+
+    def __getitem__(self, game_id):
+        """ same as get, but raise a KeyError if the game is not in memory """
+        game = self.get(game_id)
+        if game is None:
+            raise KeyError(game_id)
+        return game
+
+    def get(self, game_id):
+        """ return the game, mark it as the most recently used.
+        args: game_id (int)
+        return: Game object, None if not in memory
+        """
+        with self._lock:
+            game = self._games.get(game_id)
+            if game is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._games.move_to_end(game_id)
+            return game
+
+    def peek(self, game_id):
+        """ same as get, but do not count as a hit/miss, nor change the
+        eviction order.
+        args: game_id (int)
+        return: Game object, None if not in memory
+        """
+        with self._lock:
+            return self._games.get(game_id)
+
+    def put(self, game_id, game):
+        """ add or replace a game, then evict games over the limits.
+        the game put is never evicted by this call.
+        args:
+         game_id (int)
+         game (Game object)
+        """
+        with self._lock:
+            self._games[game_id] = game
+            self._games.move_to_end(game_id)
+            self._set_size(game_id)
+            dirty = self._evict(keep=game_id)
+        self._evict_dirty(dirty, keep=game_id)
+
+    def pop(self, game_id):
+        """ remove a game without writing it back.
+        args: game_id (int)
+        return: Game object, None if not in memory
+        """
+        with self._lock:
+            game = self._games.pop(game_id, None)
+            self._bytes -= self._sizes.pop(game_id, 0)
+            self._pins.pop(game_id, None)
+            self._dirty.discard(game_id)
+            return game
+
+    def resize(self, game_id):
+        """ compute again the size of a game modified in memory, then evict
+        games over the limits.
+        args: game_id (int)
+        """
+        with self._lock:
+            if game_id not in self._games:
+                return
+            self._set_size(game_id)
+            dirty = self._evict(keep=game_id)
+        self._evict_dirty(dirty, keep=game_id)
+
+    def pin(self, game_id):
+        """ prevent the eviction of a game, must be balanced by unpin.
+        args: game_id (int)
+        """
+        with self._lock:
+            self._pins[game_id] = self._pins.get(game_id, 0) + 1
+
+    def unpin(self, game_id):
+        """ allow the eviction of a game once all its pins are removed.
+        args: game_id (int)
+        """
+        with self._lock:
+            count = self._pins.get(game_id, 0) - 1
+            if count > 0:
+                self._pins[game_id] = count
+                return
+            self._pins.pop(game_id, None)
+            dirty = self._evict()
+        self._evict_dirty(dirty)
+
+    def is_pinned(self, game_id):
+        """ return: True if the game can't be evicted because it's pinned """
+        return game_id in self._pins
+
+    def mark_dirty(self, game_id):
+        """ the game has been modified, write it back before its eviction.
+        args: game_id (int)
+        """
+        with self._lock:
+            if game_id in self._games:
+                self._dirty.add(game_id)
+
+    def mark_clean(self, game_id):
+        """ the game has been saved.
+        args: game_id (int)
+        """
+        with self._lock:
+            self._dirty.discard(game_id)
+
+    def is_dirty(self, game_id):
+        """ return: True if the game has been modified and not saved """
+        return game_id in self._dirty
+
+    def stats(self):
+        """ return: dict of the cache counters and usage """
+        with self._lock:
+            return {'games': len(self._games),
+                    'bytes': self._bytes,
+                    'max_games': self.max_games,
+                    'max_bytes': self.max_bytes,
+                    'pinned': len(self._pins),
+                    'dirty': len(self._dirty),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'write_backs': self.write_backs}
+
+    def _set_size(self, game_id):
+        """ store the size of a game in memory. called with the lock held. """
+        size = self._sizeof(self._games[game_id])
+        self._bytes += size - self._sizes.get(game_id, 0)
+        self._sizes[game_id] = size
+
+    def _over_limits(self, games, bytes_):
+        """ return: True if games entries using bytes_ exceed the limits """
+        return ((self.max_games is not None and games > self.max_games)
+                or (self.max_bytes is not None and bytes_ > self.max_bytes))
+
+    def _evict(self, keep=None):
+        """ evict the least recently used clean games until the cache is
+        under its limits, the dirty games to evict are returned to be
+        written back by _evict_dirty once the lock is released.
+        called with the lock held.
+        args: keep (int): id of a game not to evict
+        return: [(game_id (int), Game object), ...] dirty games to evict
+        """
+        games = len(self._games)
+        bytes_ = self._bytes
+        dirty = []
+        for game_id in list(self._games):
+            if not self._over_limits(games, bytes_):
+                break
+            if game_id == keep or game_id in self._pins:
+                continue
+            if game_id in self._dirty and self._write_back is None:
+                continue
+            games -= 1
+            bytes_ -= self._sizes.get(game_id, 0)
+            if game_id in self._dirty:
+                # marked dirty again if modified during its write back
+                self._dirty.discard(game_id)
+                dirty.append((game_id, self._games[game_id]))
+            else:
+                self.pop(game_id)
+                self.evictions += 1
+                self._logger.debug('Evicted game {}'.format(game_id))
+        return dirty
+
+    def _evict_dirty(self, dirty, keep=None):
+        """ write back dirty games then evict them, unless they've been
+        used since _evict selected them. called without the lock.
+        args:
+         dirty [(game_id (int), Game object), ...]: returned by _evict
+         keep (int): id of a game not to evict
+        """
+        for game_id, game in dirty:
+            if not self._write_back(game):
+                self._logger.warning(("Game {} not written back, not "
+                                      "evicted").format(game_id))
+                self.mark_dirty(game_id)
+                continue
+            with self._lock:
+                self.write_backs += 1
+                if (self._games.get(game_id) is not game
+                        or game_id == keep
+                        or game_id in self._pins
+                        or game_id in self._dirty
+                        or not self._over_limits(len(self._games),
+                                                 self._bytes)):
+                    continue
+                self.pop(game_id)
+                self.evictions += 1
+                self._logger.debug('Evicted game {}'.format(game_id))
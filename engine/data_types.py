@@ -16,13 +16,60 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import engine.util
+from engine.galaxy import Galaxy
+from engine.reachability import Reachability
+import engine.rules
 
 # everything is stored inside the Game State
 
-class Player(object):
+# A game keeps its state and thousands of actions in memory, the state
+# objects have __slots__ instead of a __dict__ to be compact. A new
+# attribute has to be added to the __slots__ of its class, and to the class
+# schema in engine/serializer.py to be stored. The attributes starting with
+# an underscore are caches rebuilt from the others, they are not stored.
+
+class Slotted(object):
+    """
+    base of the slotted state objects, they are pickled as the dict of
+    their attributes, like the plain objects of the legacy pickled states,
+    so both are unpickled by __setstate__.
+
+    _defaults are the values of the attributes added since, missing in the
+    older pickles, a callable returning the value for mutable defaults.
+    """
+    __slots__ = ()
+    _defaults = {}
+
+    def __getstate__(self):
+        """ return: {attribute name (str): value} of the set attributes,
+        without the caches
+        """
+        return {name: getattr(self, name) for name in self.__slots__
+                if not name.startswith('_') and hasattr(self, name)}
+
+    def __setstate__(self, state):
+        """ set the attributes of a pickled state.
+        args: state {attribute name (str): value}, an attribute no longer
+              in __slots__ is ignored
+        """
+        slots = self.__slots__
+        for name, value in state.items():
+            if name in slots:
+                setattr(self, name, value)
+        for name, default in self._defaults.items():
+            if name not in state:
+                setattr(self, name, default() if callable(default)
+                        else default)
+
+class Player(Slotted):
     """ a player in the game.
     created in the game state when a player choose its races.
     """
+    __slots__ = ('id_', 'name', 'race', 'races_wishes', 'money', 'science',
+                 'materials', 'influence', 'actions')
+    _defaults = {'money': 0, 'science': 0, 'materials': 0, 'influence': 0,
+                 'actions': 0}
+
     def __init__(self, id_, name, races_wishes):
         # the id_ is the same as the web player id_
         self.id_ = id_
@@ -32,10 +79,17 @@ class Player(object):
         self.race = None
         # a tab of #players races whishes, first is preferred one
         self.races_wishes = races_wishes
+        # storages of the resources
+        self.money = 0
+        self.science = 0
+        self.materials = 0
+        # influence discs on the influence track and on the action spaces
+        self.influence = 0
+        self.actions = 0
 
 GAME_PHASES = engine.util.enum(INIT=0, TURN=1, END=2)
 TURN_PHASES = engine.util.enum(ACTION=0, BATTLE=1, UPKEEP=2, CLEANUP=3)
-class GameState(object):
+class GameState(Slotted):
     """
     the state of the game, to be sent to the client with json:
      -players
@@ -45,6 +99,12 @@ class GameState(object):
      -extensions flags
      -researchs
     """
+    __slots__ = ('id_', 'game_phase', 'turn_phase', 'cur_turn', 'cur_actions',
+                 'players', 'players_order', 'num_players', 'cur_player',
+                 'hexes', 'ships', '_galaxy', '_reach', '_blockers',
+                 '_undo')
+    _defaults = {'cur_player': None, 'hexes': dict, 'ships': dict}
+
     def __init__(self, num_players):
         """ for now store only players, to be filled with the rest """
         self.id_ = -1
@@ -82,6 +142,15 @@ class GameState(object):
 
         self.num_players = num_players
 
+        # id of the player playing, None between the players turns
+        self.cur_player = None
+
+        # the hexes of the game, explored or not, by id
+        self.hexes = {}
+
+        # the ships of the players, built or not, by id
+        self.ships = {}
+
     def add_player(self, id_, name, races_wishes):
         """ players must be added after the state creation, when they manually
         join the game and enter their race wishes.
@@ -107,16 +176,177 @@ class GameState(object):
         """ send the state to the client to display it """
         pass
 
-    def is_action_valid(self, action):
-        """ check that an action sent from a player is a valid one """
-        pass
+    @property
+    def galaxy(self):
+        """ the Galaxy of the explored hexes, built when first used """
+        galaxy = getattr(self, '_galaxy', None)
+        if galaxy is None:
+            galaxy = Galaxy([hex_ for hex_ in self.hexes.values()
+                             if hex_.q is not None])
+            self._galaxy = galaxy
+            self._reach = Reachability(galaxy)
+        return galaxy
+
+    @property
+    def reachability(self):
+        """ the Reachability cache of the ships moves on the galaxy """
+        # built with the galaxy
+        self.galaxy
+        return self._reach
+
+    def blockers(self, player_id):
+        """ return: frozenset of the galaxy indexes of the hexes pinning the
+        ships of a player, the hexes with ships of other players
+        """
+        blockers = getattr(self, '_blockers', None)
+        if blockers is None:
+            blockers = self._blockers = {}
+        if player_id not in blockers:
+            galaxy = self.galaxy
+            blockers[player_id] = frozenset(
+                galaxy.index_of(ship.hex_id) for ship in self.ships.values()
+                if ship.hex_id is not None and ship.owner != player_id)
+        return blockers[player_id]
+
+    def move_ship(self, ship, hex_id):
+        """ put a ship in a hex, or back in its reserve when hex_id is None,
+        and update the caches of the ships moves
+        """
+        galaxy = self.galaxy
+        for moved in (ship.hex_id, hex_id):
+            index = None if moved is None else galaxy.index_of(moved)
+            if index is not None:
+                self._reach.ships_changed(index)
+        ship.hex_id = hex_id
+        self._blockers = None
+
+    def move_hex(self, hex_, pos):
+        """ put a hex on the galaxy, rotate it, or put it back in its stack.
+        args:
+         hex_ (Hex)
+         pos (q, r, rotation), None for the stack
+        """
+        galaxy = self.galaxy
+        index = galaxy.index_of(hex_.id_)
+        if index is None and pos is not None:
+            galaxy.place(hex_, *pos)
+        elif index is not None and pos is not None and pos[:2] == (hex_.q,
+                                                                   hex_.r):
+            galaxy.rotate(index, pos[2])
+        else:
+            # the galaxy doesn't remove nor move hexes, rebuilt when used
+            (hex_.q, hex_.r, hex_.rotation) = (None, None, None)
+            if pos is not None:
+                (hex_.q, hex_.r, hex_.rotation) = pos
+            self._galaxy = None
+            self._blockers = None
+
+    def is_action_valid(self, action, player_id):
+        """ check that an action sent from a player is a valid one, see
+        engine/rules.py
+        args:
+         action (Action)
+         player_id (int): the player making the action, during their turn
+        return: True if the action is valid
+        """
+        return engine.rules.Turn(self, player_id).add(action)
 
     def apply_action(self, action):
-        """ apply the action to the state """
-        pass
+        """ apply the action to the state, without checking it.
+        raise: ValueError for an unknown action
+        """
+        engine.rules.apply_action(self, action)
+
+    def apply_turn(self, actions, player_id):
+        """ check and apply the actions of a player turn, all or none of
+        them. the applied actions are added to cur_actions.
+        args:
+         actions [Action, ...]
+         player_id (int): the player playing, the actions are invalid when
+                          not the cur_player
+        return: (True, None) if the actions are applied,
+                (False, index of the first invalid action) otherwise
+        """
+        return self._apply(engine.rules.Turn(self, player_id), actions)
 
+    def apply_game_turn(self, actions):
+        """ same as apply_turn, for the actions made by the game itself
+        between the players turns, allowed to move the elements of every
+        player. not to be called with actions sent by a player.
+        """
+        return self._apply(engine.rules.Turn.of_game(self), actions)
+
+    def _apply(self, turn, actions):
+        """ check the actions with a Turn, then apply them """
+        for index, action in enumerate(actions):
+            if not turn.add(action):
+                return (False, index)
+        turn.commit()
+        self.cur_actions.extend(turn.actions)
+        self._keep_undo(turn)
+        return (True, None)
+
+    def _keep_undo(self, turn):
+        """ keep the actions of a player turn so that the player can undo
+        them until the end of the turn. the actions of the game, and the
+        ones ending the turn, can't be undone.
+        """
+        if turn.is_game or self.cur_player != turn.player_id:
+            self._undo = None
+            return
+        undo = getattr(self, '_undo', None)
+        if undo is None or undo[0] != turn.player_id:
+            # a new player turn
+            undo = self._undo = (turn.player_id, [])
+        undo[1].extend(turn.actions)
+
+    def _undo_stack(self, player_id):
+        """ return: [Action, ...] the actions of the current turn of a
+        player applied since the last clear_undo, empty if it's not the
+        player turn
+        """
+        undo = getattr(self, '_undo', None)
+        if (undo is None or undo[0] != player_id
+                or self.cur_player != player_id):
+            return []
+        return undo[1]
+
+    def undo(self, player_id, count=None):
+        """ undo the last actions of the current turn of a player, in
+        memory, by applying their inverses, and remove them from
+        cur_actions. only the actions applied by apply_turn since the last
+        clear_undo are undone.
+        args:
+         player_id (int): the player playing
+         count (int): number of actions to undo, None for all of them
+        return: (True, [Action, ...] the undone actions, the last one first)
+                (False, []) if the player has less actions to undo
+        """
+        stack = self._undo_stack(player_id)
+        if count is None:
+            count = len(stack)
+        if count > len(stack):
+            return (False, [])
+        undone = []
+        for _ in range(count):
+            action = stack.pop()
+            engine.rules.apply_action(self, action.inverse())
+            if len(self.cur_actions) != 0 and self.cur_actions[-1] is action:
+                self.cur_actions.pop()
+            undone.append(action)
+        return (True, undone)
+
+    def undo_size(self, player_id):
+        """ return: the number of actions a player can undo """
+        return len(self._undo_stack(player_id))
+
+    def clear_undo(self):
+        """ the actions applied so far can no longer be undone, called when
+        the state is saved
+        """
+        self._undo = None
 
-class Action(object):
+class Action(Slotted):
     """
     Everything a player does has to be a player action which is applied
     to a game state to generate a new state.
@@ -148,6 +378,9 @@ class Action(object):
     During a player/game turn, the state keeps track of the available
     science/material/money for the next actions.
 
+    The elements and zones of each kind of action, and their checks, are
+    in engine/rules.py.
+
     Example:
      player turn:
       -move influence token from influence track to action slot "buy"
@@ -177,16 +410,27 @@ class Action(object):
       -move round marker one step forward
       -end turn
     """
+    __slots__ = ('element', 'old_zone', 'new_zone')
 
     def __init__(self, element, old_zone, new_zone):
         self.element = element
         self.old_zone = old_zone
         self.new_zone = new_zone
 
+    def inverse(self):
+        """ return: the Action undoing this one, which moves the element
+        back to its old zone
+        """
+        return Action(self.element, self.new_zone, self.old_zone)
+
 # an hex has a number of planets, a number id, wormholes, an influence
 # token.
 # it can also be of a special type, like in the extension
-class Hex(object):
+class Hex(Slotted):
+    __slots__ = ('id_', 'influence', 'wormholes', 'planets', 'rotation', 'q',
+                 'r')
+    _defaults = {'q': None, 'r': None}
+
     def __init__(self, id_, wormholes, planets):
         self.id_ = id_
         self.influence = None
@@ -197,14 +441,23 @@ class Hex(object):
         # can be rotated when put in game
         self.rotation = None
 
+        # axial coordinates on the galaxy map, see engine/galaxy.py, None
+        # until the hex is explored
+        self.q = None
+        self.r = None
+
 # a planet 
-class Planet(object):
+class Planet(Slotted):
+    __slots__ = ('id_', 'slots')
+
     def __init__(self, id_, slots):
         self.id_ = id_
         self.slots = slots
 
 # a population slot
-class PopSlot(object):
+class PopSlot(Slotted):
+    __slots__ = ('id_', 'type_', 'star', 'pop_owner')
+
     def __init__(self, id_, type_, star):
         self.id_ = id_
         # type can be: money, science, material, grey
@@ -214,9 +467,18 @@ class PopSlot(object):
         # the player having a pop cube on the slot
         self.pop_owner = None
 
-class Ship(object):
-    def __init__(self, id_):
-        pass
+class Ship(Slotted):
+    """ a ship of a player, in its reserve until built """
+    __slots__ = ('id_', 'owner', 'type_', 'hex_id')
+
+    def __init__(self, id_, owner, type_):
+        self.id_ = id_
+        # the player id
+        self.owner = owner
+        # interceptor, cruiser, dreadnought or starbase
+        self.type_ = type_
+        # id of the hex of the ship, None in the reserve
+        self.hex_id = None
 
 class Research(object):
     def __init__(self, id_):
@@ -15,15 +15,25 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import functools
 import hashlib
+import json
 import logging
+import lzma
 import os.path
 import pickle
+import re
 import sqlite3
+import struct
 import sys
 import tempfile
+import threading
+import time
+import zlib
+import engine.db_stats
+import engine.serializer
 import engine.util
-from engine.web_types import WebPlayer, Timezones, Game
+from engine.web_types import WebPlayer, Timezones, Game, GameSummary
 
 # status returned by all db methods
 DB_STATUS = engine.util.enum(OK=0, ERROR=1, DUP_ERROR=2, NO_ROWS=3)
@@ -53,8 +63,240 @@ def fail(fun):
             return fun(*args, **kargs)
 
     # to display an usable name in the log decorator
-    failer.__name__ = fun.__name__
-    return failer
+    return functools.wraps(fun)(failer)
+
+# states blobs are made of a header followed by the compressed serialized
+# state:
+#  -magic (3 bytes)
+#  -format version (1 byte)
+#  -codec id (1 byte)
+#  -serializer id (1 byte), since format version 2
+#  -uncompressed size (4 bytes, big endian)
+# legacy blobs are raw pickles, they start with the pickle PROTO opcode.
+STATE_CODECS = engine.util.enum(NONE=0, ZLIB=1, LZMA=2)
+STATE_SERIALIZERS = engine.util.enum(PICKLE=0, BINARY=1)
+STATE_FORMAT_VERSION = 2
+DEFAULT_STATE_CODEC = STATE_CODECS.ZLIB
+DEFAULT_STATE_SERIALIZER = STATE_SERIALIZERS.PICKLE
+_STATE_MAGIC = b'ECS'
+# format version -> header
+_STATE_HEADERS = {1: struct.Struct('>3sBBI'),
+                  2: struct.Struct('>3sBBBI')}
+
+_COMPRESS = {STATE_CODECS.NONE: lambda data: data,
+             STATE_CODECS.ZLIB: zlib.compress,
+             STATE_CODECS.LZMA: lzma.compress}
+_DECOMPRESS = {STATE_CODECS.NONE: lambda data: data,
+               STATE_CODECS.ZLIB: zlib.decompress,
+               STATE_CODECS.LZMA: lzma.decompress}
+_SERIALIZE = {STATE_SERIALIZERS.PICKLE: lambda state: pickle.dumps(
+                  state, pickle.HIGHEST_PROTOCOL),
+              STATE_SERIALIZERS.BINARY: engine.serializer.encode}
+_DESERIALIZE = {STATE_SERIALIZERS.PICKLE: pickle.loads,
+                STATE_SERIALIZERS.BINARY: engine.serializer.decode}
+
+def encode_state(state, codec=DEFAULT_STATE_CODEC,
+                 serializer=DEFAULT_STATE_SERIALIZER):
+    """ serialize a state to be stored in the db.
+    args:
+     state (GameState object)
+     codec (STATE_CODECS)
+     serializer (STATE_SERIALIZERS)
+    return: blob (bytes)
+    """
+    data = _SERIALIZE[serializer](state)
+    header = _STATE_HEADERS[STATE_FORMAT_VERSION].pack(
+        _STATE_MAGIC, STATE_FORMAT_VERSION, codec, serializer, len(data))
+    return header + _COMPRESS[codec](data)
+
+def decode_state(blob):
+    """ deserialize a state stored in the db, legacy raw pickle or
+    encode_state blob.
+    args: blob (bytes)
+    return: GameState object
+    raise: ValueError if the blob format is unknown or corrupted
+    """
+    if not is_encoded_state(blob):
+        return pickle.loads(blob)
+
+    version = blob[len(_STATE_MAGIC)]
+    if version not in _STATE_HEADERS:
+        raise ValueError('Unknown state format {}'.format(version))
+    header = _STATE_HEADERS[version]
+    if version == 1:
+        (_, _, codec, size) = header.unpack_from(blob)
+        serializer = STATE_SERIALIZERS.PICKLE
+    else:
+        (_, _, codec, serializer, size) = header.unpack_from(blob)
+    if codec not in _DECOMPRESS or serializer not in _DESERIALIZE:
+        raise ValueError(('Unknown state codec {} serializer {}'
+                          '').format(codec, serializer))
+    try:
+        data = _DECOMPRESS[codec](memoryview(blob)[header.size:])
+    except (zlib.error, lzma.LZMAError) as err:
+        raise ValueError('Corrupted state: {}'.format(err))
+    if len(data) != size:
+        raise ValueError(('Corrupted state, size {} instead of {}'
+                          '').format(len(data), size))
+    return _DESERIALIZE[serializer](data)
+
+def is_encoded_state(blob):
+    """ return: True if the blob has been written by encode_state, False
+    for a legacy raw pickle """
+    return blob[:len(_STATE_MAGIC)] == _STATE_MAGIC
+
+# memory used by a decoded state for one byte of its serialized form. the
+# compressed blob is 8 to 30 times smaller than the state in memory, the
+# serialized data before compression 3.5 to 5 times (pickle) and 4.5 to 7
+# times (binary) smaller, measured with sys.getsizeof over the objects of
+# states of 2 to 6 players with up to 400 actions
+STATE_MEMORY_RATIOS = {STATE_SERIALIZERS.PICKLE: 5,
+                       STATE_SERIALIZERS.BINARY: 7}
+
+def state_memory_size(blob):
+    """ approximate the memory used by the state of a blob, from the size
+    of its serialized data, without decoding it.
+    args: blob (bytes): written by encode_state, or a legacy raw pickle
+    return: size in bytes (int)
+    """
+    if not is_encoded_state(blob):
+        return len(blob) * STATE_MEMORY_RATIOS[STATE_SERIALIZERS.PICKLE]
+    version = blob[len(_STATE_MAGIC)]
+    header = _STATE_HEADERS.get(version)
+    if header is None or len(blob) < header.size:
+        return len(blob) * STATE_MEMORY_RATIOS[STATE_SERIALIZERS.PICKLE]
+    if version == 1:
+        (_, _, _, size) = header.unpack_from(blob)
+        serializer = STATE_SERIALIZERS.PICKLE
+    else:
+        (_, _, _, serializer, size) = header.unpack_from(blob)
+    return size * STATE_MEMORY_RATIOS.get(
+        serializer, STATE_MEMORY_RATIOS[STATE_SERIALIZERS.PICKLE])
+
+# default number of states between two snapshots: 1 snapshots every state.
+# the other states are rebuilt by replaying the actions log on the nearest
+# snapshot, so a state must only be modified by applying actions.
+DEFAULT_SNAPSHOT_EVERY = 1
+
+def _replay(state, state_id, actions):
+    """ apply actions from the actions log on a state.
+    args:
+     state (GameState object): the snapshot to start from
+     state_id (int): the state to rebuild, its actions are its cur_actions
+     actions [(state_id (int), pickled action), ...] ordered by seq
+    return: the rebuilt GameState object
+    """
+    cur_actions = []
+    for action_state_id, pic_action in actions:
+        action = pickle.loads(pic_action)
+        state.apply_action(action)
+        if action_state_id == state_id:
+            cur_actions.append(action)
+    state.cur_actions = cur_actions
+    return state
+
+# directory of the schema migration scripts, relative to engine/.
+# scripts are named NNNN_description.sql, NNNN being the schema version
+# reached after the script execution.
+_MIGRATIONS_DIR = 'migrations'
+
+def _list_migrations():
+    """ return: [(version (int), script name (str)), ...] ordered by version """
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    migrations = []
+    for name in os.listdir(os.path.join(cwd, _MIGRATIONS_DIR)):
+        version, _, _ = name.partition('_')
+        if name.endswith('.sql') and version.isdigit():
+            migrations.append((int(version), name))
+    return sorted(migrations)
+
+# the test databases are clones of a template database built from db.sql
+# and test_db.sql. the template is cached on disk, keyed by the hash of the
+# scripts, and shared by the processes running the tests.
+TEST_TEMPLATE_DIR = os.path.join(tempfile.gettempdir(), 'eclipsebb-tests')
+_test_template_lock = threading.Lock()
+_test_template_path = None
+
+def _test_template():
+    """ return the template test database, build it if the scripts
+    changed. the template is written in a temporary file then renamed, so
+    that concurrent processes never see a partial template.
+    return: path of the template (str)
+    raise: OSError, sqlite3.Error
+    """
+    global _test_template_path
+    with _test_template_lock:
+        if (_test_template_path is not None
+                and os.path.exists(_test_template_path)):
+            return _test_template_path
+
+        cwd = os.path.dirname(os.path.abspath(__file__))
+        scripts = []
+        for name in ('db.sql', 'test_db.sql'):
+            with open(os.path.join(cwd, name), 'r') as script:
+                scripts.append(script.read())
+        migrations = _list_migrations()
+        version = migrations[-1][0] if len(migrations) != 0 else 0
+        digest = hashlib.sha1('\0'.join(scripts + [str(version)])
+                              .encode('utf-8')).hexdigest()
+        path = os.path.join(TEST_TEMPLATE_DIR,
+                            'test-{}.db'.format(digest[:16]))
+
+        if not os.path.exists(path):
+            os.makedirs(TEST_TEMPLATE_DIR, exist_ok=True)
+            (fd, tmp_path) = tempfile.mkstemp(suffix='.tmp',
+                                              dir=TEST_TEMPLATE_DIR)
+            os.close(fd)
+            try:
+                conn = sqlite3.connect(tmp_path)
+                try:
+                    # a schema created from db.sql is at the last version
+                    conn.executescript(scripts[0])
+                    conn.execute('PRAGMA user_version = {};'.format(version))
+                    conn.executescript(scripts[1])
+                    conn.commit()
+                finally:
+                    conn.close()
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+
+        _test_template_path = path
+        return path
+
+# columns of the games lists, in the GameSummary constructor order.
+# players and extensions are aggregated as json to list the games in
+# a single query.
+_SQL_SUMMARY = ('SELECT g.id, g.name, g.level, g.private, g.started, '
+                ' g.start_date, g.last_play, g.num_players, g.creator_id, '
+                ' g.cur_turn, '
+                ' (SELECT IFNULL(MAX(s.id), -1) '
+                '  FROM state s '
+                '  WHERE s.game_id = g.id), '
+                ' (SELECT json_group_array(json_array(p.id, p.name, '
+                '                                     p.timezone)) '
+                '  FROM (SELECT p.id, p.name, p.timezone '
+                '        FROM games_players gp2, players p '
+                '        WHERE gp2.player_id = p.id '
+                '         AND gp2.game_id = g.id '
+                '        ORDER BY gp2.rowid) p), '
+                ' (SELECT json_group_object(e.id, e.name) '
+                '  FROM games_extensions ge, extensions e '
+                '  WHERE ge.extension_id = e.id '
+                '   AND ge.game_id = g.id) ')
+
+# sqlite limits the number of variables in a query
+_MAX_VARIABLES = 500
+
+def _chunks(ids):
+    """ split a list of ids in lists small enough to be used as query vars """
+    for i in range(0, len(ids), _MAX_VARIABLES):
+        yield ids[i:i + _MAX_VARIABLES]
+
+def _placeholders(ids):
+    """ return the '?, ?, ..., ?' string for an IN clause """
+    return ', '.join('?' * len(ids))
 
 class MockDB(object):
     """ mock db object which raises sqlite3.DatabaseError """
@@ -70,6 +312,339 @@ class MockDB(object):
         """ for the finally close """
         pass
 
+# default number of connections kept opened by the pool
+DEFAULT_POOL_SIZE = 8
+# seconds to wait for a free connection when the pool is exhausted
+DEFAULT_POOL_TIMEOUT = 10.0
+# idle connections older than that (in seconds) are checked before reuse
+DEFAULT_CHECK_INTERVAL = 60.0
+
+# storage profile, pragmas applied to each new connection:
+#  -WAL journal: the readers don't block the writer and vice versa
+#  -synchronous NORMAL: safe with WAL, a commit doesn't fsync
+#  -cache_size in KiB when negative
+#  -busy_timeout in ms, wait for the locks instead of failing at once
+# and the WAL checkpoint policy:
+#  -wal_autocheckpoint: a commit checkpoints the WAL beyond that many pages
+#  -journal_size_limit: the WAL file is truncated to that many bytes after
+#   a checkpoint
+DEFAULT_PRAGMAS = {'journal_mode': 'wal',
+                   'synchronous': 'normal',
+                   'cache_size': -16384,
+                   'mmap_size': 64 * 1024 * 1024,
+                   'temp_store': 'memory',
+                   'busy_timeout': 5000,
+                   'wal_autocheckpoint': 1000,
+                   'journal_size_limit': 64 * 1024 * 1024}
+# the automatic checkpoints can't complete while readers use the WAL, so
+# every checkpoint_interval seconds (None to disable) a connection released
+# to the pool runs a checkpoint, waiting for the readers up to busy_timeout
+DEFAULT_CHECKPOINT_INTERVAL = 300.0
+DEFAULT_CHECKPOINT_MODE = 'TRUNCATE'
+_PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+_PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+def _pragmas(pragmas):
+    """ merge pragmas with the default ones, check that they can be put
+    in a PRAGMA statement.
+    args: pragmas {name (str): value (str or int)}, None for the defaults
+    return: {name: value}
+    raise: ValueError for an invalid name or value
+    """
+    merged = dict(DEFAULT_PRAGMAS)
+    merged.update(pragmas or {})
+    for name, value in merged.items():
+        if (not _PRAGMA_NAME.match(name)
+                or not _PRAGMA_VALUE.match(str(value))):
+            raise ValueError('Invalid pragma {} = {}'.format(name, value))
+    return merged
+
+class ConnectionPool(object):
+    """
+    Keep long-lived sqlite3 connections to the database file and lend them
+    to the threads calling the DBInterface methods.
+
+    A thread gets back the connection it used last time if it is idle, so
+    each waitress worker ends up with its own connection. At most max_size
+    connections are opened, when all of them are lent the caller waits up
+    to timeout seconds for one to be released.
+
+    Acquiring is reentrant: a thread which already holds a connection gets
+    the same one back.
+
+    Connections idle for more than check_interval seconds are checked with a
+    trivial query before being lent, and replaced by a new connection if
+    the check fails.
+
+    The pragmas are applied to each new connection, and the WAL is
+    checkpointed every checkpoint_interval seconds, see DEFAULT_PRAGMAS.
+
+    The connections time their statements, the slow ones are recorded in
+    query_stats (DBStats), see engine.db_stats.
+
+    attributes:
+      self._idle (dict): idle connections -> time of their release
+      self._size (int): number of opened connections
+      self._local (threading.local): connection held by the current thread
+                                     and reentrancy depth, and the last
+                                     connection it used, forgotten with the
+                                     thread
+    """
+    def __init__(self, db_path, max_size=DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_POOL_TIMEOUT,
+                 check_interval=DEFAULT_CHECK_INTERVAL, pragmas=None,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 checkpoint_mode=DEFAULT_CHECKPOINT_MODE, query_stats=None):
+        self._logger = logging.getLogger('ecbb.db')
+        self._db_path = db_path
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.pragmas = _pragmas(pragmas)
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_mode = checkpoint_mode
+        self.query_stats = query_stats
+        self._last_checkpoint = time.monotonic()
+        self._checkpoint_lock = threading.Lock()
+
+        self._cond = threading.Condition()
+        self._idle = {}
+        self._size = 0
+        self._closed = False
+        self._local = threading.local()
+
+    def _new_connection(self):
+        """ the detect_types param of the connect method allow us to store
+        python types directly in the database.
+        connections are shared between threads, but only one thread at a time
+        can use a connection.
+        """
+        conn = sqlite3.connect(self._db_path,
+                               detect_types=sqlite3.PARSE_DECLTYPES,
+                               check_same_thread=False,
+                               factory=engine.db_stats.InstrumentedConnection)
+        conn.stats = self.query_stats
+        try:
+            for name, value in self.pragmas.items():
+                conn.execute('PRAGMA {} = {};'.format(name, value)).fetchall()
+        except sqlite3.Error:
+            self._close_quietly(conn)
+            raise
+        return conn
+
+    def _is_healthy(self, conn):
+        """ run a trivial query on the connection
+        args: conn (sqlite3 connection)
+        return: True if the connection is usable
+        """
+        try:
+            conn.execute('SELECT 1;').fetchone()
+        except sqlite3.Error:
+            return False
+        else:
+            return True
+
+    def _take(self):
+        """ remove a connection from the idle ones, or reserve a slot for a
+        new one. must be called with self._cond acquired.
+        return: (conn, last release time), (None, None) if a new connection
+                has to be created, raise IndexError if the pool is exhausted
+        """
+        conn = getattr(self._local, 'last', None)
+        if conn is not None and conn in self._idle:
+            return (conn, self._idle.pop(conn))
+        if self._size < self.max_size:
+            self._size += 1
+            return (None, None)
+        if len(self._idle) != 0:
+            # steal the connection idle for the longest time
+            conn = min(self._idle, key=self._idle.get)
+            return (conn, self._idle.pop(conn))
+        raise IndexError
+
+    def acquire(self):
+        """ lend a connection to the current thread.
+        raise sqlite3.OperationalError if no connection is available
+        after self.timeout seconds.
+        return: sqlite3 connection
+        """
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            return held
+
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.OperationalError('Connection pool closed')
+                try:
+                    (conn, released) = self._take()
+                except IndexError:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise sqlite3.OperationalError(('No database '
+                                                        'connection '
+                                                        'available'))
+                    self._cond.wait(remaining)
+                else:
+                    break
+
+        try:
+            if conn is None:
+                conn = self._new_connection()
+            elif (time.monotonic() - released > self.check_interval
+                  and not self._is_healthy(conn)):
+                self._logger.warning('Reconnecting broken db connection')
+                self._close_quietly(conn)
+                conn = self._new_connection()
+        except sqlite3.Error:
+            # give the slot back
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        self._local.last = conn
+        self._local.conn = conn
+        self._local.depth = 1
+        engine.db_stats.add_acquire(time.monotonic() - start)
+        return conn
+
+    def release(self, conn):
+        """ give back a connection lent by acquire.
+        any transaction left opened (error before commit) is rolled back, as
+        closing the connection would have done.
+        args: conn (sqlite3 connection)
+        """
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.depth -= 1
+            if self._local.depth > 0:
+                return
+            self._local.conn = None
+
+        discard = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            discard = True
+        else:
+            self._periodic_checkpoint(conn)
+
+        with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+                self._close_quietly(conn)
+                if getattr(self._local, 'last', None) is conn:
+                    self._local.last = None
+            else:
+                self._idle[conn] = time.monotonic()
+            self._cond.notify()
+
+    def checkpoint(self, conn, mode=None):
+        """ checkpoint the WAL.
+        args:
+         conn (sqlite3 connection or cursor): not in a transaction
+         mode (str): PASSIVE, FULL, RESTART or TRUNCATE, default to
+                     self.checkpoint_mode
+        return: (busy (int), WAL pages, checkpointed pages), see the
+                sqlite wal_checkpoint pragma
+        """
+        mode = (mode or self.checkpoint_mode).upper()
+        if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+            raise ValueError('Invalid checkpoint mode {}'.format(mode))
+        result = conn.execute(('PRAGMA wal_checkpoint({});'
+                               '').format(mode)).fetchone()
+        self._last_checkpoint = time.monotonic()
+        if result[0] != 0:
+            self._logger.warning(('WAL checkpoint {} incomplete, {} pages '
+                                  'of {} checkpointed').format(mode,
+                                                               result[2],
+                                                               result[1]))
+        else:
+            self._logger.debug(('WAL checkpoint {} done, {} pages'
+                                '').format(mode, result[2]))
+        return tuple(result)
+
+    def _periodic_checkpoint(self, conn):
+        """ checkpoint the WAL with the released connection if the last
+        checkpoint is older than checkpoint_interval. only one thread at a
+        time runs it, the other ones don't wait.
+        args: conn (sqlite3 connection)
+        """
+        if (self.checkpoint_interval is None
+                or time.monotonic() - self._last_checkpoint
+                < self.checkpoint_interval
+                or not self._checkpoint_lock.acquire(blocking=False)):
+            return
+        try:
+            self.checkpoint(conn)
+        except sqlite3.Error:
+            self._logger.exception('Error while checkpointing the WAL')
+        finally:
+            self._checkpoint_lock.release()
+
+    def check(self):
+        """ check all the idle connections, reconnect the broken ones.
+        return: number of connections replaced
+        """
+        with self._cond:
+            idle = list(self._idle.items())
+            self._idle.clear()
+
+        replaced = 0
+        checked = {}
+        for conn, released in idle:
+            if not self._is_healthy(conn):
+                self._close_quietly(conn)
+                try:
+                    conn = self._new_connection()
+                except sqlite3.Error:
+                    self._logger.exception('Error reconnecting to database')
+                    with self._cond:
+                        self._size -= 1
+                    continue
+                replaced += 1
+            checked[conn] = released
+
+        with self._cond:
+            self._idle.update(checked)
+            self._cond.notify_all()
+
+        if replaced != 0:
+            self._logger.warning(('Replaced {} broken db connections'
+                                  '').format(replaced))
+        return replaced
+
+    def stats(self):
+        """ return: {'size': opened connections, 'idle': idle connections,
+                     'max_size': pool capacity}
+        """
+        with self._cond:
+            return {'size': self._size,
+                    'idle': len(self._idle),
+                    'max_size': self.max_size}
+
+    def close(self):
+        """ close the idle connections, lent ones are closed on release """
+        with self._cond:
+            self._closed = True
+            for conn in self._idle:
+                self._size -= 1
+                self._close_quietly(conn)
+            self._idle.clear()
+            self._cond.notify_all()
+
+    @staticmethod
+    def _close_quietly(conn):
+        """ close a connection, ignore errors as it may be already broken """
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
 class DBInterface(object):
     """
     Handles the connections to the database
@@ -88,10 +663,41 @@ class DBInterface(object):
     calling the db module in case of a db error.
 
     For tests, use a temporary database filled with test data.
+
+    The connections to the database are kept opened in a ConnectionPool,
+    pool_size is the maximum number of connections opened at the same time.
+
+    Only one state every snapshot_every states is fully stored, the other
+    ones are rebuilt from the actions log. The states are serialized with
+    state_serializer and compressed with state_codec, see encode_state.
+
+    db_path overrides the default database file, outside of test mode.
+
+    pragmas overrides some of the DEFAULT_PRAGMAS storage profile applied to
+    each connection, the WAL is checkpointed every checkpoint_interval
+    seconds.
+
+    The calls of the methods are timed in a DBStats, see query_stats, the
+    statements slower than slow_query_threshold seconds are kept with their
+    query plan.
     """
-    def __init__(self, test_mode=False):
-        """ if the .db file doesn't exist create all the tables in the db """
+    def __init__(self, test_mode=False, pool_size=DEFAULT_POOL_SIZE,
+                 snapshot_every=DEFAULT_SNAPSHOT_EVERY,
+                 state_codec=DEFAULT_STATE_CODEC,
+                 state_serializer=DEFAULT_STATE_SERIALIZER, db_path=None,
+                 pragmas=None,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 slow_query_threshold=engine.db_stats.DEFAULT_SLOW_QUERY_THRESHOLD,
+                 test_template=True):
+        """ if the .db file doesn't exist create all the tables in the db.
+        in test mode, with test_template the test db is cloned from the
+        template test database instead of being built from the scripts.
+        """
         self._logger = logging.getLogger('ecbb.db')
+        self._stats = engine.db_stats.DBStats(slow_query_threshold)
+        self._snapshot_every = max(1, snapshot_every)
+        self._state_codec = state_codec
+        self._state_serializer = state_serializer
 
         # for db unittest, to mock the db sqlite3 object
         self._unittest = False
@@ -103,10 +709,40 @@ class DBInterface(object):
             self._db_tmp_file = tempfile.NamedTemporaryFile()
             self._db_path = self._db_tmp_file.name
         else:
-            db_file_name = '~/.local/share/eclipsebb/eclipse.db'
-            self._db_path = os.path.expanduser(db_file_name)
+            if db_path is None:
+                db_path = '~/.local/share/eclipsebb/eclipse.db'
+            self._db_path = os.path.expanduser(db_path)
 
-        if not os.path.exists(self._db_path) or test_mode:
+        # check existence before the pool creates the file
+        db_exists = os.path.exists(self._db_path)
+        self._pool = ConnectionPool(self._db_path, pool_size,
+                                    pragmas=pragmas,
+                                    checkpoint_interval=checkpoint_interval,
+                                    query_stats=self._stats)
+
+        if test_mode and test_template and self._clone_test_template():
+            self._logger.info('Test database cloned from the template.')
+        else:
+            self._create_schema(test_mode, db_exists)
+
+        self._logger.info('Storage profile: {}'.format(
+            ', '.join('{}={}'.format(name, value)
+                      for name, value in self.storage_profile().items())))
+
+    def __del__(self):
+        if hasattr(self, '_pool'):
+            self._pool.close()
+        if hasattr(self, '_db_tmp_file'):
+            self._db_tmp_file.close()
+
+    def _create_schema(self, test_mode, db_exists):
+        """ create the schema if the db is new, bring it up to date, and
+        populate it in test mode. quit on error.
+        args:
+         test_mode (bool)
+         db_exists (bool): the db file existed before the connection
+        """
+        if not db_exists or test_mode:
             self._logger.info('Creating database schema...')
 
             # schema declaration is stored in db.sql
@@ -117,20 +753,44 @@ class DBInterface(object):
         else:
             self._logger.info('Database schema already created.')
 
+        if not self._migrate(created=not db_exists or test_mode):
+            sys.exit()
+
         if test_mode:
             # add tests data
             self._logger.info('Populating test database.')
             if not self._exec_script('test_db.sql'):
                 sys.exit()
 
-    def __del__(self):
-        if hasattr(self, '_db_tmp_file'):
-            self._db_tmp_file.close()
+    def _clone_test_template(self):
+        """ copy the template test database in the db file with the
+        sqlite3 backup API, see _test_template.
+        return:
+         OK: True
+         ERROR: False
+        """
+        try:
+            template = sqlite3.connect(_test_template())
+            try:
+                db = sqlite3.connect(self._db_path)
+                try:
+                    template.backup(db)
+                finally:
+                    db.close()
+            finally:
+                template.close()
+        except (OSError, sqlite3.Error):
+            self._logger.exception('Error cloning the template test database')
+            return False
+        return True
 
-    def _exec_script(self, name):
+    def _exec_script(self, name, version=None):
         """ execute the sql script located in the eclipsebb/engine directory.
         do not catch exceptions.
-        args: name (str) basename of the script
+        args:
+          name (str) basename of the script
+          version (int): for migration scripts, execute the script in a
+                         transaction which also sets the schema version
         return:
          OK: True
          ERROR: False
@@ -143,6 +803,10 @@ class DBInterface(object):
             self._logger.exception(msg)
             return False
 
+        if version is not None:
+            sql = ('BEGIN;\n{}\nPRAGMA user_version = {};\n'
+                   'COMMIT;').format(sql, version)
+
         self._logger.info('Executing SQL script {} in {}'.format(name, cwd))
 
         try:
@@ -159,11 +823,50 @@ class DBInterface(object):
             return True
         finally:
             if 'db' in locals():
-                db.close()
+                self._release(db)
         
+    def _migrate(self, created):
+        """ bring the database schema up to date, execute in order the
+        scripts of engine/migrations/ more recent than the schema version
+        stored in the sqlite user_version.
+        a schema just created from db.sql is already up to date.
+        args: created (bool): True if the schema has just been created
+        return:
+         OK: True
+         ERROR: False
+        """
+        migrations = _list_migrations()
+        last_version = migrations[-1][0] if len(migrations) != 0 else 0
+
+        try:
+            db = self._connect()
+            cursor = db.cursor()
+            if created:
+                cursor.execute('PRAGMA user_version = {};'.format(last_version))
+            cursor.execute('PRAGMA user_version;')
+            version = cursor.fetchone()[0]
+        except sqlite3.DatabaseError:
+            self._logger.exception('Error reading database schema version')
+            return False
+        finally:
+            if 'cursor' in locals():
+                cursor.close()
+            if 'db' in locals():
+                self._release(db)
+
+        for mig_version, name in migrations:
+            if mig_version <= version:
+                continue
+            self._logger.info(('Migrating database schema to version {}'
+                               '').format(mig_version))
+            if not self._exec_script(os.path.join(_MIGRATIONS_DIR, name),
+                                     mig_version):
+                return False
+
+        return True
+
     def _connect(self):
-        """ the detect_types param of the connect method allow us to store
-        python types directly in the database.
+        """ get a connection from the pool, must be given back with _release.
         For unittests return a mock db which raises exceptions
         args: None
         return: sqlite3 db object
@@ -171,8 +874,16 @@ class DBInterface(object):
         if self._unittest:
             return MockDB()
         else:
-            return sqlite3.connect(self._db_path,
-                                   detect_types=sqlite3.PARSE_DECLTYPES)
+            return self._pool.acquire()
+
+    def _release(self, db):
+        """ give back to the pool a connection returned by _connect
+        args: db (sqlite3 db object)
+        """
+        if isinstance(db, MockDB):
+            db.close()
+        else:
+            self._pool.release(db)
 
     def _get_pass_hash(self, id_, password):
         """ generate the sha1 hash of the salted password.
@@ -190,8 +901,62 @@ class DBInterface(object):
         """
         self._unittest = unittest
 
+    def check_connections(self):
+        """ check the idle pooled connections, reopen the broken ones.
+        args: None
+        return: number of reopened connections (int)
+        """
+        return self._pool.check()
+
+    def pool_stats(self):
+        """ return: {'size': opened connections, 'idle': idle connections,
+                     'max_size': pool capacity}
+        """
+        return self._pool.stats()
+
+    def query_stats(self):
+        """ return: DBStats, the statistics of the calls of the methods """
+        return self._stats
+
+    def storage_profile(self):
+        """ read back the pragmas of the storage profile, sqlite ignores
+        the unsupported ones.
+        return: {name (str): value of the pragma}
+        """
+        db = self._pool.acquire()
+        try:
+            return {name: db.execute('PRAGMA {};'.format(name)).fetchone()[0]
+                    for name in self._pool.pragmas}
+        finally:
+            self._pool.release(db)
+
+    @engine.util.log
+    @fail
+    @engine.db_stats.timed
+    def checkpoint(self, mode=None):
+        """ checkpoint the WAL now, see ConnectionPool.checkpoint.
+        args: mode (str): PASSIVE, FULL, RESTART or TRUNCATE
+        return: db_status,
+                (busy, WAL pages, checkpointed pages), None if error
+        """
+        try:
+            db = self._connect()
+            cursor = db.cursor()
+            result = self._pool.checkpoint(cursor, mode)
+        except sqlite3.DatabaseError:
+            self._logger.exception('Error while checkpointing the WAL')
+            return (DB_STATUS.ERROR, None)
+        else:
+            return (DB_STATUS.OK, result)
+        finally:
+            if 'cursor' in locals():
+                cursor.close()
+            if 'db' in locals():
+                self._release(db)
+
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def create_game(self, game, players_ids):
         """ create a game in the db, the rowid is the game id.
         store the players who joined the game, the selected extensions.
@@ -247,31 +1012,28 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def save_game(self, game):
         """ update the content of the game row.
         args: complete game object
         return: db_status, None
         """
-        sql = ('UPDATE games '
-               'SET started=?, ended=?, last_play=? '
-               'WHERE id = ?;')
         try:
             db = self._connect()
             cursor = db.cursor()
 
-            cursor.execute(sql, (game.started, game.ended,
-                                 game.last_play, game.id_))
+            updated = self._update_game(cursor, self._game_row(game))
             db.commit()
         except sqlite3.DatabaseError:
             msg = 'Error saving game {!r} (id{})'.format(game.name, game.id_)
             self._logger.exception(msg)
             return (DB_STATUS.ERROR, None)
         else:
-            if cursor.rowcount == 0:
+            if updated == 0:
                 msg = 'No rows updated for game {}'.format(game.id_)
                 self._logger.warning(msg)
                 return (DB_STATUS.NO_ROWS, None)
@@ -283,10 +1045,11 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def load_game(self, game_id):
         """ load a game from the db
         args: game_id (int)
@@ -299,9 +1062,9 @@ class DBInterface(object):
                'WHERE id = ?;')
         try:
             db = self._connect()
-            # to have access to returned row as a dict
-            db.row_factory = sqlite3.Row
             cursor = db.cursor()
+            # to have access to returned row as a dict
+            cursor.row_factory = sqlite3.Row
             cursor.execute(sql, (game_id, ))
         except sqlite3.DatabaseError:
             msg = 'Error while loading game with id {}'.format(game_id)
@@ -322,10 +1085,11 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def get_game_players_ids(self, game_id):
         """ return a list of players ids registered with the game
         args: game_id (int)
@@ -352,10 +1116,11 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def get_game_ext(self, game_id):
         """ return the activated extensions for the given game
         args: game_id (int)
@@ -383,10 +1148,11 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def get_game_states_ids(self, game_id):
         """ return the list of the game's states ids
         args: game_id (int)
@@ -414,10 +1180,233 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
+
+    @engine.util.log
+    @fail
+    @engine.db_stats.timed
+    def load_games_bulk(self, games_ids):
+        """ fully load many games at once: game row, players ids, extensions,
+        states ids and current state.
+        use one query per kind of data for all the games, all of them in
+        the same transaction.
+        args: games_ids [game_id_1 (int), ..., game_id_n (int)]
+        return: db_status,
+                {game_id (int): Game object}, games not found are missing.
+                cur_state is None if the game has no state.
+        """
+        sql_games = ('SELECT * '
+                     'FROM games '
+                     'WHERE id IN ({});')
+        sql_players = ('SELECT game_id, player_id '
+                       'FROM games_players '
+                       'WHERE game_id IN ({}) '
+                       'ORDER BY rowid;')
+        sql_ext = ('SELECT g.game_id, g.extension_id, e.name '
+                   'FROM games_extensions g, extensions e '
+                   'WHERE g.extension_id = e.id '
+                   ' AND g.game_id IN ({});')
+        sql_states = ('SELECT game_id, id '
+                      'FROM state '
+                      'WHERE game_id IN ({}) '
+                      'ORDER BY id;')
+        sql_cur_state = ('SELECT game_id, id, pickle '
+                         'FROM state '
+                         'WHERE id IN (SELECT MAX(id) '
+                         '             FROM state '
+                         '             WHERE game_id IN ({}) '
+                         '             GROUP BY game_id);')
+        # for the current states which are not snapshots
+        sql_snapshot = ('SELECT game_id, MAX(id), pickle '
+                        'FROM state '
+                        'WHERE game_id IN ({}) '
+                        ' AND pickle IS NOT NULL '
+                        'GROUP BY game_id;')
+        sql_actions = ('SELECT a.game_id, a.state_id, a.pickle '
+                       'FROM actions a '
+                       'WHERE a.game_id IN ({}) '
+                       ' AND a.state_id > (SELECT MAX(s.id) '
+                       '                   FROM state s '
+                       '                   WHERE s.game_id = a.game_id '
+                       '                    AND s.pickle IS NOT NULL) '
+                       'ORDER BY a.game_id, a.seq;')
+        games_ids = list(set(games_ids))
+        games = {}
+        try:
+            db = self._connect()
+            cursor = db.cursor()
+            # same snapshot of the db for all the queries
+            cursor.execute('BEGIN;')
+            for chunk in _chunks(games_ids):
+                params = _placeholders(chunk)
+
+                cursor.row_factory = sqlite3.Row
+                cursor.execute(sql_games.format(params), chunk)
+                for row in cursor.fetchall():
+                    game = Game.from_db(**row)
+                    games[game.id_] = game
+                cursor.row_factory = None
+
+                cursor.execute(sql_players.format(params), chunk)
+                for game_id, player_id in cursor.fetchall():
+                    games[game_id].players_ids.append(player_id)
+
+                cursor.execute(sql_ext.format(params), chunk)
+                for game_id, ext_id, ext_name in cursor.fetchall():
+                    games[game_id].extensions[ext_id] = ext_name
+
+                cursor.execute(sql_states.format(params), chunk)
+                for game_id, state_id in cursor.fetchall():
+                    games[game_id].states_ids.append(state_id)
+
+                cursor.execute(sql_cur_state.format(params), chunk)
+                to_replay = {}
+                for game_id, state_id, pic_state in cursor.fetchall():
+                    if pic_state is None:
+                        to_replay[game_id] = state_id
+                    else:
+                        games[game_id].cur_state = decode_state(pic_state)
+                        games[game_id].state_bytes = state_memory_size(
+                            pic_state)
+                        self._stats.record_state_size(len(pic_state))
+                if len(to_replay) != 0:
+                    self._replay_bulk(cursor, games, to_replay,
+                                      sql_snapshot, sql_actions)
+            db.commit()
+        except (sqlite3.DatabaseError, ValueError):
+            msg = 'Error while bulk loading games {}'.format(games_ids)
+            self._logger.exception(msg)
+            return (DB_STATUS.ERROR, None)
+        else:
+            msg = 'Success bulk loaded games {}'.format(sorted(games))
+            self._logger.info(msg)
+            return (DB_STATUS.OK, games)
+        finally:
+            if 'cursor' in locals():
+                cursor.close()
+            if 'db' in locals():
+                self._release(db)
+
+    def _replay_bulk(self, cursor, games, to_replay, sql_snapshot,
+                     sql_actions):
+        """ rebuild the current states of many games from their last
+        snapshot and the actions played since.
+        args:
+         cursor (sqlite3 cursor)
+         games {game_id (int): Game object}: games to update
+         to_replay {game_id (int): current state_id (int)}
+         sql_snapshot, sql_actions (str): queries from load_games_bulk
+        """
+        games_ids = list(to_replay)
+        params = _placeholders(games_ids)
+        cursor.execute(sql_snapshot.format(params), games_ids)
+        snapshots = {game_id: pic_state
+                     for game_id, _, pic_state in cursor.fetchall()}
+        if len(snapshots) != len(games_ids):
+            raise sqlite3.DatabaseError(('No snapshot found for some of the '
+                                         'games {}').format(games_ids))
+
+        actions = {game_id: [] for game_id in games_ids}
+        cursor.execute(sql_actions.format(params), games_ids)
+        for game_id, state_id, pic_action in cursor.fetchall():
+            actions[game_id].append((state_id, pic_action))
+
+        for game_id, state_id in to_replay.items():
+            # the actions played since the snapshot are not counted
+            games[game_id].state_bytes = state_memory_size(
+                snapshots[game_id])
+            self._stats.record_state_size(len(snapshots[game_id]))
+            games[game_id].cur_state = _replay(decode_state(snapshots[game_id]),
+                                               state_id, actions[game_id])
+
+    def _fetch_summaries(self, cursor):
+        """ build the GameSummary objects from the rows of a query selecting
+        _SQL_SUMMARY columns.
+        args: cursor (sqlite3 cursor) of the executed query
+        return: [GameSummary_1, ..., GameSummary_n]
+        """
+        summaries = []
+        for row in cursor.fetchall():
+            row = list(row)
+            players = [tuple(player) for player in json.loads(row[-2])]
+            extensions = {int(id_): name
+                          for id_, name in json.loads(row[-1]).items()}
+            summaries.append(GameSummary(*row[:-2], players=players,
+                                         extensions=extensions))
+        return summaries
+
+    @engine.util.log
+    @fail
+    @engine.db_stats.timed
+    def get_my_games_summaries(self, player_id):
+        """ return the summaries of the not-finished games joined by the
+        player, without loading the games states.
+        args: player_id (int)
+        return: db_status, [GameSummary_1, ..., GameSummary_n] ordered by id
+        """
+        sql = (_SQL_SUMMARY +
+               'FROM games_players gp, games g '
+               'WHERE gp.game_id = g.id '
+               ' AND gp.player_id = ? '
+               ' AND g.ended = 0 '
+               'ORDER BY g.id;')
+        try:
+            db = self._connect()
+            cursor = db.cursor()
+            cursor.execute(sql, (player_id, ))
+            summaries = self._fetch_summaries(cursor)
+        except sqlite3.DatabaseError:
+            msg = 'Error while listing games for player {}'.format(player_id)
+            self._logger.exception(msg)
+            return (DB_STATUS.ERROR, None)
+        else:
+            msg = 'Success listed games for player {}'.format(player_id)
+            self._logger.info(msg)
+            return (DB_STATUS.OK, summaries)
+        finally:
+            if 'cursor' in locals():
+                cursor.close()
+            if 'db' in locals():
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
+    def get_pub_priv_games_summaries(self):
+        """ return the summaries of the games not yet started, public and
+        private, without loading the games states.
+        args: none
+        return: db_status, ([pub_summary_1, ..., pub_summary_n],
+                            [priv_summary_1, ..., priv_summary_n]) ordered
+                by name
+        """
+        sql = (_SQL_SUMMARY +
+               'FROM games g '
+               'WHERE g.started = 0 '
+               ' AND g.private = ? '
+               'ORDER BY g.name;')
+        try:
+            db = self._connect()
+            cursor = db.cursor()
+            cursor.execute(sql, (False, ))
+            pub_summaries = self._fetch_summaries(cursor)
+            cursor.execute(sql, (True, ))
+            priv_summaries = self._fetch_summaries(cursor)
+        except sqlite3.DatabaseError:
+            self._logger.exception('Error while listing pub/priv games')
+            return (DB_STATUS.ERROR, None)
+        else:
+            self._logger.info('Success listed priv/pub games')
+            return (DB_STATUS.OK, (pub_summaries, priv_summaries))
+        finally:
+            if 'cursor' in locals():
+                cursor.close()
+            if 'db' in locals():
+                self._release(db)
+
+    @engine.util.log
+    @fail
+    @engine.db_stats.timed
     def get_pub_priv_games_ids(self):
         """ return the ids of games not yet started (waiting for players)
         there's two kind of games, public ones joinable to everyone and
@@ -458,10 +1447,11 @@ class DBInterface(object):
             if 'cursor_priv' in locals():
                 cursor_priv.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def get_my_games_ids(self, player_id):
         """ return the not-finished games joined by the player
         args: player_id (int)
@@ -490,10 +1480,11 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def create_player(self, name, email, password, tz_id):
         """ register new player in database.
         args:
@@ -529,10 +1520,11 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def update_player(self, player, to_update):
         """ update player fields.
         args:
@@ -585,10 +1577,11 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def auth_player(self, email, password):
         """ check password with the one in database.
         args:
@@ -625,10 +1618,11 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def load_player(self, player_id):
         """" get player info in database, then instanciate a player.
         args: player_id (int)
@@ -659,10 +1653,47 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
+    def load_players(self, players_ids):
+        """ get the infos of many players at once, then instanciate them.
+        args: players_ids [player_id_1 (int), ..., player_id_n (int)]
+        return: db_status,
+                {player_id (int): WebPlayer object}, players not found are
+                missing
+        """
+        sql = ('SELECT id, name, email, timezone, password '
+               'FROM players '
+               'WHERE id IN ({});')
+        players_ids = list(set(players_ids))
+        players = {}
+        try:
+            db = self._connect()
+            cursor = db.cursor()
+            for chunk in _chunks(players_ids):
+                cursor.execute(sql.format(_placeholders(chunk)), chunk)
+                for row in cursor.fetchall():
+                    players[row[0]] = WebPlayer(*row)
+        except sqlite3.DatabaseError:
+            msg = 'Error while loading players {}'.format(players_ids)
+            self._logger.exception(msg)
+            return (DB_STATUS.ERROR, None)
+        else:
+            msg = 'Success loaded players {}'.format(sorted(players))
+            self._logger.info(msg)
+            return (DB_STATUS.OK, players)
+        finally:
+            if 'cursor' in locals():
+                cursor.close()
+            if 'db' in locals():
+                self._release(db)
+
+    @engine.util.log
+    @fail
+    @engine.db_stats.timed
     def get_players_infos(self):
         """ get players infos to be displayed in the game creation page
         args: None
@@ -686,38 +1717,244 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
+
+    def _insert_state(self, cursor, game_id, state, actions):
+        """ store the current state of a game, within the transaction
+        opened by the caller.
+        every self._snapshot_every states the whole state is stored (a
+        snapshot), the other states only store their actions, i.e. the
+        actions applied to the previous state to reach the current one. the
+        actions are always appended to the game actions log.
+        args:
+         cursor (sqlite3 cursor)
+         game_id (int)
+         state (GameState object, or bytes already encoded by encode_state)
+         actions [pickled action, ...]: the cur_actions of the state
+        return: state_id (int),
+                approximate memory used by the state (int), see
+                state_memory_size, None if not a snapshot
+        """
+        sql_since_snapshot = ('SELECT COUNT(s.id), snap.id '
+                              'FROM (SELECT MAX(id) AS id '
+                              '      FROM state '
+                              '      WHERE game_id = ? '
+                              '       AND pickle IS NOT NULL) snap '
+                              'LEFT JOIN state s '
+                              ' ON s.game_id = ? AND s.id > snap.id;')
+        sql_state = ('INSERT INTO state '
+                     'VALUES (NULL, ?, ?);')
+        sql_last_seq = ('SELECT IFNULL(MAX(seq), 0) '
+                        'FROM actions '
+                        'WHERE game_id = ?;')
+        sql_action = ('INSERT INTO actions (game_id, seq, state_id, pickle) '
+                      'VALUES (?, ?, ?, ?);')
+
+        cursor.execute(sql_since_snapshot, (game_id, game_id))
+        (since_snapshot, snapshot_id) = cursor.fetchone()
+        if snapshot_id is None or since_snapshot + 1 >= self._snapshot_every:
+            if isinstance(state, bytes):
+                pic_state = state
+            else:
+                pic_state = encode_state(state, self._state_codec,
+                                         self._state_serializer)
+        else:
+            pic_state = None
+        cursor.execute(sql_state, (game_id, pic_state))
+        state_id = cursor.lastrowid
+
+        if len(actions) != 0:
+            cursor.execute(sql_last_seq, (game_id, ))
+            last_seq = cursor.fetchone()[0]
+            cursor.executemany(sql_action,
+                               [(game_id, last_seq + i, state_id, action)
+                                for i, action in enumerate(actions, 1)])
+        if pic_state is None:
+            return (state_id, None)
+        self._stats.record_state_size(len(pic_state))
+        return (state_id, state_memory_size(pic_state))
+
+    @staticmethod
+    def _pickle_actions(state):
+        """ return: [pickled action, ...] of the state cur_actions """
+        return [pickle.dumps(action) for action in state.cur_actions]
+
+    @staticmethod
+    def _game_row(game):
+        """ return: the values of the games row updated by save_game """
+        # games loaded without their state keep their turn
+        cur_turn = None
+        if game.cur_state is not None:
+            cur_turn = game.cur_state.cur_turn
+        return (game.started, game.ended, game.last_play, cur_turn, game.id_)
+
+    @staticmethod
+    def _update_game(cursor, game_row):
+        """ update a games row, within the transaction opened by the caller.
+        args:
+         cursor (sqlite3 cursor)
+         game_row: the values returned by _game_row
+        return: number of updated rows (int)
+        """
+        sql = ('UPDATE games '
+               'SET started=?, ended=?, last_play=?, '
+               ' cur_turn=COALESCE(?, cur_turn) '
+               'WHERE id = ?;')
+        cursor.execute(sql, game_row)
+        return cursor.rowcount
+
+    def prepare_save(self, game):
+        """ serialize the current state of a game and its row, so that the
+        game can be modified while save_games writes them. the actions of
+        the save are logged once: the caller empties the cur_actions of the
+        state, and puts them back if the save fails.
+        args: game (Game object)
+        return: pending save, to be given to save_games
+        """
+        state = encode_state(game.cur_state, self._state_codec,
+                             self._state_serializer)
+        game.state_bytes = state_memory_size(state)
+        return (game.id_, state, self._pickle_actions(game.cur_state),
+                self._game_row(game))
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
+    def save_games(self, saves):
+        """ store the states and update the rows of many games in a single
+        transaction, like save_state followed by save_game for each game.
+        a game whose save fails doesn't prevent the other ones from being
+        saved. the games states_ids are not updated.
+        args: saves [pending save returned by prepare_save, ...]
+        return: db_status,
+                [(db_status, state_id (int)), ...] in the saves order,
+                None if error
+        """
+        results = []
+        try:
+            db = self._connect()
+            cursor = db.cursor()
+            cursor.execute('BEGIN IMMEDIATE;')
+            for (game_id, state, actions, game_row) in saves:
+                cursor.execute('SAVEPOINT save_game;')
+                try:
+                    (state_id, _) = self._insert_state(cursor, game_id,
+                                                       state, actions)
+                    updated = self._update_game(cursor, game_row)
+                except sqlite3.DatabaseError:
+                    msg = 'Error while saving game {}'.format(game_id)
+                    self._logger.exception(msg)
+                    cursor.execute('ROLLBACK TO save_game;')
+                    results.append((DB_STATUS.ERROR, None))
+                else:
+                    if updated == 0:
+                        msg = 'No rows updated for game {}'.format(game_id)
+                        self._logger.warning(msg)
+                        results.append((DB_STATUS.NO_ROWS, state_id))
+                    else:
+                        results.append((DB_STATUS.OK, state_id))
+                cursor.execute('RELEASE save_game;')
+            db.commit()
+        except sqlite3.DatabaseError:
+            msg = 'Error while saving {} games'.format(len(saves))
+            self._logger.exception(msg)
+            return (DB_STATUS.ERROR, None)
+        else:
+            msg = 'Success saved {} games in one transaction'.format(len(saves))
+            self._logger.info(msg)
+            return (DB_STATUS.OK, results)
+        finally:
+            if 'cursor' in locals():
+                cursor.close()
+            if 'db' in locals():
+                self._release(db)
+
+    def _select_state(self, cursor, state_id):
+        """ load a state, replay its actions on the nearest snapshot if it's
+        not a snapshot itself.
+        args:
+         cursor (sqlite3 cursor)
+         state_id (int)
+        return: GameState object, None if the state doesn't exist
+        """
+        sql_state = ('SELECT game_id, pickle '
+                     'FROM state '
+                     'WHERE id = ?;')
+        sql_snapshot = ('SELECT id, pickle '
+                        'FROM state '
+                        'WHERE game_id = ? '
+                        ' AND id < ? '
+                        ' AND pickle IS NOT NULL '
+                        'ORDER BY id DESC '
+                        'LIMIT 1;')
+        sql_actions = ('SELECT state_id, pickle '
+                       'FROM actions '
+                       'WHERE game_id = ? '
+                       ' AND state_id > ? '
+                       ' AND state_id <= ? '
+                       'ORDER BY seq;')
+
+        cursor.execute(sql_state, (state_id, ))
+        data = cursor.fetchone()
+        if data is None:
+            return None
+        (game_id, pic_state) = data
+        if pic_state is not None:
+            self._stats.record_state_size(len(pic_state))
+            return decode_state(pic_state)
+
+        cursor.execute(sql_snapshot, (game_id, state_id))
+        snapshot = cursor.fetchone()
+        if snapshot is None:
+            raise sqlite3.DatabaseError(('No snapshot found for state {}'
+                                         '').format(state_id))
+        (snapshot_id, pic_state) = snapshot
+        self._stats.record_state_size(len(pic_state))
+        cursor.execute(sql_actions, (game_id, snapshot_id, state_id))
+        return _replay(decode_state(pic_state), state_id, cursor.fetchall())
+
+    @engine.util.log
+    @fail
+    @engine.db_stats.timed
     def save_state(self, game):
-        """ pickle the state and store it in the db.
-        update the states_ids of the game.
+        """ store the state in the db, as a snapshot or as a list of
+        actions, see _insert_state.
+        update the states_ids of the game, and empty the cur_actions of the
+        state once they are stored.
         infos saved in the database for a state:
          -id: uniq increasing id (sqlite rowid)
          -gameid: id of the game hosting the state
-         -pickle: pickled string of the state
+         -pickle: pickled string of the state, NULL if not a snapshot
+        and for each action of the state:
+         -game_id: id of the game
+         -seq: order of the action in the game
+         -state_id: id of the state
+         -pickle: pickled string of the action
 
         args:
          game (Game object)
         return: db_status,
                 state_id (int), None if error
         """
-        sql = ('INSERT INTO state '
-               'VALUES (NULL, ?, ?);')
         try:
-            pic_state = pickle.dumps(game.cur_state)
             db = self._connect()
             cursor = db.cursor()
-            cursor.execute(sql, (game.id_, pic_state))
+            cursor.execute('BEGIN IMMEDIATE;')
+            (state_id, size) = self._insert_state(
+                cursor, game.id_, game.cur_state,
+                self._pickle_actions(game.cur_state))
             db.commit()
         except sqlite3.DatabaseError:
             msg = 'Error while saving state for game {}'.format(game.id_)
             self._logger.exception(msg)
             return (DB_STATUS.ERROR, None)
         else:
-            state_id = cursor.lastrowid
             game.states_ids.append(state_id)
+            if size is not None:
+                game.state_bytes = size
+            # logged with this state, the next state logs only the actions
+            # played after it
+            game.cur_state.cur_actions = []
             msg = 'Success saved state {} for game {}'.format(state_id, game.id_)
             self._logger.info(msg)
             return (DB_STATUS.OK, state_id)
@@ -725,45 +1962,112 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def load_state(self, state_id):
-        """ load state from db and unpickle it
+        """ load state from db and unpickle it, rebuild it from the nearest
+        snapshot and the actions log if it's not a snapshot.
         args: state_id (int)
         return: db_status,
                 GameState object, None if error
         """
-        sql = ('SELECT pickle '
-               'FROM state '
-               'WHERE id = ?;')
         try:
             db = self._connect()
             cursor = db.cursor()
-            cursor.execute(sql, (state_id, ))
-        except sqlite3.DatabaseError:
+            state = self._select_state(cursor, state_id)
+        except (sqlite3.DatabaseError, ValueError):
             msg = 'Error while loading state {}'.format(state_id)
             self._logger.exception(msg)
             return (DB_STATUS.ERROR, None)
         else:
-            data = cursor.fetchone()
-            if data is None:
+            if state is None:
                 msg = 'State {} not found in database'.format(state_id)
                 self._logger.warning(msg)
                 return (DB_STATUS.NO_ROWS, None)
-            pic_state = data[0]
             msg = 'Success loaded state {}'.format(state_id)
             self._logger.info(msg)
-            return (DB_STATUS.OK, pickle.loads(pic_state))
+            return (DB_STATUS.OK, state)
+        finally:
+            if 'cursor' in locals():
+                cursor.close()
+            if 'db' in locals():
+                self._release(db)
+
+    @engine.util.log
+    @fail
+    @engine.db_stats.timed
+    def rewrite_legacy_states(self, batch_size=100):
+        """ rewrite the states stored as raw pickles with the state codec,
+        one transaction per batch of states.
+        args: batch_size (int): number of states read at once
+        return: db_status,
+                number of rewritten states (int), None if error
+        """
+        sql_states = ('SELECT id, pickle '
+                      'FROM state '
+                      'WHERE id > ? '
+                      ' AND pickle IS NOT NULL '
+                      'ORDER BY id '
+                      'LIMIT ?;')
+        sql_update = ('UPDATE state '
+                      'SET pickle = ? '
+                      'WHERE id = ?;')
+
+        rewritten = 0
+        skipped = 0
+        last_id = -1
+        try:
+            db = self._connect()
+            cursor = db.cursor()
+            while True:
+                cursor.execute(sql_states, (last_id, batch_size))
+                states = cursor.fetchall()
+                if len(states) == 0:
+                    break
+                last_id = states[-1][0]
+                updates = []
+                for state_id, blob in states:
+                    if is_encoded_state(blob):
+                        continue
+                    try:
+                        state = pickle.loads(blob)
+                    except (pickle.UnpicklingError, AttributeError,
+                            EOFError, ImportError):
+                        msg = 'Unreadable legacy state {}, left as is'
+                        self._logger.exception(msg.format(state_id))
+                        skipped += 1
+                        continue
+                    updates.append((encode_state(state,
+                                                 self._state_codec,
+                                                 self._state_serializer),
+                                    state_id))
+                if len(updates) != 0:
+                    cursor.executemany(sql_update, updates)
+                    db.commit()
+                    rewritten += len(updates)
+                    self._logger.info(('Rewritten {} states up to state {}'
+                                       '').format(rewritten, last_id))
+        except sqlite3.DatabaseError:
+            msg = 'Error while rewriting legacy states after state {}'
+            self._logger.exception(msg.format(last_id))
+            return (DB_STATUS.ERROR, None)
+        else:
+            msg = ('Success rewritten {} legacy states, {} unreadable'
+                   '').format(rewritten, skipped)
+            self._logger.info(msg)
+            return (DB_STATUS.OK, rewritten)
         finally:
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def get_extensions_infos(self):
         """ get the id, internal name and description of the available
         extensions.
@@ -787,10 +2091,11 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
 
     @engine.util.log
     @fail
+    @engine.db_stats.timed
     def get_timezones(self):
         """ get the timezone ids and associated name, ordered by id.
         args: None
@@ -815,4 +2120,4 @@ class DBInterface(object):
             if 'cursor' in locals():
                 cursor.close()
             if 'db' in locals():
-                db.close()
+                self._release(db)
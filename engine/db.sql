@@ -40,7 +40,9 @@ CREATE TABLE IF NOT EXISTS games (
     -- num players for the game
     num_players INTEGER NOT NULL,
     -- game creator id
-    creator_id INTEGER NOT NULL
+    creator_id INTEGER NOT NULL,
+    -- turn of the current state, to list games without loading their state
+    cur_turn INTEGER NOT NULL DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS players (
@@ -81,14 +83,41 @@ CREATE TABLE IF NOT EXISTS games_extensions (
 CREATE TABLE IF NOT EXISTS state (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     game_id INTEGER NOT NULL,
-    pickle BLOB NOT NULL,
+    -- pickled state for snapshots, NULL if only the actions applied since
+    -- the previous state are stored
+    pickle BLOB,
     FOREIGN KEY(game_id) REFERENCES games(id)
 );
 
+-- the log of the actions played in the games
+CREATE TABLE IF NOT EXISTS actions (
+    game_id INTEGER NOT NULL,
+    -- order of the action in the game
+    seq INTEGER NOT NULL,
+    -- the state reached once the action is applied
+    state_id INTEGER NOT NULL,
+    pickle BLOB NOT NULL,
+    PRIMARY KEY(game_id, seq),
+    FOREIGN KEY(game_id) REFERENCES games(id),
+    FOREIGN KEY(state_id) REFERENCES state(id)
+);
+
 CREATE TABLE IF NOT EXISTS races (
     name TEXT PRIMARY KEY
 );
 
+-- indexes used by the queries of DBInterface, the query plans are checked
+-- by the db tests
+-- lobby: games not started, by privacy, ordered by name
+CREATE INDEX IF NOT EXISTS games_lobby ON games(started, private, name);
+-- players of a game, games of a player
+CREATE INDEX IF NOT EXISTS games_players_game ON games_players(game_id, player_id);
+CREATE INDEX IF NOT EXISTS games_players_player ON games_players(player_id, game_id);
+CREATE INDEX IF NOT EXISTS games_extensions_game ON games_extensions(game_id, extension_id);
+-- states of a game, and its snapshots
+CREATE INDEX IF NOT EXISTS state_game ON state(game_id, id);
+CREATE INDEX IF NOT EXISTS state_snapshots ON state(game_id, id) WHERE pickle IS NOT NULL;
+
 -- insert available extensions
 INSERT OR IGNORE INTO extensions (name, desc) VALUES('rare_technologies', 'enable rare technologies');
 INSERT OR IGNORE INTO extensions (name, desc) VALUES('developments', 'enable developments');
@@ -0,0 +1,379 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import bisect
+from collections import deque
+import contextvars
+import functools
+import logging
+import sqlite3
+import threading
+import time
+import engine.util
+
+# Instrumentation of the DBInterface methods:
+#  -the timed decorator records, for each call of a DB method, its wall
+#   time, the time spent waiting for a pooled connection and the number of
+#   rows fetched, in the histograms of the DBInterface DBStats
+#  -the pooled connections hand out InstrumentedCursor objects, timing
+#   every statement. The statements slower than the threshold are kept
+#   with their EXPLAIN QUERY PLAN.
+
+# upper bounds of the buckets, in seconds and in rows
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROWS_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 10000)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# statements slower than that (seconds) are kept with their query plan
+DEFAULT_SLOW_QUERY_THRESHOLD = 0.1
+# number of slow statements kept, the oldest ones are forgotten
+DEFAULT_MAX_SLOW_QUERIES = 100
+
+# the DB method call in progress in the current thread/task
+_current_call = contextvars.ContextVar('ecbb_db_call', default=None)
+
+class Histogram(object):
+    """
+    Counts of observed values in fixed buckets, as the prometheus
+    histograms: self.counts[i] is the number of values <= bounds[i], the
+    last count is for the values over the last bound. Not thread-safe, see
+    DBStats.
+
+    attributes:
+      self.count (int): number of observed values
+      self.sum (float): sum of the observed values
+    """
+    def __init__(self, bounds=TIME_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        """ add a value """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def mean(self):
+        """ return: mean of the values, 0 if none """
+        if self.count == 0:
+            return 0
+        return self.sum / self.count
+
+    def quantile(self, q):
+        """ approximate a quantile, interpolated in its bucket.
+        args: q (float): between 0 and 1, e.g. 0.95
+        return: value, 0 if no value
+        """
+        if self.count == 0:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count != 0 and seen + count >= rank:
+                if index == len(self.bounds):
+                    # no upper bound for the last bucket
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index > 0 else 0
+                upper = self.bounds[index]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+    def cumulative(self):
+        """ return: [(upper bound, count of values <= bound), ...], the
+        last bound is float('inf')
+        """
+        total = 0
+        buckets = []
+        for bound, count in zip(self.bounds + (float('inf'), ), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+class MethodStats(object):
+    """ the histograms of a DB method """
+    def __init__(self):
+        self.time = Histogram(TIME_BUCKETS)
+        self.acquire = Histogram(TIME_BUCKETS)
+        self.rows = Histogram(ROWS_BUCKETS)
+        self.statements = 0
+        self.errors = 0
+
+class SlowQuery(object):
+    """ a statement slower than the threshold """
+    def __init__(self, method, sql, params, elapsed, plan):
+        self.method = method
+        self.sql = sql
+        self.params = params
+        self.elapsed = elapsed
+        # [(id, parent, notused, detail), ...], None if not explained
+        self.plan = plan
+        self.time = time.time()
+
+class _Call(object):
+    """ counters of a DB method call in progress """
+    __slots__ = ('method', 'acquire', 'rows', 'statements')
+
+    def __init__(self, method):
+        self.method = method
+        self.acquire = 0
+        self.rows = 0
+        self.statements = 0
+
+class DBStats(object):
+    """
+    Statistics of the DBInterface methods, per method name:
+     -wall time of the calls
+     -time waiting for a connection from the pool
+     -rows fetched by a call
+     -number of statements and of calls returning DB_STATUS.ERROR
+    and the last max_slow statements slower than slow_threshold seconds,
+    with their query plan.
+
+    and the sizes of the state blobs written and read.
+
+    Thread-safe, queryable with methods() / slow_queries() / state_sizes(),
+    dumpable with report().
+    """
+    def __init__(self, slow_threshold=DEFAULT_SLOW_QUERY_THRESHOLD,
+                 max_slow=DEFAULT_MAX_SLOW_QUERIES):
+        self._logger = logging.getLogger('ecbb.db_stats')
+        self.slow_threshold = slow_threshold
+        self._lock = threading.Lock()
+        self._methods = {}
+        self._slow = deque(maxlen=max_slow)
+        self._state_sizes = Histogram(SIZE_BUCKETS)
+
+    def record_call(self, call, elapsed, error):
+        """ add a finished call to the histograms of its method.
+        args:
+         call (_Call)
+         elapsed (float): wall time in seconds
+         error (bool): the call returned DB_STATUS.ERROR or raised
+        """
+        with self._lock:
+            stats = self._methods.get(call.method)
+            if stats is None:
+                stats = self._methods[call.method] = MethodStats()
+            stats.time.observe(elapsed)
+            stats.acquire.observe(call.acquire)
+            stats.rows.observe(call.rows)
+            stats.statements += call.statements
+            if error:
+                stats.errors += 1
+
+    def record_slow(self, method, sql, params, elapsed, conn):
+        """ keep a slow statement with its query plan.
+        args:
+         method (str): DB method running the statement, None if outside
+                       of the DB methods
+         sql (str), params: the statement
+         elapsed (float): its wall time in seconds
+         conn (sqlite3 connection): to explain the statement
+        """
+        plan = None
+        if params is not None:
+            try:
+                # a plain cursor, not timed
+                cursor = sqlite3.Cursor(conn)
+                plan = cursor.execute('EXPLAIN QUERY PLAN ' + sql,
+                                      params).fetchall()
+                cursor.close()
+            except sqlite3.Error:
+                plan = None
+        slow = SlowQuery(method, sql, params, elapsed, plan)
+        with self._lock:
+            self._slow.append(slow)
+        self._logger.warning('Slow query in {} ({:.1f} ms): {} plan: {}'.format(
+            method, elapsed * 1000, ' '.join(sql.split()),
+            None if plan is None else [detail for _, _, _, detail in plan]))
+
+    def record_state_size(self, size):
+        """ add the size in bytes of a state blob written or read """
+        with self._lock:
+            self._state_sizes.observe(size)
+
+    def state_sizes(self):
+        """ return: Histogram of the state blobs sizes, a copy """
+        with self._lock:
+            sizes = Histogram(SIZE_BUCKETS)
+            sizes.counts = list(self._state_sizes.counts)
+            sizes.count = self._state_sizes.count
+            sizes.sum = self._state_sizes.sum
+            return sizes
+
+    def methods(self):
+        """ return: {method name (str): MethodStats}, a copy """
+        with self._lock:
+            return dict(self._methods)
+
+    def slow_queries(self):
+        """ return: [SlowQuery, ...], the oldest first """
+        with self._lock:
+            return list(self._slow)
+
+    def reset(self):
+        """ forget the recorded calls and slow statements """
+        with self._lock:
+            self._methods.clear()
+            self._slow.clear()
+            self._state_sizes = Histogram(SIZE_BUCKETS)
+
+    def report(self):
+        """ return: a text report, the methods taking the most time first,
+        then the slow statements
+        """
+        lines = [('{:<30} {:>7} {:>6} {:>10} {:>8} {:>8} {:>8} {:>8} '
+                  '{:>10} {:>9}').format('method', 'calls', 'errors',
+                                         'total ms', 'mean ms', 'p50 ms',
+                                         'p95 ms', 'p99 ms', 'acq p95 ms',
+                                         'rows mean')]
+        with self._lock:
+            methods = sorted(self._methods.items(),
+                             key=lambda item: item[1].time.sum, reverse=True)
+            for name, stats in methods:
+                lines.append(('{:<30} {:>7} {:>6} {:>10.1f} {:>8.2f} '
+                              '{:>8.2f} {:>8.2f} {:>8.2f} {:>10.2f} '
+                              '{:>9.1f}').format(
+                                  name, stats.time.count, stats.errors,
+                                  stats.time.sum * 1000,
+                                  stats.time.mean() * 1000,
+                                  stats.time.quantile(0.5) * 1000,
+                                  stats.time.quantile(0.95) * 1000,
+                                  stats.time.quantile(0.99) * 1000,
+                                  stats.acquire.quantile(0.95) * 1000,
+                                  stats.rows.mean()))
+            slow = list(self._slow)
+        lines.append('')
+        lines.append('{} slow statements (> {} ms)'.format(
+            len(slow), self.slow_threshold * 1000))
+        for query in slow:
+            lines.append('{} {:.1f} ms: {}'.format(query.method,
+                                                   query.elapsed * 1000,
+                                                   ' '.join(query.sql.split())))
+            for _, _, _, detail in query.plan or []:
+                lines.append('    ' + detail)
+        return '\n'.join(lines)
+
+def timed(fun):
+    """
+    a decorator recording the calls of a DBInterface method in the
+    DBInterface DBStats (self._stats), the method must return
+    (db_status, data).
+    """
+    # engine.db imports this module, the methods are decorated while
+    # engine.db is being imported, once DB_STATUS is defined
+    from engine.db import DB_STATUS
+    method = fun.__name__
+
+    def timer(self, *args, **kargs):
+        """ returned function """
+        call = _Call(method)
+        token = _current_call.set(call)
+        start = time.perf_counter()
+        error = True
+        try:
+            result = fun(self, *args, **kargs)
+            error = result[0] == DB_STATUS.ERROR
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            _current_call.reset(token)
+            self._stats.record_call(call, elapsed, error)
+            engine.util.add_timing('db', elapsed)
+    return functools.wraps(fun)(timer)
+
+def add_acquire(elapsed):
+    """ count the time waiting for a pooled connection in the current call
+    args: elapsed (float): seconds
+    """
+    call = _current_call.get()
+    if call is not None:
+        call.acquire += elapsed
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """ sqlite3 cursor timing its statements and counting the fetched rows
+    in the current DB method call.
+    """
+    def execute(self, sql, params=()):
+        """ timed sqlite3.Cursor.execute """
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.execute(self, sql, params)
+        finally:
+            self._timed(sql, params, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_params):
+        """ timed sqlite3.Cursor.executemany, the slow ones aren't
+        explained
+        """
+        start = time.perf_counter()
+        try:
+            return sqlite3.Cursor.executemany(self, sql, seq_of_params)
+        finally:
+            self._timed(sql, None, time.perf_counter() - start)
+
+    def fetchone(self):
+        """ counted sqlite3.Cursor.fetchone """
+        row = sqlite3.Cursor.fetchone(self)
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, size=None):
+        """ counted sqlite3.Cursor.fetchmany """
+        if size is None:
+            size = self.arraysize
+        rows = sqlite3.Cursor.fetchmany(self, size)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        """ counted sqlite3.Cursor.fetchall """
+        rows = sqlite3.Cursor.fetchall(self)
+        self._count(len(rows))
+        return rows
+
+    @staticmethod
+    def _count(rows):
+        """ add fetched rows to the current call """
+        call = _current_call.get()
+        if call is not None:
+            call.rows += rows
+
+    def _timed(self, sql, params, elapsed):
+        """ count a statement, keep it if slow """
+        call = _current_call.get()
+        if call is not None:
+            call.statements += 1
+        stats = self.connection.stats
+        if stats is not None and elapsed >= stats.slow_threshold:
+            stats.record_slow(None if call is None else call.method, sql,
+                              params, elapsed, self.connection)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """ sqlite3 connection handing out InstrumentedCursor objects, the
+    slow statements are recorded in self.stats (DBStats, or None)
+    """
+    stats = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        """ sqlite3.Connection.cursor with an InstrumentedCursor factory """
+        return sqlite3.Connection.cursor(self, factory)
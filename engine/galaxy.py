@@ -0,0 +1,228 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from array import array
+import engine.util
+
+# The galaxy map: the placed hexes, on axial coordinates (q, r), the
+# galactic center being (0, 0).
+#
+# The movement, influence and exploration rules ask for the neighbours of a
+# hex and for the wormholes linking them many times per action, the map
+# keeps them precomputed in arrays indexed by the hex position in the map,
+# the hexes being numbered in their placement order:
+#  -the neighbours: 6 entries per hex, the index of the hex on each side,
+#   NO_HEX if the side is still unexplored
+#  -the links: 6 entries per hex, the wormhole connection on each side,
+#   LINKS.NONE, HALF (wormhole on one side only) or FULL
+# Placing or rotating a hex only updates its entries and the ones of its
+# neighbours.
+
+# directions of the sides of a hex, side d of a hex at (q, r) touches the
+# hex at (q + dq, r + dr), and side (d + 3) % 6 of that hex
+DIRECTIONS = ((1, 0), (1, -1), (0, -1), (-1, 0), (-1, 1), (0, 1))
+
+LINKS = engine.util.enum(NONE=0, HALF=1, FULL=2)
+
+NO_HEX = -1
+
+def opposite(side):
+    """ return: the side of the neighbour touching side of a hex """
+    return (side + 3) % 6
+
+def distance(pos1, pos2):
+    """ return: the number of hexes between two positions (q, r) """
+    (dq, dr) = (pos1[0] - pos2[0], pos1[1] - pos2[1])
+    return (abs(dq) + abs(dr) + abs(dq + dr)) // 2
+
+def hex_sides(wormholes, rotation):
+    """ compute the wormholes of a placed hex.
+    args:
+     wormholes (6 bools): wormholes of the hex tile, in the DIRECTIONS order
+                          when not rotated
+     rotation (int): sixth of turns of the tile, None for 0
+    return: bit mask, bit d set if side d has a wormhole
+    """
+    rotation = rotation or 0
+    mask = 0
+    for side, wormhole in enumerate(wormholes):
+        if wormhole:
+            mask |= 1 << ((side + rotation) % 6)
+    return mask
+
+class Galaxy(object):
+    """
+    The hexes of a game placed on the map, see the module comment.
+     -hexes: the placed Hex objects, by index
+     -version: incremented by every change of the map, the caches built on
+               the map compare it with their own version, and get the hexes
+               changed since with changes_since
+    """
+    def __init__(self, hexes=()):
+        """ args: hexes [Hex, ...] already placed, with their coordinates """
+        self.hexes = []
+        self.version = 0
+        # (q, r) -> index
+        self._index = {}
+        # hex id -> index
+        self._ids = {}
+        # wormholes of the hexes, see hex_sides
+        self._sides = array('B')
+        # 6 entries per hex, see the module comment
+        self._neighbors = array('i')
+        self._links = array('B')
+        # index of the hex changed by each version
+        self._changes = array('i')
+        for hex_ in hexes:
+            self.place(hex_, hex_.q, hex_.r, hex_.rotation)
+
+    def __len__(self):
+        return len(self.hexes)
+
+    def __contains__(self, pos):
+        return pos in self._index
+
+    def __getstate__(self):
+        """ the arrays are rebuilt when unpickled """
+        return {'hexes': self.hexes}
+
+    def __setstate__(self, state):
+        self.__init__(state['hexes'])
+
+    def index(self, pos):
+        """ return: the index of the hex at pos (q, r), None if empty """
+        return self._index.get(pos)
+
+    def index_of(self, hex_id):
+        """ return: the index of the hex of the given id, None if not placed """
+        return self._ids.get(hex_id)
+
+    def hex_at(self, pos):
+        """ return: the Hex at pos (q, r), None if empty """
+        index = self._index.get(pos)
+        if index is None:
+            return None
+        return self.hexes[index]
+
+    def position(self, index):
+        """ return: the coordinates (q, r) of a hex """
+        hex_ = self.hexes[index]
+        return (hex_.q, hex_.r)
+
+    def place(self, hex_, q, r, rotation=0):
+        """ put a hex on the map, when it's explored.
+        args:
+         hex_ (Hex): its coordinates and rotation are set
+         q, r (int): axial coordinates
+         rotation (int): see hex_sides
+        return: the index of the hex
+        raise: ValueError if the position or the hex is already taken
+        """
+        if (q, r) in self._index:
+            raise ValueError('Hex position {} already taken'.format((q, r)))
+        if hex_.id_ in self._ids:
+            raise ValueError('Hex {} already placed'.format(hex_.id_))
+        (hex_.q, hex_.r, hex_.rotation) = (q, r, rotation)
+        index = len(self.hexes)
+        self.hexes.append(hex_)
+        self._index[(q, r)] = index
+        self._ids[hex_.id_] = index
+        self._sides.append(hex_sides(hex_.wormholes, rotation))
+        self._neighbors.extend([NO_HEX] * 6)
+        self._links.extend([LINKS.NONE] * 6)
+        for side, (dq, dr) in enumerate(DIRECTIONS):
+            neighbor = self._index.get((q + dq, r + dr))
+            if neighbor is not None:
+                self._neighbors[index * 6 + side] = neighbor
+                self._neighbors[neighbor * 6 + opposite(side)] = index
+                self._update_link(index, side, neighbor)
+        self._changed(index)
+        return index
+
+    def rotate(self, index, rotation):
+        """ change the rotation of a placed hex.
+        args:
+         index (int): index of the hex
+         rotation (int): see hex_sides
+        """
+        hex_ = self.hexes[index]
+        hex_.rotation = rotation
+        self._sides[index] = hex_sides(hex_.wormholes, rotation)
+        for side in range(6):
+            neighbor = self._neighbors[index * 6 + side]
+            if neighbor != NO_HEX:
+                self._update_link(index, side, neighbor)
+        self._changed(index)
+
+    def _changed(self, index):
+        """ record the change of a hex """
+        self._changes.append(index)
+        self.version += 1
+
+    def changes_since(self, version):
+        """ return: {index, ...} of the hexes placed or rotated since the
+        given version of the map, their links and the links of their
+        neighbours changed
+        """
+        return set(self._changes[version:])
+
+    def _update_link(self, index, side, neighbor):
+        """ compute the link between a hex and its neighbour on side """
+        other = opposite(side)
+        here = self._sides[index] >> side & 1
+        there = self._sides[neighbor] >> other & 1
+        link = here + there
+        self._links[index * 6 + side] = link
+        self._links[neighbor * 6 + other] = link
+
+    def neighbor(self, index, side):
+        """ return: the index of the neighbour on side, NO_HEX if none """
+        return self._neighbors[index * 6 + side]
+
+    def neighbors(self, index):
+        """ return: [index, ...] of the placed neighbours of a hex """
+        return [neighbor for neighbor
+                in self._neighbors[index * 6:index * 6 + 6]
+                if neighbor != NO_HEX]
+
+    def link(self, index, side):
+        """ return: LINKS, the wormhole connection on a side of a hex """
+        return self._links[index * 6 + side]
+
+    def connected(self, index, half=False):
+        """ the neighbours a ship or an influence disc can go to.
+        args:
+         index (int): index of the hex
+         half (bool): also the neighbours with a half connection, with the
+                      wormhole generator technology
+        return: [index, ...]
+        """
+        least = LINKS.HALF if half else LINKS.FULL
+        start = index * 6
+        return [self._neighbors[start + side] for side in range(6)
+                if self._links[start + side] >= least]
+
+    def has_wormhole(self, index, side):
+        """ return: True if the hex has a wormhole on side """
+        return bool(self._sides[index] >> side & 1)
+
+    def free_positions(self, index):
+        """ return: [(q, r), ...] the unexplored positions around a hex """
+        hex_ = self.hexes[index]
+        return [(hex_.q + dq, hex_.r + dr)
+                for side, (dq, dr) in enumerate(DIRECTIONS)
+                if self._neighbors[index * 6 + side] == NO_HEX]
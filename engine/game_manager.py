@@ -15,11 +15,20 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+from concurrent.futures import Future
+from contextlib import contextmanager
 import logging
 import sys
+import threading
+from engine.cache import GamesCache
 from engine.db import DBInterface, DB_STATUS
 import engine.util
 from engine.web_types import Game
+from engine.write_behind import WriteBehind
+
+# default limits of the games kept in memory
+DEFAULT_MAX_GAMES = 1000
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
 
 class GamesManager(object):
     """
@@ -31,18 +40,50 @@ class GamesManager(object):
     Allow to browse ended games.
 
     attributes:
-      self._games (dict): the games, accessed by their id
+      self._games (GamesCache): the games, accessed by their id. at most
+                                max_games games using about max_bytes
+                                are kept in memory (None for no limit)
       self._web_players (dict): the players, accessed by their id
-      self._db (DBInterface object): the DB interface object
+      self._db (DBInterface object): the DB interface object, created with
+                                     the db_settings keyword arguments
+      self._write_behind (WriteBehind object): with write_behind, the games
+                                               saves are group committed
+                                               by a writer thread
+      self._game_locks (KeyedLocks): a lock per game, held while loading
+                                     or saving the game
+      self._player_locks (KeyedLocks): a lock per player, held while
+                                       loading the player
+      self._open_turns (set): ids of the games pinned in memory during a
+                              player turn, see play_turn
+      self._deferred (dict): game_id -> [function, ...], the updates of the
+                             games deferred by the write-behind thread, see
+                             _run_locked
+
+    The games manager is shared by the web server threads. The actions on
+    a game must be done with its lock held, see game_lock, so that the
+    actions on different games run in parallel while the actions on the
+    same game are serialized.
     """
-    def __init__(self, test_mode=False):
+    def __init__(self, test_mode=False, max_games=DEFAULT_MAX_GAMES,
+                 max_bytes=DEFAULT_MAX_BYTES, db_settings=None,
+                 write_behind=False):
         self._logger = logging.getLogger('ecbb.gm')
 
-        # TODO::limit the number of games loaded in memory at the same
-        # time to avoid too important memory consumption
-        self._games = {}
+        self._games = GamesCache(max_games, max_bytes,
+                                 write_back=self._write_back)
         self._web_players = {}
-        self._db = DBInterface(test_mode)
+        # get_player lookups, approximate: not updated under a lock
+        self._players_hits = 0
+        self._players_misses = 0
+        self._game_locks = engine.util.KeyedLocks()
+        self._player_locks = engine.util.KeyedLocks()
+        self._open_turns = set()
+        self._deferred = {}
+        self._deferred_lock = threading.Lock()
+        self._db = DBInterface(test_mode, **(db_settings or {}))
+        self._write_behind = None
+        if write_behind:
+            self._write_behind = WriteBehind(self._db)
 
         # load constants from DB
         (status_ext, self.ext_infos) = self._db.get_extensions_infos()
@@ -55,7 +96,56 @@ class GamesManager(object):
         """ called from mako templates to log stuffs """
         self._logger.debug(msg)
 
+    def game_lock(self, *games_ids):
+        """ lock games, the locks are reentrant.
+        usage:
+          with gm.game_lock(game_id):
+              play the player turn, then save_game
+        args: games_ids (int, ...)
+        return: context manager
+        """
+        return self._lock_game(*games_ids)
+
+    @contextmanager
+    def _lock_game(self, *games_ids, blocking=True):
+        """ lock games like self._game_locks, and run their deferred
+        updates once locked and before unlocking, see _run_locked.
+        yield: True if the locks are held
+        """
+        with self._game_locks(*games_ids, blocking=blocking) as locked:
+            if locked:
+                self._run_deferred(games_ids)
+            try:
+                yield locked
+            finally:
+                if locked:
+                    self._run_deferred(games_ids)
+
+    def _run_locked(self, game_id, update):
+        """ run a function modifying a game with the game lock held, called
+        by the write-behind thread. this thread never waits for a game lock:
+        the thread holding it may be waiting for the save being written.
+        when the game is locked, the update is run by the next thread
+        locking it with _lock_game. the updates of a game are run in order.
+        args:
+         game_id (int)
+         update (function): called without arguments
+        """
+        with self._deferred_lock:
+            self._deferred.setdefault(game_id, []).append(update)
+        with self._lock_game(game_id, blocking=False):
+            pass
+
+    def _run_deferred(self, games_ids):
+        """ run the deferred updates of games, with their locks held """
+        for game_id in games_ids:
+            with self._deferred_lock:
+                updates = self._deferred.pop(game_id, [])
+            for update in updates:
+                update()
+
     @engine.util.log
+    @engine.util.timed_span('gm')
     def create_game(self, creator_id, name, level, private, password,
                     num_players, players_ids, extensions):
         """ Instanciate a new game. Save it to the database to get its uniq id.
@@ -90,24 +180,205 @@ class GamesManager(object):
 
         self._logger.info("Game {!r} successfully created".format(name))
 
-        self._games[game.id_] = game
+        self._games.put(game.id_, game)
         return True
         
     @engine.util.log
+    @engine.util.timed_span('gm')
     def save_game(self, game):
         """ update an existing game into the database.
         first save the current state to get its id, then update the game in db.
+        with write-behind, wait for the batch holding the save to be written.
         args: game (Game object): the game to save
         return: db_ok (bool), upd_ok (bool)
         """
+        with self._lock_game(game.id_):
+            if self._write_behind is None:
+                return self._save_game_now(game)
+            saved = self.save_game_async(game)
+        result = saved.result()
+        with self._lock_game(game.id_):
+            # the state_id appended by the updates deferred while the caller
+            # held the lock
+            return result
+
+    @engine.util.timed_span('gm')
+    def save_game_async(self, game):
+        """ same as save_game, but return without waiting for the
+        write-behind queue to write the save. the game stays in memory until
+        it's written.
+        args: game (Game object): the game to save
+        return: Future of (db_ok (bool), upd_ok (bool)), already resolved
+                without write-behind
+        """
+        saved = Future()
+        if self._write_behind is None:
+            with self._lock_game(game.id_):
+                saved.set_result(self._save_game_now(game))
+            return saved
+
+        # the state is serialized by submit, later modifications of the
+        # game mark it dirty again
+        self._games.pin(game.id_)
+        self._games.mark_clean(game.id_)
+        # logged by the save, emptied from the state once submitted
+        actions = []
+
+        def written(status, state_id):
+            """ called by the writer thread, in the order of the saves """
+            def update():
+                if state_id is not None:
+                    game.states_ids.append(state_id)
+                else:
+                    # not stored, logged by the next save
+                    game.cur_state.cur_actions[:0] = actions
+            self._run_locked(game.id_, update)
+
+        def done(pending):
+            """ called by the writer thread once the save is written """
+            try:
+                (status, _) = pending.result()
+            except Exception:
+                status = DB_STATUS.ERROR
+            if status == DB_STATUS.OK:
+                self._games.resize(game.id_)
+            else:
+                self._games.mark_dirty(game.id_)
+            self._games.unpin(game.id_)
+            saved.set_result((status != DB_STATUS.ERROR,
+                              status != DB_STATUS.NO_ROWS))
+
+        try:
+            # the game is serialized by submit, its actions can no longer
+            # be undone
+            with self._lock_game(game.id_):
+                pending = self._write_behind.submit(game, written)
+                actions.extend(game.cur_state.cur_actions)
+                game.cur_state.cur_actions = []
+                game.cur_state.clear_undo()
+                self._close_turn(game.id_)
+        except Exception:
+            # queue closed, or a state which can't be serialized
+            msg = 'Error queuing save of game {}'.format(game.id_)
+            self._logger.exception(msg)
+            self._games.mark_dirty(game.id_)
+            self._games.unpin(game.id_)
+            saved.set_result((False, False))
+        else:
+            pending.add_done_callback(done)
+        return saved
+
+    def _save_game_now(self, game):
+        """ save_game without write-behind """
+        saved = self._store_game(game)
+        if saved == (True, True):
+            self._games.resize(game.id_)
+        return saved
+
+    def _store_game(self, game):
+        """ save the current state of a game, then update the game.
+        return: db_ok (bool), upd_ok (bool)
+        """
         (status, _) = self._db.save_state(game)
         if status != DB_STATUS.OK:
             return (False, False)
+        # the saved actions can't be undone
+        if game.cur_state is not None:
+            game.cur_state.clear_undo()
+        self._close_turn(game.id_)
 
         (status, _) = self._db.save_game(game)
+        if status == DB_STATUS.OK:
+            self._games.mark_clean(game.id_)
         return (status != DB_STATUS.ERROR, status != DB_STATUS.NO_ROWS)
 
+    def _write_back(self, game):
+        """ save a modified game before removing it from memory.
+        called by the cache while evicting games: never wait for the writer
+        thread, nor resize the game. a game locked by another thread is
+        being modified, it's not written back.
+        args: game (Game object)
+        return: True if saved
+        """
+        with self._lock_game(game.id_, blocking=False) as locked:
+            if not locked:
+                self._logger.debug(("Game {} locked, not written back"
+                                    "").format(game.id_))
+                return False
+            (db_ok, upd_ok) = self._store_game(game)
+        return db_ok and upd_ok
+
+    def flush(self):
+        """ wait for the pending write-behind saves to be written, and
+        their updates of the games to be run
+        """
+        if self._write_behind is not None:
+            self._write_behind.flush()
+        with self._deferred_lock:
+            games_ids = list(self._deferred)
+        for game_id in games_ids:
+            with self._lock_game(game_id):
+                pass
+
+    def close(self):
+        """ write the pending saves and stop the write-behind thread """
+        if self._write_behind is not None:
+            self._write_behind.close()
+
+    def mark_dirty(self, game_id):
+        """ a game in memory has been modified and not yet saved, it will be
+        saved if evicted from memory.
+        args: game_id (int)
+        """
+        self._games.mark_dirty(game_id)
+
+    def pin_game(self, game_id):
+        """ keep a game in memory until unpin_game. the games are already
+        kept in memory during the player turns played by play_turn.
+        args: game_id (int)
+        """
+        self._games.pin(game_id)
+
+    def unpin_game(self, game_id):
+        """ the game can be removed from memory again.
+        args: game_id (int)
+        """
+        self._games.unpin(game_id)
+
+    def cache_stats(self):
+        """ return: dict of the games cache counters (hits, misses,
+        evictions, write_backs) and usage (games, bytes, pinned, dirty)
+        """
+        return self._games.stats()
+
+    def players_stats(self):
+        """ return: dict of the players in memory and of the get_player
+        hits/misses
+        """
+        return {'players': len(self._web_players),
+                'hits': self._players_hits,
+                'misses': self._players_misses}
+
+    def pool_stats(self):
+        """ return: dict of the DB connections, see DBInterface.pool_stats """
+        return self._db.pool_stats()
+
+    def db_stats(self):
+        """ return: DBStats, the timings of the DB methods and the slow
+        queries, see engine.db_stats
+        """
+        return self._db.query_stats()
+
+    def write_behind_stats(self):
+        """ return: dict of the write-behind counters (pending, batches,
+        saves), None without write-behind
+        """
+        if self._write_behind is None:
+            return None
+        return self._write_behind.stats()
+
     @engine.util.log
+    @engine.util.timed_span('gm')
     def load_game(self, game_id, force=False):
         """ load a game from the database if not already in memory.
         fully load a game, i.e. also load:
@@ -125,61 +396,95 @@ class GamesManager(object):
          NO_GAME: (db_ok: True, None)
          ERROR: (db_ok: False, None)
         """
-        if not force and game_id in self._games:
-            return (True, self._games[game_id])
-
-        # load game
-        (status, game) = self._db.load_game(game_id)
-        if status == DB_STATUS.ERROR:
-            self._logger.error("Error loading game {}".format(game_id))
+        (db_ok, games) = self.load_games([game_id], force)
+        if not db_ok:
             return (False, None)
-        elif status == DB_STATUS.NO_ROWS:
+        elif game_id not in games:
             self._logger.warning("Game {} not found".format(game_id))
             return (True, None)
+        else:
+            return (True, games[game_id])
 
-        # load players
-        (status, players_ids) = self._db.get_game_players_ids(game_id)
-        if status != DB_STATUS.OK:
-            self._logger.error(("Error loading players ids for game "
-                                "{}").format(game_id))
-            return (False, None)
-
-        game.players_ids = players_ids
-        for player_id in players_ids:
-            if self.get_player(player_id) == None:
-                self._logger.error(("Error loading player {} for game "
-                                    "{}").format(player_id, game_id))
-                return (False, None)
+    @engine.util.log
+    @engine.util.timed_span('gm')
+    def load_games(self, games_ids, force=False):
+        """ load many games, those not already in memory are loaded from the
+        database at once.
 
-        # load extensions
-        (status, ext) = self._db.get_game_ext(game_id)
+        args:
+         games_ids [int, ..., int]: ids of the games to load
+         force (bool): to force the loading of the games from db even if they
+                       are already in memory
+        return:
+         OK: (db_ok (bool): True, {game_id (int): fully loaded Game object}),
+             games not found are missing
+         ERROR: (db_ok: False, None)
+        """
+        games = {}
+        missing = []
+        for game_id in games_ids:
+            game = None if force else self._games.get(game_id)
+            if game is not None:
+                games[game_id] = game
+            else:
+                missing.append(game_id)
+
+        if len(missing) == 0:
+            return (True, games)
+
+        # double-checked load: once the locks are held, the games loaded by
+        # another thread in the meantime are in memory
+        with self._lock_game(*missing):
+            to_load = []
+            for game_id in missing:
+                game = None if force else self._games.peek(game_id)
+                if game is not None:
+                    games[game_id] = game
+                else:
+                    to_load.append(game_id)
+
+            if len(to_load) == 0:
+                return (True, games)
+            return self._load_games_locked(to_load, games)
+
+    def _load_games_locked(self, to_load, games):
+        """ load games from the database, put them in memory.
+        called with the games locks held.
+        args:
+         to_load [int, ..., int]: ids of the games to load
+         games {game_id (int): Game object}: updated with the loaded games
+        return: see load_games
+        """
+        (status, loaded) = self._db.load_games_bulk(to_load)
         if status != DB_STATUS.OK:
-            self._logger.error(("Error loading extensions for game "
-                                "{}").format(game_id))
+            self._logger.error("Error loading games {}".format(to_load))
             return (False, None)
-        game.extensions = ext
 
-        # load states
-        (status, states_ids) = self._db.get_game_states_ids(game_id)
-        if status != DB_STATUS.OK:
-            self._logger.error(("Error loading states ids for game {}"
-                                "").format(game_id))
+        players_ids = set()
+        for game in loaded.values():
+            players_ids.update(game.players_ids)
+        if not self._load_players(players_ids):
+            self._logger.error(("Error loading the players of games {}"
+                                "").format(sorted(loaded)))
             return (False, None)
-        game.states_ids = states_ids
 
-        # load current state
-        (status, state) = self._db.load_state(game.cur_state_id())
-        if status != DB_STATUS.OK:
-            self._logger.error(("Error loading state {} for game {}"
-                                "").format(game.cur_state_id(), game.id_))
-            return (False, None)
-        game.cur_state = state
+        for game_id, game in loaded.items():
+            if game.cur_state is None:
+                self._logger.error(("Error loading state {} for game {}"
+                                    "").format(game.cur_state_id(), game_id))
+                return (False, None)
 
-        self._games[game_id] = game
+        for game_id, game in loaded.items():
+            self._games.put(game_id, game)
+            # a forced reload discards the changes made in memory
+            self._games.mark_clean(game_id)
+            self._close_turn(game_id)
+            games[game_id] = game
 
-        return (True, self._games[game_id])
+        return (True, games)
 
     @engine.util.log
+    @engine.util.timed_span('gm')
     def get_game(self, game_id):
         """
         Returns the game, do NOT load it from database if not already in memory.
@@ -193,55 +498,123 @@ class GamesManager(object):
         return self._games[game_id]
 
     @engine.util.log
+    @engine.util.timed_span('gm')
+    def undo_actions(self, game_id, player_id, count=1):
+        """ undo the last actions of a player turn, in memory, without
+        reloading the state from the database. only the actions not saved
+        yet are undone, see GameState.undo.
+        args:
+         game_id (int)
+         player_id (int): must be the player playing
+         count (int): number of actions to undo, None for the whole turn
+        return:
+         OK: (True, [Action, ...] the undone actions, the last one first)
+         ERROR: (False, []) if the game is not in memory, or if the
+                player has less actions to undo in the current turn
+        """
+        with self._lock_game(game_id):
+            game = self._games.get(game_id)
+            if game is None or game.cur_state is None:
+                self._logger.warning(("Game {} not in memory, nothing to "
+                                      "undo").format(game_id))
+                return (False, [])
+            (undo_ok, undone) = game.cur_state.undo(player_id, count)
+            if not undo_ok:
+                self._logger.warning(("Player {} can't undo {} actions in "
+                                      "game {}").format(player_id, count,
+                                                        game_id))
+            elif len(undone) != 0:
+                self._games.mark_dirty(game_id)
+                self._follow_turn(game)
+            return (undo_ok, undone)
+
+    @engine.util.log
+    @engine.util.timed_span('gm')
+    def play_turn(self, game_id, player_id, actions):
+        """ check and apply actions of a player turn to a game in memory,
+        see GameState.apply_turn. the game is kept in memory from the first
+        action of the turn until the end of the turn or its save: evicted,
+        it would be written back with only a part of the turn.
+        args:
+         game_id (int)
+         player_id (int): must be the player playing
+         actions [Action, ...]
+        return:
+         OK: (True, None)
+         INVALID: (False, index of the first invalid action), nothing is
+                  applied
+         ERROR: (False, None) if the game is not in memory
+        """
+        with self._lock_game(game_id):
+            game = self._games.get(game_id)
+            if game is None or game.cur_state is None:
+                self._logger.warning(("Game {} not in memory, turn not "
+                                      "played").format(game_id))
+                return (False, None)
+            (valid, index) = game.cur_state.apply_turn(actions, player_id)
+            if valid:
+                self._games.mark_dirty(game_id)
+                self._follow_turn(game)
+            return (valid, index)
+
+    def _follow_turn(self, game):
+        """ pin a game while its current player has actions to undo, i.e.
+        during the turn, unpin it at the end of the turn. called with the
+        game lock held.
+        args: game (Game object)
+        """
+        state = game.cur_state
+        if state.undo_size(state.cur_player) == 0:
+            self._close_turn(game.id_)
+        elif game.id_ not in self._open_turns:
+            self._open_turns.add(game.id_)
+            self._games.pin(game.id_)
+
+    def _close_turn(self, game_id):
+        """ unpin a game pinned by _follow_turn, the turn is over or saved.
+        called with the game lock held.
+        args: game_id (int)
+        """
+        if game_id in self._open_turns:
+            self._open_turns.discard(game_id)
+            self._games.unpin(game_id)
+
+    @engine.util.log
+    @engine.util.timed_span('gm')
     def get_my_games(self, player_id):
         """ return the games the player is currently playing
         even the non started ones.
+        the games are listed from the database without being loaded.
         args: player_id (int)
-        return: (db_ok (bool), [game_1, ..., game_n])
+        return: (db_ok (bool), [GameSummary_1, ..., GameSummary_n])
         """
-        status, my_games_ids = self._db.get_my_games_ids(player_id)
+        status, my_games = self._db.get_my_games_summaries(player_id)
         if status != DB_STATUS.OK:
             return (False, None)
 
-        my_games = []
-        for id_ in my_games_ids:
-            db_ok, game = self.load_game(id_)
-            if db_ok and game is not None:
-                my_games.append(game)
-
         return (True, my_games)
 
     @engine.util.log
+    @engine.util.timed_span('gm')
     def get_pub_priv_games(self):
         """ return the not yet started, not ended games, public and private.
+        the games are listed from the database without being loaded.
         args: None
         return:
          OK: (db_ok (bool): True,
-              pubs ([game_1, ..., game_n]),
-              privs ([game_1, ..., game_n]))
+              pubs ([GameSummary_1, ..., GameSummary_n]),
+              privs ([GameSummary_1, ..., GameSummary_n]))
          ERROR: (db_ok (bool): False, None, None)
         """
-        status, ids = self._db.get_pub_priv_games_ids()
-        if status == DB_STATUS.ERROR:
+        status, summaries = self._db.get_pub_priv_games_summaries()
+        if status != DB_STATUS.OK:
             return (False, None, None)
 
-        pub_ids, priv_ids = ids
-
-        pub_games = []
-        for id_ in pub_ids:
-            db_ok, game = self.load_game(id_)
-            if db_ok and game is not None:
-                pub_games.append(game)
-
-        priv_games = []
-        for id_ in priv_ids:
-            db_ok, game = self.load_game(id_)
-            if db_ok and game is not None:
-                priv_games.append(game)
-
+        pub_games, priv_games = summaries
         return (True, pub_games, priv_games)
 
     @engine.util.log
+    @engine.util.timed_span('gm')
     def _load_player(self, player_id):
         """ load a player from the database.
         args: player_id (int)
@@ -254,10 +627,34 @@ class GamesManager(object):
         if status != DB_STATUS.OK:
             return None
         else:
+            # a single dict assignment is atomic, no need for a lock
             self._web_players[player_id] = player
             return player_id
 
+    def _load_players(self, players_ids):
+        """ load at once the players not already in memory.
+        args: players_ids [int, ..., int]
+        return: True if all the players are in memory
+        """
+        missing = [player_id for player_id in players_ids
+                   if player_id not in self._web_players]
+        if len(missing) == 0:
+            return True
+
+        # double-checked load, see get_player
+        with self._player_locks(*missing):
+            missing = [player_id for player_id in missing
+                       if player_id not in self._web_players]
+            if len(missing) == 0:
+                return True
+            (status, players) = self._db.load_players(missing)
+            if status != DB_STATUS.OK:
+                return False
+            self._web_players.update(players)
+        return len(players) == len(missing)
+
     @engine.util.log
+    @engine.util.timed_span('gm')
     def get_player(self, player_id):
         """ load player if not present then return it.
         args: player_id (int)
@@ -265,13 +662,21 @@ class GamesManager(object):
          OK: Player object
          ERROR: None
         """
-        if player_id not in self._web_players:
-            if self._load_player(player_id) is None:
-                return None
-
-        return self._web_players[player_id]
+        player = self._web_players.get(player_id)
+        if player is not None:
+            self._players_hits += 1
+            return player
+        self._players_misses += 1
+
+        # double-checked load, a single thread loads the player
+        with self._player_locks(player_id):
+            player = self._web_players.get(player_id)
+            if player is None and self._load_player(player_id) is not None:
+                player = self._web_players[player_id]
+        return player
 
     @engine.util.log
+    @engine.util.timed_span('gm')
     def get_players_infos(self):
         """ get minimal infos (id and name) on all registered players.
         args: None
@@ -286,6 +691,7 @@ class GamesManager(object):
             return players_infos
 
     @engine.util.log
+    @engine.util.timed_span('gm')
     def auth_player(self, email, password):
         """ check player password with the one encrypted in database.
         args:
@@ -302,6 +708,7 @@ class GamesManager(object):
             return (False, None, None)
 
     @engine.util.log
+    @engine.util.timed_span('gm')
     def create_player(self, name, email, password, tz_id):
         """ create a new player in the db.
         args:
@@ -320,6 +727,7 @@ class GamesManager(object):
             return (False, None, None)
 
     @engine.util.log
+    @engine.util.timed_span('gm')
     def update_player(self, player, to_update):
         """ update player email/password/tz_id in the db.
         args:
@@ -333,7 +741,9 @@ class GamesManager(object):
         (status, dummy) = self._db.update_player(player, to_update)
         if status == DB_STATUS.OK:
             # update player in memory
-            if self._load_player(player.id_) is None:
+            with self._player_locks(player.id_):
+                loaded = self._load_player(player.id_)
+            if loaded is None:
                 return (False, True)
             else:
                 return (True, True)
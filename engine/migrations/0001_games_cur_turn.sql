@@ -0,0 +1,19 @@
+--Copyright (C) 2012-2013  manu, adri
+--
+--This program is free software: you can redistribute it and/or modify
+--it under the terms of the GNU General Public License as published by
+--the Free Software Foundation, either version 3 of the License, or
+--(at your option) any later version.
+--
+--This program is distributed in the hope that it will be useful,
+--but WITHOUT ANY WARRANTY; without even the implied warranty of
+--MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+--GNU General Public License for more details.
+--
+--You should have received a copy of the GNU General Public License
+--along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+-- turn of the current state, to list games without loading their state.
+-- existing games start at 0, updated on their next save.
+ALTER TABLE games ADD COLUMN cur_turn INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,47 @@
+--Copyright (C) 2012-2013  manu, adri
+--
+--This program is free software: you can redistribute it and/or modify
+--it under the terms of the GNU General Public License as published by
+--the Free Software Foundation, either version 3 of the License, or
+--(at your option) any later version.
+--
+--This program is distributed in the hope that it will be useful,
+--but WITHOUT ANY WARRANTY; without even the implied warranty of
+--MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+--GNU General Public License for more details.
+--
+--You should have received a copy of the GNU General Public License
+--along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+-- states are stored as snapshots or as the actions applied since the
+-- previous state: the pickle of a state becomes optional.
+-- sqlite can't drop a NOT NULL constraint, so rebuild the table and keep
+-- its autoincrement sequence.
+CREATE TEMP TABLE state_seq AS
+    SELECT seq FROM sqlite_sequence WHERE name = 'state';
+
+CREATE TABLE state_new (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_id INTEGER NOT NULL,
+    pickle BLOB,
+    FOREIGN KEY(game_id) REFERENCES games(id)
+);
+INSERT INTO state_new (id, game_id, pickle)
+    SELECT id, game_id, pickle FROM state;
+DROP TABLE state;
+ALTER TABLE state_new RENAME TO state;
+
+DELETE FROM sqlite_sequence WHERE name = 'state';
+INSERT INTO sqlite_sequence (name, seq) SELECT 'state', seq FROM state_seq;
+DROP TABLE state_seq;
+
+CREATE TABLE IF NOT EXISTS actions (
+    game_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    state_id INTEGER NOT NULL,
+    pickle BLOB NOT NULL,
+    PRIMARY KEY(game_id, seq),
+    FOREIGN KEY(game_id) REFERENCES games(id),
+    FOREIGN KEY(state_id) REFERENCES state(id)
+);
@@ -0,0 +1,24 @@
+--Copyright (C) 2012-2013  manu, adri
+--
+--This program is free software: you can redistribute it and/or modify
+--it under the terms of the GNU General Public License as published by
+--the Free Software Foundation, either version 3 of the License, or
+--(at your option) any later version.
+--
+--This program is distributed in the hope that it will be useful,
+--but WITHOUT ANY WARRANTY; without even the implied warranty of
+--MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+--GNU General Public License for more details.
+--
+--You should have received a copy of the GNU General Public License
+--along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+-- indexes used by the queries of DBInterface, see db.sql
+CREATE INDEX IF NOT EXISTS games_lobby ON games(started, private, name);
+CREATE INDEX IF NOT EXISTS games_players_game ON games_players(game_id, player_id);
+CREATE INDEX IF NOT EXISTS games_players_player ON games_players(player_id, game_id);
+CREATE INDEX IF NOT EXISTS games_extensions_game ON games_extensions(game_id, extension_id);
+CREATE INDEX IF NOT EXISTS state_game ON state(game_id, id);
+CREATE INDEX IF NOT EXISTS state_snapshots ON state(game_id, id) WHERE pickle IS NOT NULL;
+ANALYZE;
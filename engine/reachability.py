@@ -0,0 +1,184 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from array import array
+from collections import OrderedDict, deque
+
+# Where the ships can move on a galaxy map, see engine/galaxy.py.
+#
+# A ship moves from hex to hex through the wormholes, one hex per movement
+# point of its drives. A ship entering a hex with enemy ships is pinned, it
+# can't leave the hex: these hexes are the blockers of a move.
+#
+# Validating the moves of a turn, or trying many moves, asks the same
+# questions again and again, so the answers are cached:
+#  -the hexes reachable from a hex with a drive range and blockers, the
+#   cache remembers the hexes each search went through, a change of a hex
+#   only drops the searches which went through it or next to it, and a
+#   change of the ships of a hex the searches it blocked
+#  -the distances between every two hexes without blockers, computed for
+#   the whole map at once when a distance is asked after a change of the
+#   map
+
+# searches kept in the cache
+DEFAULT_MAX_SEARCHES = 4096
+
+# distance of the hexes not linked, in the distances table
+UNREACHABLE = 0xffff
+
+class Reachability(object):
+    """
+    The reachability cache of a galaxy map, it follows the changes of the
+    map by itself, the changes of the ships must be given to ships_changed.
+
+    attributes:
+      self.hits (int): searches found in the cache
+      self.misses (int): searches computed
+    """
+    def __init__(self, galaxy, max_searches=DEFAULT_MAX_SEARCHES):
+        self.galaxy = galaxy
+        self.max_searches = max_searches
+        self.hits = 0
+        self.misses = 0
+        # version of the map of the cached searches
+        self._version = galaxy.version
+        # (start, drive, blockers, half) -> {index: jumps}, least recently
+        # used first
+        self._searches = OrderedDict()
+        # index -> {key, ...} of the searches which left the hex
+        self._expanded = {}
+        # index -> {key, ...} of the searches with the hex in their blockers
+        self._blocked = {}
+        # half (bool) -> (version, array of the distances, n * n entries)
+        self._distances = {}
+
+    def _sync(self):
+        """ drop the searches outdated by the changes of the map """
+        galaxy = self.galaxy
+        if galaxy.version == self._version:
+            return
+        changed = galaxy.changes_since(self._version)
+        for index in list(changed):
+            changed.update(galaxy.neighbors(index))
+        for index in changed:
+            for key in list(self._expanded.get(index, ())):
+                self._drop(key)
+        self._version = galaxy.version
+
+    def _drop(self, key):
+        """ remove a search from the cache and from the reverse indexes """
+        reached = self._searches.pop(key)
+        (start, drive, blockers, _) = key
+        for index, jumps in reached.items():
+            if jumps < drive and index not in blockers:
+                self._expanded[index].discard(key)
+        for index in blockers:
+            self._blocked[index].discard(key)
+
+    def _store(self, key, reached):
+        """ add a search to the cache, evicting the oldest ones """
+        (start, drive, blockers, _) = key
+        self._searches[key] = reached
+        for index, jumps in reached.items():
+            if jumps < drive and index not in blockers:
+                self._expanded.setdefault(index, set()).add(key)
+        for index in blockers:
+            self._blocked.setdefault(index, set()).add(key)
+        while len(self._searches) > self.max_searches:
+            self._drop(next(iter(self._searches)))
+
+    def ships_changed(self, index):
+        """ the ships of a hex changed, it's no longer a blocker or became
+        one: drop the searches made with the old blockers.
+        args: index (int): index of the hex
+        """
+        for key in list(self._blocked.get(index, ())):
+            self._drop(key)
+
+    def reachable(self, start, drive, blockers=frozenset(), half=False):
+        """ the hexes a ship can move to.
+        args:
+         start (int): index of the hex of the ship
+         drive (int): movement points of the ship
+         blockers (frozenset): indexes of the hexes the ship can't leave,
+                               a ship pinned in start can't move
+         half (bool): the half connections can be used, with the wormhole
+                      generator technology
+        return: {index: jumps to reach it}, start included, do not modify
+        """
+        self._sync()
+        key = (start, drive, blockers, half)
+        reached = self._searches.get(key)
+        if reached is not None:
+            self.hits += 1
+            self._searches.move_to_end(key)
+            return reached
+        self.misses += 1
+
+        reached = {start: 0}
+        queue = deque([start])
+        while len(queue) != 0:
+            index = queue.popleft()
+            jumps = reached[index]
+            if jumps == drive or index in blockers:
+                continue
+            for neighbor in self.galaxy.connected(index, half):
+                if neighbor not in reached:
+                    reached[neighbor] = jumps + 1
+                    queue.append(neighbor)
+        self._store(key, reached)
+        return reached
+
+    def can_reach(self, start, end, drive, blockers=frozenset(), half=False):
+        """ return: True if a ship can move from start to end, see
+        reachable
+        """
+        if len(blockers) == 0:
+            # no search needed
+            return self.distance(start, end, half) <= drive
+        return end in self.reachable(start, drive, blockers, half)
+
+    def distance(self, start, end, half=False):
+        """ return: the jumps between two hexes without blockers,
+        UNREACHABLE if they aren't linked
+        """
+        table = self._distances.get(half)
+        if table is None or table[0] != self.galaxy.version:
+            table = (self.galaxy.version, self._all_distances(half))
+            self._distances[half] = table
+        return table[1][start * len(self.galaxy) + end]
+
+    def _all_distances(self, half):
+        """ return: array of the distances between the hexes, a breadth
+        first search from each hex
+        """
+        galaxy = self.galaxy
+        size = len(galaxy)
+        distances = array('H', [UNREACHABLE]) * (size * size)
+        connected = [galaxy.connected(index, half) for index in range(size)]
+        for start in range(size):
+            row = start * size
+            distances[row + start] = 0
+            queue = deque([start])
+            while len(queue) != 0:
+                index = queue.popleft()
+                jumps = distances[row + index] + 1
+                for neighbor in connected[index]:
+                    if distances[row + neighbor] == UNREACHABLE:
+                        distances[row + neighbor] = jumps
+                        queue.append(neighbor)
+        return distances
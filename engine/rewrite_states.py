@@ -0,0 +1,51 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+One-shot tool rewriting the states stored as raw pickles with the state
+codec, run it with the web server stopped:
+  python -m engine.rewrite_states [--db PATH] [--codec zlib|lzma]
+"""
+
+import argparse
+import sys
+import engine.db
+from engine.db import DB_STATUS, STATE_CODECS
+
+_CODECS = {'none': STATE_CODECS.NONE,
+           'zlib': STATE_CODECS.ZLIB,
+           'lzma': STATE_CODECS.LZMA}
+
+def main(argv=None):
+    """ parse the command line and rewrite the legacy states """
+    parser = argparse.ArgumentParser(description=('rewrite the legacy '
+                                                  'states with the codec'))
+    parser.add_argument('--db', default=None,
+                        help='database file, default to the server one')
+    parser.add_argument('--codec', choices=sorted(_CODECS), default='zlib')
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args(argv)
+
+    db = engine.db.DBInterface(db_path=args.db,
+                               state_codec=_CODECS[args.codec])
+    status, rewritten = db.rewrite_legacy_states(args.batch_size)
+    if status != DB_STATUS.OK:
+        print('Error while rewriting the states, see the log file')
+        return 1
+    print('{} states rewritten'.format(rewritten))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
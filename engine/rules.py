@@ -0,0 +1,466 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from engine.galaxy import DIRECTIONS
+
+# The action engine behind GameState.is_action_valid, apply_action,
+# apply_turn and apply_game_turn.
+#
+# An action moves an element from a zone to another, see Action. The
+# elements and the zones are values, or tuples whose first item is their
+# kind:
+#  element                       zones
+#  'turn'                        the old and the new turn (int)
+#  'cur_player'                  the old and the new player id, None when
+#                                nobody plays
+#  (resource, player id)         the old and the new storage (int), with
+#                                resource in RESOURCES
+#  ('influence', player id)      'track', 'action', ('hex', hex id)
+#  ('ship', ship id)             'reserve', ('hex', hex id)
+#  ('hex', hex id)               'stack', ('pos', q, r, rotation)
+#
+# The actions are dispatched on their kinds: the checks are looked up by
+# (element kind, old zone kind, new zone kind), the moves by element kind.
+# Both read and write the state through a view, by keys (name, id):
+#  -StateView reads and writes the state itself, to apply the actions
+#  -Turn reads the state under the values written by the actions already
+#   checked, and keeps them: the actions of a player turn are checked one
+#   after the other without modifying the state, then applied at once
+# A player only plays during their turn, while being the cur_player of the
+# state. The actions of the game itself are checked by the turns made with
+# Turn.of_game, the only ones allowed to move the elements of every player.
+# A check only reads a few keys and the cached reachability of the ships,
+# checking an action costs the same whatever the actions checked before it.
+#
+# apply_action doesn't check anything, the actions of the actions log are
+# replayed as they were played.
+
+RESOURCES = ('money', 'science', 'materials')
+
+# resources given for one resource of another type
+TRADE_RATE = 3
+
+# ship type -> (cost in materials, movement points)
+SHIP_TYPES = {'interceptor': (3, 1),
+              'cruiser': (5, 1),
+              'dreadnought': (8, 1),
+              'starbase': (3, 0)}
+
+MAX_TURN = 9
+
+def kind(value):
+    """ return: the kind of an element or of a zone, None if unknown """
+    if isinstance(value, tuple) and len(value) != 0:
+        return value[0]
+    if isinstance(value, str):
+        return value
+    if value is None or isinstance(value, int):
+        return 'value'
+    return None
+
+# readers and writers of the keys of the views
+
+def _get_turn(state, _):
+    return state.cur_turn
+
+def _set_turn(state, _, value):
+    state.cur_turn = value
+
+def _get_cur_player(state, _):
+    return state.cur_player
+
+def _set_cur_player(state, _, value):
+    state.cur_player = value
+
+def _resource_key(resource):
+    """ return: the reader and the writer of a player resource """
+    def get(state, player_id):
+        return getattr(state.players[player_id], resource)
+    def set_(state, player_id, value):
+        setattr(state.players[player_id], resource, value)
+    return (get, set_)
+
+def _get_track(state, player_id):
+    return state.players[player_id].influence
+
+def _set_track(state, player_id, value):
+    state.players[player_id].influence = value
+
+def _get_actions(state, player_id):
+    return state.players[player_id].actions
+
+def _set_actions(state, player_id, value):
+    state.players[player_id].actions = value
+
+def _get_owner(state, hex_id):
+    return state.hexes[hex_id].influence
+
+def _set_owner(state, hex_id, value):
+    state.hexes[hex_id].influence = value
+
+def _get_ship(state, ship_id):
+    return state.ships[ship_id].hex_id
+
+def _set_ship(state, ship_id, hex_id):
+    state.move_ship(state.ships[ship_id], hex_id)
+
+def _get_pos(state, hex_id):
+    hex_ = state.hexes[hex_id]
+    if hex_.q is None:
+        return None
+    return (hex_.q, hex_.r, hex_.rotation)
+
+def _set_pos(state, hex_id, pos):
+    state.move_hex(state.hexes[hex_id], pos)
+
+def _get_at(state, pos):
+    hex_ = state.galaxy.hex_at(pos)
+    if hex_ is None:
+        return None
+    return hex_.id_
+
+def _set_at(state, pos, hex_id):
+    # follows the hexes positions
+    pass
+
+# key name -> (reader, writer)
+_KEYS = {'turn': (_get_turn, _set_turn),
+         'cur_player': (_get_cur_player, _set_cur_player),
+         'track': (_get_track, _set_track),
+         'actions': (_get_actions, _set_actions),
+         'owner': (_get_owner, _set_owner),
+         'ship': (_get_ship, _set_ship),
+         'pos': (_get_pos, _set_pos),
+         'at': (_get_at, _set_at)}
+for _resource in RESOURCES:
+    _KEYS[_resource] = _resource_key(_resource)
+
+class StateView(object):
+    """ reads and writes a state by keys """
+    def __init__(self, state):
+        self.state = state
+
+    def get(self, key):
+        """ return: the value of a key (name, id) """
+        return _KEYS[key[0]][0](self.state, key[1])
+
+    def set(self, key, value):
+        """ change the value of a key (name, id) """
+        _KEYS[key[0]][1](self.state, key[1], value)
+
+# the moves, by element kind
+
+def _zone_key(player_id, zone):
+    """ return: the key counting the influence discs of a zone """
+    if zone == 'track':
+        return ('track', player_id)
+    return ('actions', player_id)
+
+def _move_influence(view, action):
+    player_id = action.element[1]
+    for zone, step in ((action.old_zone, -1), (action.new_zone, 1)):
+        if kind(zone) == 'hex':
+            view.set(('owner', zone[1]), player_id if step == 1 else None)
+        else:
+            key = _zone_key(player_id, zone)
+            view.set(key, view.get(key) + step)
+
+def _move_ship(view, action):
+    hex_id = None
+    if kind(action.new_zone) == 'hex':
+        hex_id = action.new_zone[1]
+    view.set(('ship', action.element[1]), hex_id)
+
+def _move_hex(view, action):
+    hex_id = action.element[1]
+    if kind(action.old_zone) == 'pos':
+        view.set(('at', action.old_zone[1:3]), None)
+    pos = None
+    if kind(action.new_zone) == 'pos':
+        pos = action.new_zone[1:]
+        view.set(('at', pos[:2]), hex_id)
+    view.set(('pos', hex_id), pos)
+
+def _move_value(view, action):
+    view.set((kind(action.element), _element_id(action.element)),
+             action.new_zone)
+
+def _element_id(element):
+    """ return: the id of an element, None for the markers """
+    if isinstance(element, tuple) and len(element) > 1:
+        return element[1]
+    return None
+
+_MOVES = {'turn': _move_value,
+          'cur_player': _move_value,
+          'influence': _move_influence,
+          'ship': _move_ship,
+          'hex': _move_hex}
+for _resource in RESOURCES:
+    _MOVES[_resource] = _move_value
+
+# the checks, by (element kind, old zone kind, new zone kind), called with
+# (turn, action), the is_game of the Turn being True for the actions of the
+# game. a check returns False before changing the turn
+
+def _game_only(check):
+    """ a check of the actions only the game makes """
+    def game_check(turn, action):
+        return turn.is_game and check(turn, action)
+    return game_check
+
+def _is_owner(turn, player_id):
+    """ return: True if the turn can move the elements of a player """
+    return turn.is_game or turn.player_id == player_id
+
+def _check_turn(turn, action):
+    return (turn.get(('turn', None)) == action.old_zone
+            and action.new_zone == action.old_zone + 1
+            and action.new_zone <= MAX_TURN)
+
+def _check_cur_player(turn, action):
+    return (turn.get(('cur_player', None)) == action.old_zone
+            and (action.new_zone is None
+                 or action.new_zone in turn.state.players))
+
+def _check_resource(turn, action):
+    (resource, player_id) = action.element
+    if (player_id not in turn.state.players
+            or not _is_owner(turn, player_id)
+            or turn.get((resource, player_id)) != action.old_zone
+            or action.new_zone < 0):
+        return False
+    if turn.is_game:
+        return True
+    # the tokens taken back from the storage are available for the next
+    # actions, the ones put on the storage are paid with them
+    if action.new_zone < action.old_zone:
+        turn.available[resource] += action.old_zone - action.new_zone
+        return True
+    return turn.pay(resource, action.new_zone - action.old_zone)
+
+def _hex_placed(turn, zone):
+    """ return: True if a zone ('hex', hex id) is a hex of the map """
+    return (zone[1] in turn.state.hexes
+            and turn.get(('pos', zone[1])) is not None)
+
+def _check_influence_put(turn, action):
+    player_id = action.element[1]
+    if player_id not in turn.state.players or not _is_owner(turn, player_id):
+        return False
+    if turn.get(_zone_key(player_id, action.old_zone)) <= 0:
+        return False
+    if kind(action.new_zone) == 'hex':
+        return (_hex_placed(turn, action.new_zone)
+                and turn.get(('owner', action.new_zone[1])) is None)
+    return True
+
+def _check_influence_back(turn, action):
+    player_id = action.element[1]
+    if player_id not in turn.state.players or not _is_owner(turn, player_id):
+        return False
+    if kind(action.old_zone) == 'hex':
+        return (action.old_zone[1] in turn.state.hexes
+                and turn.get(('owner', action.old_zone[1])) == player_id)
+    return turn.get(_zone_key(player_id, action.old_zone)) > 0
+
+def _ship(turn, action):
+    """ return: the Ship of an action, None if unknown or not owned """
+    ship = turn.state.ships.get(action.element[1])
+    if ship is None or not _is_owner(turn, ship.owner):
+        return None
+    return ship
+
+def _check_ship_build(turn, action):
+    ship = _ship(turn, action)
+    if (ship is None or turn.get(('ship', ship.id_)) is not None
+            or not _hex_placed(turn, action.new_zone)):
+        return False
+    if turn.is_game:
+        return True
+    return turn.pay('materials', SHIP_TYPES[ship.type_][0])
+
+def _check_ship_move(turn, action):
+    ship = _ship(turn, action)
+    if (ship is None or turn.get(('ship', ship.id_)) != action.old_zone[1]
+            or action.new_zone[1] not in turn.state.hexes):
+        return False
+    galaxy = turn.state.galaxy
+    start = galaxy.index_of(action.old_zone[1])
+    end = galaxy.index_of(action.new_zone[1])
+    if start is None or end is None:
+        return False
+    return turn.state.reachability.can_reach(
+        start, end, SHIP_TYPES[ship.type_][1],
+        turn.state.blockers(ship.owner))
+
+def _check_ship_destroyed(turn, action):
+    ship = _ship(turn, action)
+    return (ship is not None
+            and turn.get(('ship', ship.id_)) == action.old_zone[1])
+
+def _check_explore(turn, action):
+    hex_id = action.element[1]
+    if hex_id not in turn.state.hexes or turn.get(('pos', hex_id)) is not None:
+        return False
+    if len(action.new_zone) != 4 or action.new_zone[3] not in range(6):
+        return False
+    (q, r) = action.new_zone[1:3]
+    if turn.get(('at', (q, r))) is not None:
+        return False
+    # next to an explored hex, or the first hex of the galaxy
+    return (len(turn.state.galaxy) == 0
+            or any(turn.get(('at', (q + dq, r + dr))) is not None
+                   for (dq, dr) in DIRECTIONS))
+
+def _check_rotate(turn, action):
+    hex_id = action.element[1]
+    return (hex_id in turn.state.hexes
+            and turn.get(('pos', hex_id)) == action.old_zone[1:]
+            and len(action.new_zone) == 4
+            and action.new_zone[1:3] == action.old_zone[1:3]
+            and action.new_zone[3] in range(6))
+
+def _check_unexplore(turn, action):
+    hex_id = action.element[1]
+    return (hex_id in turn.state.hexes
+            and turn.get(('pos', hex_id)) == action.old_zone[1:])
+
+_CHECKS = {('turn', 'value', 'value'): _game_only(_check_turn),
+           ('cur_player', 'value', 'value'): _check_cur_player,
+           ('influence', 'track', 'action'): _check_influence_put,
+           ('influence', 'track', 'hex'): _check_influence_put,
+           ('influence', 'hex', 'track'): _check_influence_back,
+           ('influence', 'action', 'track'): _game_only(_check_influence_back),
+           ('ship', 'reserve', 'hex'): _check_ship_build,
+           ('ship', 'hex', 'hex'): _check_ship_move,
+           ('ship', 'hex', 'reserve'): _game_only(_check_ship_destroyed),
+           ('hex', 'stack', 'pos'): _check_explore,
+           ('hex', 'pos', 'pos'): _check_rotate,
+           ('hex', 'pos', 'stack'): _game_only(_check_unexplore)}
+for _resource in RESOURCES:
+    _CHECKS[(_resource, 'value', 'value')] = _check_resource
+
+def dispatch(action):
+    """ return: (check, move) of an action, (None, None) if unknown """
+    key = (kind(action.element), kind(action.old_zone),
+           kind(action.new_zone))
+    check = _CHECKS.get(key)
+    if check is None:
+        return (None, None)
+    return (check, _MOVES[key[0]])
+
+def apply_action(state, action):
+    """ apply an action to a state, without checking it.
+    raise: ValueError for an unknown action
+    """
+    (check, move) = dispatch(action)
+    if move is None:
+        raise ValueError('Unknown action {!r} {!r} {!r}'.format(
+            action.element, action.old_zone, action.new_zone))
+    move(StateView(state), action)
+
+class Turn(StateView):
+    """
+    The actions of a player turn, or of a game turn made by of_game, checked
+    one after the other by add against the state modified by the previous
+    ones, see the module comment. The state is only modified by commit.
+
+    attributes:
+      self.player_id (int): the player playing, None for the game
+      self.is_game (bool): True for a game turn, its actions are not the
+                           ones of a player
+      self.actions [Action, ...]: the checked actions
+      self.available {resource: int}: the resources taken from the storages
+                     and not spent yet
+    """
+    def __init__(self, state, player_id):
+        StateView.__init__(self, state)
+        self.player_id = player_id
+        self.is_game = False
+        self.actions = []
+        self.available = dict.fromkeys(RESOURCES, 0)
+        # key -> value written by the checked actions
+        self._values = {}
+
+    @classmethod
+    def of_game(cls, state):
+        """ return: the Turn of the actions of the game, moving the elements
+        of every player at any time
+        """
+        turn = cls(state, None)
+        turn.is_game = True
+        return turn
+
+    def get(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            return StateView.get(self, key)
+
+    def set(self, key, value):
+        self._values[key] = value
+
+    def pay(self, resource, amount):
+        """ spend available resources, the missing ones are traded with the
+        other available resources.
+        return: False if not enough resources are available, nothing is
+                spent then
+        """
+        available = self.available
+        missing = max(0, amount - available[resource])
+        trades = {}
+        for other in RESOURCES:
+            if missing == 0:
+                break
+            if other != resource:
+                traded = min(missing, available[other] // TRADE_RATE)
+                trades[other] = traded
+                missing -= traded
+        if missing != 0:
+            return False
+        available[resource] -= min(amount, available[resource])
+        for other, traded in trades.items():
+            available[other] -= traded * TRADE_RATE
+        return True
+
+    def add(self, action):
+        """ check an action, and keep it if valid.
+        return: True if the action is valid
+        """
+        if not self.is_game and (self.player_id is None
+                                 or self.get(('cur_player', None))
+                                 != self.player_id):
+            # not the player turn, or no longer after passing it
+            return False
+        (check, move) = dispatch(action)
+        try:
+            valid = check is not None and check(self, action)
+        except (KeyError, TypeError, IndexError, AttributeError):
+            # ids of unknown players, hexes or ships, or zones badly built
+            valid = False
+        if not valid:
+            return False
+        move(self, action)
+        self.actions.append(action)
+        return True
+
+    def commit(self):
+        """ apply the checked actions to the state """
+        view = StateView(self.state)
+        for action in self.actions:
+            _MOVES[kind(action.element)](view, action)
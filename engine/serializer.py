@@ -0,0 +1,264 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import marshal
+import engine.util
+from engine.data_types import (Action, GameState, Hex, Planet, Player, PopSlot,
+                               Ship)
+
+# Binary serializer of the game states, driven by the schemas declared at
+# the end of this module.
+#
+# The schemas are declared leaves first, each schema is compiled after the
+# schemas of its nested fields.
+#
+# An object is flattened to a record, the tuple (schema version, field 1,
+# ..., field n) with its fields in the schema order, then the records are
+# dumped with marshal.
+#
+# Schema evolution: a field is never removed nor moved, a new field is
+# appended to its schema with since set to the new schema version. A
+# record written with an older version gets the defaults of the fields
+# added since.
+
+# marshal format used to dump the records
+MARSHAL_VERSION = 4
+
+# kind of the fields
+FIELD_KINDS = engine.util.enum(VALUE=0, OBJECT=1, LIST=2, DICT=3)
+
+class Field(object):
+    """
+    A field of a schema:
+     -name: name of the object attribute
+     -kind: FIELD_KINDS
+       -VALUE: None, bool, int, float, str, bytes, or lists, tuples, dicts,
+               sets of them
+       -OBJECT: an object of type_, or None
+       -LIST: a list of objects of type_
+       -DICT: a dict of objects of type_, the keys are values
+     -type_: class of the objects for OBJECT/LIST/DICT fields
+     -since: first schema version having the field
+     -default: value of the field when reading an older record, a callable
+               returning the value for mutable defaults
+    """
+    def __init__(self, name, kind=FIELD_KINDS.VALUE, type_=None, since=1,
+                 default=None):
+        self.name = name
+        self.kind = kind
+        self.type_ = type_
+        self.since = since
+        if default is None and kind == FIELD_KINDS.LIST:
+            default = list
+        elif default is None and kind == FIELD_KINDS.DICT:
+            default = dict
+        self.default = default
+
+    def get_default(self):
+        """ return: the value of the field missing in an old record """
+        if callable(self.default):
+            return self.default()
+        return self.default
+
+class Schema(object):
+    """
+    The fields of a class, version is the current version of the schema,
+    the one used to write the records.
+
+    flatten and unflatten are generated by compile() for the current
+    version, unflatten falls back to a slower generic reader for the
+    records written with an older version.
+    """
+    def __init__(self, cls, version, fields):
+        self.cls = cls
+        self.version = version
+        self.fields = fields
+        if any(field.since > version for field in fields):
+            raise ValueError(('Schema of {} has fields newer than its '
+                              'version').format(cls.__name__))
+        # version -> (names, nested, missing fields) to read a record
+        self._readers = {}
+
+    def compile(self):
+        """ generate flatten and unflatten, the schemas of the nested
+        fields must be compiled first.
+        """
+        namespace = {'cls': self.cls, 'new': object.__new__,
+                     'old_version': self._unflatten_version}
+        values = []
+        attrs = []
+        for index, field in enumerate(self.fields, 1):
+            get = 'obj.{}'.format(field.name)
+            item = 'record[{}]'.format(index)
+            if field.kind != FIELD_KINDS.VALUE:
+                schema = _SCHEMAS[field.type_]
+                namespace['flatten_{}'.format(index)] = schema.flatten
+                namespace['unflatten_{}'.format(index)] = schema.unflatten
+            if field.kind == FIELD_KINDS.LIST:
+                get = '[flatten_{0}(x) for x in {1}]'.format(index, get)
+                item = '[unflatten_{0}(x) for x in {1}]'.format(index, item)
+            elif field.kind == FIELD_KINDS.DICT:
+                get = ('{{k: flatten_{0}(v) for k, v in {1}.items()}}'
+                       '').format(index, get)
+                item = ('{{k: unflatten_{0}(v) for k, v in {1}.items()}}'
+                        '').format(index, item)
+            elif field.kind == FIELD_KINDS.OBJECT:
+                get = ('None if {1} is None else flatten_{0}({1})'
+                       '').format(index, get)
+                item = ('None if {1} is None else unflatten_{0}({1})'
+                        '').format(index, item)
+            values.append(get)
+            attrs.append('    obj.{} = {}\n'.format(field.name, item))
+
+        # the attributes are set one by one, the state objects have
+        # __slots__ and no __dict__
+        source = ('def flatten(obj):\n'
+                  '    return ({}, {})\n'
+                  'def unflatten(record):\n'
+                  '    if record[0] != {} or len(record) != {}:\n'
+                  '        return old_version(record)\n'
+                  '    obj = new(cls)\n'
+                  '{}'
+                  '    return obj\n'
+                  '').format(self.version, ', '.join(values), self.version,
+                             len(self.fields) + 1, ''.join(attrs))
+        exec(source, namespace)
+        self.flatten = namespace['flatten']
+        self.unflatten = namespace['unflatten']
+
+    def flatten(self, obj):
+        """ return: the record of an object """
+        raise RuntimeError('Schema of {} not compiled'.format(self.cls.__name__))
+
+    def unflatten(self, record):
+        """ return: the object of a record """
+        raise RuntimeError('Schema of {} not compiled'.format(self.cls.__name__))
+
+    def _unflatten_version(self, record):
+        """ return: the object of a record written with any version """
+        (names, nested, missing) = self._reader(record[0])
+        if len(record) != len(names) + 1:
+            raise ValueError(('Corrupted {} record, {} fields instead of {}'
+                              '').format(self.cls.__name__, len(record) - 1,
+                                         len(names)))
+        values = list(record[1:])
+        for index, field in nested:
+            value = values[index]
+            schema = _SCHEMAS[field.type_]
+            if field.kind == FIELD_KINDS.LIST:
+                values[index] = [schema.unflatten(item) for item in value]
+            elif field.kind == FIELD_KINDS.DICT:
+                values[index] = {key: schema.unflatten(item)
+                                 for key, item in value.items()}
+            elif value is not None:
+                values[index] = schema.unflatten(value)
+
+        obj = self.cls.__new__(self.cls)
+        for name, value in zip(names, values):
+            setattr(obj, name, value)
+        for field in missing:
+            setattr(obj, field.name, field.get_default())
+        return obj
+
+    def _reader(self, version):
+        """ return: the fields in a record of the given version """
+        reader = self._readers.get(version)
+        if reader is None:
+            if not 1 <= version <= self.version:
+                raise ValueError(('Unknown {} schema version {}'
+                                  '').format(self.cls.__name__, version))
+            fields = [field for field in self.fields
+                      if field.since <= version]
+            nested = [(index, field) for index, field in enumerate(fields)
+                      if field.kind != FIELD_KINDS.VALUE]
+            missing = [field for field in self.fields
+                       if field.since > version]
+            reader = ([field.name for field in fields], nested, missing)
+            self._readers[version] = reader
+        return reader
+
+def encode(obj, cls=GameState):
+    """ serialize an object.
+    args:
+     obj: object to serialize
+     cls: expected class of the object, it's not stored in the output
+    return: bytes
+    """
+    if type(obj) is not cls:
+        raise TypeError('Expected {}, got {}'.format(cls.__name__,
+                                                     type(obj).__name__))
+    return marshal.dumps(_SCHEMAS[cls].flatten(obj), MARSHAL_VERSION)
+
+def decode(data, cls=GameState):
+    """ deserialize an object serialized by encode.
+    args:
+     data (bytes)
+     cls: class of the serialized object
+    return: object of type cls
+    raise: ValueError if the data is corrupted
+    """
+    try:
+        record = marshal.loads(data)
+        return _SCHEMAS[cls].unflatten(record)
+    except (EOFError, TypeError, IndexError, AttributeError) as err:
+        raise ValueError('Corrupted {}: {}'.format(cls.__name__, err))
+
+_SCHEMAS = {schema.cls: schema for schema in [
+    Schema(Action, 1, [Field('element'),
+                       Field('old_zone'),
+                       Field('new_zone')]),
+    Schema(Player, 2, [Field('id_'),
+                       Field('name'),
+                       Field('race'),
+                       Field('races_wishes', default=list),
+                       Field('money', since=2, default=0),
+                       Field('science', since=2, default=0),
+                       Field('materials', since=2, default=0),
+                       Field('influence', since=2, default=0),
+                       Field('actions', since=2, default=0)]),
+    Schema(PopSlot, 1, [Field('id_'),
+                        Field('type_'),
+                        Field('star'),
+                        Field('pop_owner')]),
+    Schema(Planet, 1, [Field('id_'),
+                       Field('slots', FIELD_KINDS.LIST, PopSlot)]),
+    Schema(Hex, 2, [Field('id_'),
+                    Field('influence'),
+                    Field('wormholes'),
+                    Field('planets', FIELD_KINDS.LIST, Planet),
+                    Field('rotation'),
+                    Field('q', since=2),
+                    Field('r', since=2)]),
+    Schema(Ship, 1, [Field('id_'),
+                     Field('owner'),
+                     Field('type_'),
+                     Field('hex_id')]),
+    Schema(GameState, 2, [Field('id_'),
+                          Field('game_phase'),
+                          Field('turn_phase'),
+                          Field('cur_turn'),
+                          Field('cur_actions', FIELD_KINDS.LIST, Action),
+                          Field('players', FIELD_KINDS.DICT, Player),
+                          Field('players_order', default=list),
+                          Field('num_players'),
+                          Field('cur_player', since=2),
+                          Field('hexes', FIELD_KINDS.DICT, Hex, since=2),
+                          Field('ships', FIELD_KINDS.DICT, Ship, since=2)]),
+]}
+
+for _schema in _SCHEMAS.values():
+    _schema.compile()
@@ -0,0 +1,118 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import unittest
+import engine.bench.dataset as dataset
+import engine.bench.hot_paths as hot_paths
+import engine.db
+from engine.db import DB_STATUS
+import engine.util
+
+engine.util.init_logging(test_mode=True)
+_LOGGER = logging.getLogger('ecbb.tests')
+
+class TestDataset(unittest.TestCase):
+    """ test the synthetic databases generator """
+    def test_generate(self):
+        """ methods tested:
+        generate
+        """
+        _LOGGER.info('===BEGIN TEST_GENERATE===')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, name)
+                     for name in ('1.db', '2.db', '3.db')]
+            counts = dataset.generate(paths[0], 50, 40, seed=1, actions=True)
+            self.assertEqual(counts['players'], 50)
+            self.assertEqual(counts['games'], 40)
+            self.assertTrue(counts['games_players'] >= 40)
+            self.assertTrue(counts['state'] >= 40)
+            self.assertEqual(counts['actions'],
+                             counts['state'] * dataset.ACTIONS_PER_TURN)
+            self.assertRaises(FileExistsError, dataset.generate, paths[0])
+
+            # deterministic from the seed
+            dataset.generate(paths[1], 50, 40, seed=1, actions=True)
+            dataset.generate(paths[2], 50, 40, seed=2, actions=True)
+            dumps = []
+            for path in paths:
+                conn = sqlite3.connect(path)
+                dumps.append([line for line in conn.iterdump()
+                              if 'sqlite_stat' not in line])
+                conn.close()
+            self.assertEqual(dumps[0], dumps[1])
+            self.assertNotEqual(dumps[0], dumps[2])
+
+            db = engine.db.DBInterface(db_path=paths[0])
+            self.assertEqual(db.auth_player(dataset.email(3),
+                                            dataset.PASSWORD),
+                             (DB_STATUS.OK, 3))
+            (status, games) = db.load_games_bulk(list(range(1, 41)))
+            self.assertEqual(status, DB_STATUS.OK)
+            self.assertEqual(len(games), 40)
+            for game in games.values():
+                self.assertTrue(game.cur_state is not None)
+                self.assertTrue(1 <= len(game.players_ids)
+                                <= game.num_players)
+            del db
+
+        _LOGGER.info('===END TEST_GENERATE===')
+
+class TestHotPaths(unittest.TestCase):
+    """ smoke test of the hot paths benchmarks """
+    def test_run(self):
+        """ methods tested:
+        run
+        compare
+        main
+        """
+        _LOGGER.info('===BEGIN TEST_RUN===')
+
+        results = hot_paths.run(['tiny'], 2)
+        timings = results['results']['tiny']
+        self.assertEqual(sorted(timings),
+                         sorted(name for name, _ in hot_paths.BENCHMARKS))
+        for name, timing in timings.items():
+            self.assertEqual(timing['number'], 2)
+            self.assertTrue(0 < timing['min_ms'] <= timing['median_ms'])
+
+        # twice slower than the baseline
+        baseline = json.loads(json.dumps(results))
+        for timing in baseline['results']['tiny'].values():
+            timing['median_ms'] /= 2
+        rows = hot_paths.compare(results, baseline, 0.5)
+        self.assertEqual(len(rows), len(hot_paths.BENCHMARKS))
+        self.assertTrue(all(regression for *_, regression in rows))
+        self.assertFalse(any(regression for *_, regression
+                             in hot_paths.compare(results, results)))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, 'bench.json')
+            self.assertEqual(hot_paths.main(
+                ['--scales', 'tiny', '--number', '1', '--benchmarks',
+                 'auth_player,load_state_small', '--output', output]), 0)
+            with open(output) as results_file:
+                results = json.load(results_file)
+            self.assertEqual(sorted(results['results']['tiny']),
+                             ['auth_player', 'load_state_small'])
+
+        _LOGGER.info('===END TEST_RUN===')
@@ -0,0 +1,171 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import threading
+import unittest
+from engine.cache import GamesCache, state_size
+from engine.web_types import Game
+import engine.util
+
+engine.util.init_logging(test_mode=True)
+_LOGGER = logging.getLogger('ecbb.tests')
+
+def new_game(game_id):
+    """ a game with an initial state """
+    game = Game(creator_id=1, name='cache test {}'.format(game_id), level=3,
+                private=False, password='', num_players=2, extensions={},
+                init_state=True)
+    game.id_ = game_id
+    return game
+
+class CacheTests(unittest.TestCase):
+    """ test the games cache eviction policy """
+    def setUp(self):
+        """ games written back by the cache """
+        self.saved = []
+        self.save_ok = True
+
+    def write_back(self, game):
+        """ mock of the games manager save """
+        if self.save_ok:
+            self.saved.append(game.id_)
+        return self.save_ok
+
+    def test_lru(self):
+        """ methods tested:
+        get
+        put
+        __getitem__
+        __contains__
+        stats
+        """
+        _LOGGER.info('===BEGIN TEST_LRU===')
+
+        cache = GamesCache(max_games=2)
+        cache.put(1, new_game(1))
+        cache.put(2, new_game(2))
+        self.assertEqual(len(cache), 2)
+
+        # 1 is now the most recently used, 2 is evicted
+        self.assertEqual(cache.get(1).id_, 1)
+        cache.put(3, new_game(3))
+        self.assertTrue(1 in cache)
+        self.assertFalse(2 in cache)
+        self.assertTrue(3 in cache)
+        self.assertEqual(cache.get(2), None)
+        with self.assertRaises(KeyError):
+            cache[2]
+
+        stats = cache.stats()
+        self.assertEqual(stats['games'], 2)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['evictions'], 1)
+
+        _LOGGER.info('===END TEST_LRU===')
+
+    def test_bytes(self):
+        """ methods tested:
+        put
+        resize
+        pop
+        """
+        _LOGGER.info('===BEGIN TEST_BYTES===')
+
+        size = state_size(new_game(1))
+        cache = GamesCache(max_bytes=size * 2)
+        cache.put(1, new_game(1))
+        cache.put(2, new_game(2))
+        self.assertEqual(cache.stats()['bytes'], size * 2)
+        cache.put(3, new_game(3))
+        self.assertEqual(sorted(cache._games), [2, 3])
+
+        # a game growing in memory
+        game = cache.get(3)
+        game.state_bytes = size * 2
+        cache.resize(3)
+        self.assertEqual(sorted(cache._games), [3])
+
+        cache.pop(3)
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+        _LOGGER.info('===END TEST_BYTES===')
+
+    def test_pin_dirty(self):
+        """ methods tested:
+        pin
+        unpin
+        mark_dirty
+        mark_clean
+        """
+        _LOGGER.info('===BEGIN TEST_PIN_DIRTY===')
+
+        cache = GamesCache(max_games=1, write_back=self.write_back)
+        cache.put(1, new_game(1))
+        cache.pin(1)
+        cache.pin(1)
+        self.assertTrue(cache.is_pinned(1))
+
+        # pinned game not evicted, limit exceeded
+        cache.put(2, new_game(2))
+        self.assertEqual(len(cache), 2)
+        cache.unpin(1)
+        self.assertEqual(len(cache), 2)
+        # last pin removed, evicted
+        cache.unpin(1)
+        self.assertEqual(sorted(cache._games), [2])
+
+        # dirty game written back before its eviction
+        cache.mark_dirty(2)
+        self.assertTrue(cache.is_dirty(2))
+        cache.put(3, new_game(3))
+        self.assertEqual(self.saved, [2])
+        self.assertEqual(sorted(cache._games), [3])
+        self.assertEqual(cache.stats()['write_backs'], 1)
+
+        # write back failed, not evicted
+        self.save_ok = False
+        cache.mark_dirty(3)
+        cache.put(4, new_game(4))
+        self.assertEqual(sorted(cache._games), [3, 4])
+        self.save_ok = True
+
+        # saved elsewhere
+        cache.mark_clean(3)
+        cache.put(5, new_game(5))
+        self.assertEqual(sorted(cache._games), [5])
+        self.assertEqual(self.saved, [2])
+
+        # written back without the cache lock, modified meanwhile
+        def write_back(game):
+            """ access the cache from another thread during the save """
+            reader = threading.Thread(target=cache.get, args=(5, ))
+            reader.start()
+            reader.join(5)
+            self.assertFalse(reader.is_alive())
+            cache.mark_dirty(game.id_)
+            return True
+
+        cache = GamesCache(max_games=1, write_back=write_back)
+        cache.put(5, new_game(5))
+        cache.mark_dirty(5)
+        cache.put(6, new_game(6))
+        self.assertEqual(sorted(cache._games), [5, 6])
+        self.assertTrue(cache.is_dirty(5))
+
+        _LOGGER.info('===END TEST_PIN_DIRTY===')
@@ -17,11 +17,17 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from datetime import datetime
 import logging
+import os
+import pickle
 import sqlite3
+import tempfile
+import threading
 import unittest
+from unittest import mock
 import engine.db
-from engine.data_types import GameState
-from engine.db import DB_STATUS
+import engine.db_stats
+from engine.data_types import Action, GameState
+from engine.db import DB_STATUS, STATE_CODECS, STATE_SERIALIZERS
 from engine.web_types import Game, WebPlayer
 import engine.util
 
@@ -57,6 +63,61 @@ class DBTests(unittest.TestCase):
 
         _LOGGER.info('===END TEST_EXEC_SCRIPT===')
 
+    def test_test_template(self):
+        """ functions tested:
+        _test_template
+        _clone_test_template
+        """
+        _LOGGER.info('===BEGIN TEST_TEST_TEMPLATE===')
+
+        def dump(db):
+            """ return: the SQL dump of a DBInterface db """
+            conn = sqlite3.connect(db._db_path)
+            try:
+                return list(conn.iterdump()) + [
+                    conn.execute('PRAGMA user_version;').fetchone()]
+            finally:
+                conn.close()
+
+        # a clone has the content of a db built from the scripts
+        scripts_db = engine.db.DBInterface(True, test_template=False)
+        self.assertEqual(dump(self.db), dump(scripts_db))
+        del scripts_db
+
+        # the clones are independent
+        other = engine.db.DBInterface(True)
+        status, _ = self.db.create_player('clone', 'clone@test.com', 'p', 0)
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertNotEqual(dump(self.db), dump(other))
+        del other
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with mock.patch('engine.db.TEST_TEMPLATE_DIR', tmp_dir), \
+                 mock.patch('engine.db._test_template_path', None):
+                path = engine.db._test_template()
+                self.assertEqual(os.path.dirname(path), tmp_dir)
+                self.assertEqual(os.listdir(tmp_dir),
+                                 [os.path.basename(path)])
+                mtime = os.stat(path).st_mtime_ns
+                self.assertEqual(engine.db._test_template(), path)
+                self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+
+                # rebuilt when deleted, cached on disk for other processes
+                os.remove(path)
+                self.assertEqual(engine.db._test_template(), path)
+                self.assertTrue(os.path.exists(path))
+                engine.db._test_template_path = None
+                self.assertEqual(engine.db._test_template(), path)
+
+                # fallback to the scripts when the template can't be built
+                with mock.patch('engine.db._test_template',
+                                side_effect=OSError):
+                    db = engine.db.DBInterface(True)
+                    self.assertEqual(db.load_player(1)[0], DB_STATUS.OK)
+                    del db
+
+        _LOGGER.info('===END TEST_TEST_TEMPLATE===')
+
     def test_db_fail(self):
         """ functions tested:
         change_db_fail
@@ -90,6 +151,188 @@ class DBTests(unittest.TestCase):
 
         _LOGGER.info('===END TEST_DB_FAIL===')
 
+    def test_pool(self):
+        """ methods tested:
+        _connect
+        _release
+        check_connections
+        pool_stats
+        """
+        _LOGGER.info('===BEGIN TEST_POOL===')
+
+        ## the same thread gets back the same connection
+        db = self.db._connect()
+        self.db._release(db)
+        status, _ = self.db.get_timezones()
+        self.assertEqual(status, DB_STATUS.OK)
+        db_again = self.db._connect()
+        self.assertTrue(db is db_again)
+
+        # reentrant
+        db_nested = self.db._connect()
+        self.assertTrue(db is db_nested)
+        self.db._release(db_nested)
+        self.db._release(db_again)
+        self.assertEqual(self.db.pool_stats()['idle'],
+                         self.db.pool_stats()['size'])
+
+        ## uncommitted transaction is rolled back on release
+        db = self.db._connect()
+        db.execute("UPDATE players SET name = 'rollback' WHERE id = 1;")
+        self.db._release(db)
+        status, player = self.db.load_player(1)
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertEqual(player.name, 'test player')
+
+        ## broken connection dropped on release, then reopened
+        self.assertEqual(self.db.check_connections(), 0)
+        size = self.db.pool_stats()['size']
+        db = self.db._connect()
+        db.close()
+        self.db._release(db)
+        self.assertEqual(self.db.pool_stats()['size'], size - 1)
+        status, _ = self.db.get_timezones()
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertEqual(self.db.pool_stats()['size'], size)
+
+        ## pool capacity
+        pool = engine.db.ConnectionPool(self.db._db_path, max_size=1,
+                                        timeout=0.1)
+        conn = pool.acquire()
+        results = []
+        def other_thread():
+            """ the single connection is already lent """
+            try:
+                pool.acquire()
+            except sqlite3.OperationalError:
+                results.append('timeout')
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        thread.join()
+        self.assertEqual(results, ['timeout'])
+        pool.release(conn)
+        self.assertEqual(pool.stats(), {'size': 1, 'idle': 1, 'max_size': 1})
+        pool.close()
+        self.assertEqual(pool.stats()['size'], 0)
+
+        _LOGGER.info('===END TEST_POOL===')
+
+    def test_query_stats(self):
+        """ methods tested:
+        query_stats
+        DBStats.record_call
+        DBStats.record_slow
+        DBStats.report
+        DBStats.state_sizes
+        """
+        _LOGGER.info('===BEGIN TEST_QUERY_STATS===')
+
+        histogram = engine.db_stats.Histogram((1, 2, 4))
+        for value in (0.5, 1.5, 1.5, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.cumulative(),
+                         [(1, 1), (2, 3), (4, 4), (float('inf'), 5)])
+        self.assertEqual(histogram.quantile(0.5), 1.75)
+        self.assertEqual(histogram.quantile(1), 4)
+
+        # every statement is slow
+        db = engine.db.DBInterface(True, slow_query_threshold=0)
+        stats = db.query_stats()
+        status, games = db.load_games_bulk([1, 2, 4])
+        self.assertEqual(status, DB_STATUS.OK)
+        db.load_player(1)
+        db.load_player(2)
+
+        methods = stats.methods()
+        self.assertEqual(methods['load_player'].time.count, 2)
+        self.assertEqual(methods['load_player'].rows.sum, 2)
+        self.assertEqual(methods['load_player'].statements, 2)
+        bulk = methods['load_games_bulk']
+        self.assertEqual(bulk.time.count, 1)
+        self.assertTrue(bulk.rows.sum >= 3)
+        self.assertEqual(bulk.acquire.count, 1)
+
+        slow = [query for query in stats.slow_queries()
+                if query.method == 'load_player']
+        self.assertEqual(len(slow), 2)
+        self.assertTrue(any('players' in detail
+                            for _, _, _, detail in slow[0].plan))
+        report = stats.report()
+        self.assertTrue('load_games_bulk' in report)
+        self.assertTrue('SEARCH players' in report)
+
+        # state blobs read by the bulk load, smaller than the states in
+        # memory
+        sizes = stats.state_sizes()
+        self.assertTrue(sizes.count >= 3)
+        self.assertTrue(0 < sizes.sum < sum(game.state_bytes
+                                            for game in games.values()))
+        sizes.observe(1)
+        self.assertNotEqual(stats.state_sizes().count, sizes.count)
+
+        # errors
+        db.set_unittest_to_fail(True)
+        db.load_player(1)
+        db.set_unittest_to_fail(False)
+        self.assertEqual(stats.methods()['load_player'].errors, 1)
+
+        stats.reset()
+        self.assertEqual(stats.methods(), {})
+        self.assertEqual(stats.slow_queries(), [])
+        self.assertEqual(stats.state_sizes().count, 0)
+
+        _LOGGER.info('===END TEST_QUERY_STATS===')
+
+    def test_storage_profile(self):
+        """ methods tested:
+        storage_profile
+        checkpoint
+        """
+        _LOGGER.info('===BEGIN TEST_STORAGE_PROFILE===')
+
+        profile = self.db.storage_profile()
+        self.assertEqual(profile['journal_mode'], 'wal')
+        # NORMAL
+        self.assertEqual(profile['synchronous'], 1)
+        self.assertEqual(profile['busy_timeout'], 5000)
+        # MEMORY
+        self.assertEqual(profile['temp_store'], 2)
+        self.assertEqual(profile['cache_size'],
+                         engine.db.DEFAULT_PRAGMAS['cache_size'])
+
+        self.assertRaises(ValueError, engine.db.DBInterface, True,
+                          pragmas={'cache_size': '1; DROP TABLE games'})
+
+        # checkpoint at each release
+        db = engine.db.DBInterface(True, pragmas={'synchronous': 'full',
+                                                  'cache_size': -2000},
+                                   checkpoint_interval=0)
+        profile = db.storage_profile()
+        self.assertEqual(profile['synchronous'], 2)
+        self.assertEqual(profile['cache_size'], -2000)
+        wal_path = db._db_path + '-wal'
+        status, dummy = db.create_player('wal', 'wal@test.com', 'wal', 0)
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertEqual(os.path.getsize(wal_path), 0)
+        del db
+
+        self.db.create_player('wal', 'wal@test.com', 'wal', 0)
+        self.assertTrue(os.path.getsize(self.db._db_path + '-wal') > 0)
+        status, (busy, dummy, dummy) = self.db.checkpoint('truncate')
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertEqual(busy, 0)
+        self.assertEqual(os.path.getsize(self.db._db_path + '-wal'), 0)
+
+        # test DB_ERROR
+        self.db.set_unittest_to_fail(True)
+        status, dummy = self.db.checkpoint()
+        self.assertEqual(status, DB_STATUS.ERROR)
+        self.assertEqual(dummy, None)
+        self.db.set_unittest_to_fail(False)
+
+        _LOGGER.info('===END TEST_STORAGE_PROFILE===')
+
     def test_prod(self):
         """ test loading the real db """
         _LOGGER.info('===BEGIN TEST_PROD===')
@@ -273,12 +516,145 @@ class DBTests(unittest.TestCase):
 
         _LOGGER.info('===END TEST_GAME===')
 
+    def test_load_games_bulk(self):
+        """ methods tested:
+        load_games_bulk
+        """
+        _LOGGER.info('===BEGIN TEST_LOAD_GAMES_BULK===')
+
+        not_started_gid = 1
+        in_progress_gid = 2
+        not_a_gid = 666
+
+        status, games = self.db.load_games_bulk([not_started_gid,
+                                                 in_progress_gid,
+                                                 not_a_gid])
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertEqual(sorted(games), [not_started_gid, in_progress_gid])
+
+        # same content as the separate queries
+        for game_id, game in games.items():
+            status, game_alone = self.db.load_game(game_id)
+            self.assertEqual(game.name, game_alone.name)
+            self.assertEqual(game.start_date, game_alone.start_date)
+            self.assertEqual(game.last_play, game_alone.last_play)
+            status, players_ids = self.db.get_game_players_ids(game_id)
+            self.assertEqual(game.players_ids, players_ids)
+            status, game_exts = self.db.get_game_ext(game_id)
+            self.assertEqual(game.extensions, game_exts)
+            status, states_ids = self.db.get_game_states_ids(game_id)
+            self.assertEqual(game.states_ids, states_ids)
+            status, state = self.db.load_state(game.cur_state_id())
+            self.assertEqual(game.cur_state.__getstate__(),
+                             state.__getstate__())
+
+        # the current state is the last saved one
+        game = games[in_progress_gid]
+        game.cur_state.cur_turn = 3
+        status, state_id = self.db.save_state(game)
+        self.assertEqual(status, DB_STATUS.OK)
+        status, games = self.db.load_games_bulk([in_progress_gid])
+        self.assertEqual(games[in_progress_gid].states_ids, [2, state_id])
+        self.assertEqual(games[in_progress_gid].cur_state.cur_turn, 3)
+
+        # nothing to load
+        status, games = self.db.load_games_bulk([])
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertEqual(games, {})
+
+        # test DB_ERROR
+        self.db.set_unittest_to_fail(True)
+        status, dummy = self.db.load_games_bulk([in_progress_gid])
+        self.assertEqual(status, DB_STATUS.ERROR)
+        self.assertEqual(dummy, None)
+        self.db.set_unittest_to_fail(False)
+
+        _LOGGER.info('===END TEST_LOAD_GAMES_BULK===')
+
+    def test_games_summaries(self):
+        """ methods tested:
+        get_my_games_summaries
+        get_pub_priv_games_summaries
+        save_game
+        """
+        _LOGGER.info('===BEGIN TEST_GAMES_SUMMARIES===')
+
+        not_started_gid = 1
+        in_progress_gid = 2
+        private_gid = 4
+        player_1_id = 1
+
+        ## not ended games joined by player 1
+        status, summaries = self.db.get_my_games_summaries(player_1_id)
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertEqual([summary.id_ for summary in summaries],
+                         [not_started_gid, in_progress_gid, private_gid])
+        summary = summaries[1]
+        self.assertEqual(summary.name, 'my in-progress test game')
+        self.assertEqual(summary.level, 2)
+        self.assertEqual(summary.num_players, 2)
+        self.assertEqual(summary.creator_id, 2)
+        start_date = datetime.strptime('2006-06-06 06:06:06.666666',
+                                       '%Y-%m-%d %H:%M:%S.%f')
+        self.assertEqual(summary.start_date, start_date)
+        self.assertEqual(summary.cur_turn, 0)
+        self.assertEqual(summary.cur_state_id, 2)
+        self.assertEqual(summary.players, [(1, 'test player', 600),
+                                           (2, 'test player dup', 600)])
+        self.assertEqual(summary.players_ids, [1, 2])
+        self.assertEqual(summary.get_player(2), (2, 'test player dup', 600))
+        self.assertEqual(summary.get_player(666), None)
+        self.assertEqual(summary.extensions, {1: 'rare_technologies',
+                                              3: 'ancient_worlds',
+                                              5: 'ancient_sdcg'})
+
+        # the turn is updated when saving the game
+        status, games = self.db.load_games_bulk([in_progress_gid])
+        game = games[in_progress_gid]
+        game.cur_state.cur_turn = 4
+        status, _ = self.db.save_game(game)
+        self.assertEqual(status, DB_STATUS.OK)
+        status, summaries = self.db.get_my_games_summaries(player_1_id)
+        self.assertEqual(summaries[1].cur_turn, 4)
+
+        # but not by a game loaded without its state
+        status, game = self.db.load_game(in_progress_gid)
+        status, _ = self.db.save_game(game)
+        self.assertEqual(status, DB_STATUS.OK)
+        status, summaries = self.db.get_my_games_summaries(player_1_id)
+        self.assertEqual(summaries[1].cur_turn, 4)
+
+        ## not started games
+        status, summaries = self.db.get_pub_priv_games_summaries()
+        self.assertEqual(status, DB_STATUS.OK)
+        pub_summaries, priv_summaries = summaries
+        self.assertEqual([summary.id_ for summary in pub_summaries],
+                         [not_started_gid])
+        self.assertEqual([summary.id_ for summary in priv_summaries],
+                         [private_gid])
+        self.assertEqual(priv_summaries[0].extensions, {4: 'secret_world',
+                                                        5: 'ancient_sdcg',
+                                                        6: 'ancient_hives'})
+
+        # test DB_ERROR
+        self.db.set_unittest_to_fail(True)
+        status, dummy = self.db.get_my_games_summaries(player_1_id)
+        self.assertEqual(status, DB_STATUS.ERROR)
+        self.assertEqual(dummy, None)
+        status, dummy = self.db.get_pub_priv_games_summaries()
+        self.assertEqual(status, DB_STATUS.ERROR)
+        self.assertEqual(dummy, None)
+        self.db.set_unittest_to_fail(False)
+
+        _LOGGER.info('===END TEST_GAMES_SUMMARIES===')
+
     def test_player(self):
         """ methods tested:
         create_player
         update_player
         auth_player
         load_layer
+        load_players
         get_players_infos
         """
         _LOGGER.info('===BEGIN TEST_PLAYER===')
@@ -341,6 +717,13 @@ class DBTests(unittest.TestCase):
         self.assertEqual(status, DB_STATUS.NO_ROWS)
         self.assertEqual(dummy, None)
 
+        # load many, unknown players are missing
+        status, players = self.db.load_players([1, 2, not_a_player_id, 1])
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertEqual(sorted(players), [1, 2])
+        status, player_1 = self.db.load_player(1)
+        self.assertEqual(players[1].__dict__, player_1.__dict__)
+
         ## auth player
         status, player_id = self.db.auth_player('missing@test.com', 'xxx')
         self.assertEqual(status, DB_STATUS.NO_ROWS)
@@ -374,6 +757,9 @@ class DBTests(unittest.TestCase):
         status, dummy = self.db.load_player(player.id_)
         self.assertEqual(status, DB_STATUS.ERROR)
         self.assertEqual(dummy, None)
+        status, dummy = self.db.load_players([player.id_])
+        self.assertEqual(status, DB_STATUS.ERROR)
+        self.assertEqual(dummy, None)
         status, dummy = self.db.get_players_infos()
         self.assertEqual(status, DB_STATUS.ERROR)
         self.assertEqual(dummy, None)
@@ -407,7 +793,8 @@ class DBTests(unittest.TestCase):
         ## load
         status, state_loaded = self.db.load_state(state_id)
         self.assertEqual(status, DB_STATUS.OK)
-        self.assertEqual(game.cur_state.__dict__, state_loaded.__dict__)
+        self.assertEqual(game.cur_state.__getstate__(),
+                         state_loaded.__getstate__())
 
         not_a_state_id = 666
         status, dummy_state = self.db.load_state(not_a_state_id)
@@ -426,6 +813,363 @@ class DBTests(unittest.TestCase):
 
         _LOGGER.info('===END TEST_STATE===')
 
+    def test_actions_log(self):
+        """ methods tested:
+        save_state
+        load_state
+        load_games_bulk
+        with states rebuilt from the actions log
+        """
+        _LOGGER.info('===BEGIN TEST_ACTIONS_LOG===')
+
+        db = engine.db.DBInterface(True, snapshot_every=3)
+        game = Game(creator_id=1, name='actions log test', level=3,
+                    private=False, password='', num_players=2,
+                    extensions={}, init_state=True)
+        status, game = db.create_game(game, [1, 2])
+        self.assertEqual(status, DB_STATUS.OK)
+
+        # an action moves the turn marker from old_zone to new_zone
+        def apply_action(state, action):
+            state.cur_turn = action.new_zone
+
+        with mock.patch.object(GameState, 'apply_action', apply_action):
+            states = []
+            for turns in ([], [1], [2, 3], [4], [5]):
+                game.cur_state.cur_actions = []
+                for turn in turns:
+                    action = Action('turn', game.cur_state.cur_turn, turn)
+                    game.cur_state.apply_action(action)
+                    game.cur_state.cur_actions.append(action)
+                status, state_id = db.save_state(game)
+                self.assertEqual(status, DB_STATUS.OK)
+                states.append(state_id)
+
+            # one snapshot every three states
+            conn = db._connect()
+            snapshots = conn.execute(('SELECT pickle IS NOT NULL '
+                                      'FROM state '
+                                      'WHERE game_id = ? '
+                                      'ORDER BY id;'), (game.id_, )).fetchall()
+            seqs = conn.execute(('SELECT seq, state_id '
+                                 'FROM actions '
+                                 'WHERE game_id = ? '
+                                 'ORDER BY seq;'), (game.id_, )).fetchall()
+            db._release(conn)
+            self.assertEqual([snap for snap, in snapshots], [1, 0, 0, 1, 0])
+            self.assertEqual(seqs, [(1, states[1]), (2, states[2]),
+                                    (3, states[2]), (4, states[3]),
+                                    (5, states[4])])
+
+            # replayed states
+            status, state = db.load_state(states[2])
+            self.assertEqual(status, DB_STATUS.OK)
+            self.assertEqual(state.cur_turn, 3)
+            self.assertEqual([a.new_zone for a in state.cur_actions], [2, 3])
+
+            status, state = db.load_state(states[4])
+            self.assertEqual(status, DB_STATUS.OK)
+            self.assertEqual(state.cur_turn, 5)
+            self.assertEqual([a.new_zone for a in state.cur_actions], [5])
+
+            # snapshot
+            status, state = db.load_state(states[3])
+            self.assertEqual(status, DB_STATUS.OK)
+            self.assertEqual(state.cur_turn, 4)
+
+            status, games = db.load_games_bulk([game.id_])
+            self.assertEqual(status, DB_STATUS.OK)
+            self.assertEqual(games[game.id_].cur_state.cur_turn, 5)
+            self.assertEqual(games[game.id_].states_ids, states)
+        del db
+
+        _LOGGER.info('===END TEST_ACTIONS_LOG===')
+
+    def test_actions_saved_once(self):
+        """ methods tested:
+        save_state
+        load_state
+        the actions of a saved state are not logged again by the next one
+        """
+        _LOGGER.info('===BEGIN TEST_ACTIONS_SAVED_ONCE===')
+
+        db = engine.db.DBInterface(True, snapshot_every=3)
+        game = Game(creator_id=1, name='actions saved once test', level=3,
+                    private=False, password='', num_players=2,
+                    extensions={}, init_state=True)
+        status, game = db.create_game(game, [1, 2])
+        self.assertEqual(status, DB_STATUS.OK)
+        status, dummy = db.save_state(game)
+        self.assertEqual(status, DB_STATUS.OK)
+
+        def apply_action(state, action):
+            state.cur_turn += action.new_zone - action.old_zone
+
+        with mock.patch.object(GameState, 'apply_action', apply_action):
+            for turn in (1, 2):
+                action = Action('turn', game.cur_state.cur_turn, turn)
+                game.cur_state.apply_action(action)
+                game.cur_state.cur_actions.append(action)
+                status, state_id = db.save_state(game)
+                self.assertEqual(status, DB_STATUS.OK)
+                self.assertEqual(game.cur_state.cur_actions, [])
+
+            # not a snapshot, replayed from the first state
+            status, state = db.load_state(state_id)
+            self.assertEqual(status, DB_STATUS.OK)
+            self.assertEqual(state.cur_turn, game.cur_state.cur_turn)
+            self.assertEqual(state.cur_turn, 2)
+            self.assertEqual([a.new_zone for a in state.cur_actions], [2])
+        del db
+
+        _LOGGER.info('===END TEST_ACTIONS_SAVED_ONCE===')
+
+    def test_save_games(self):
+        """ methods tested:
+        prepare_save
+        save_games
+        """
+        _LOGGER.info('===BEGIN TEST_SAVE_GAMES===')
+
+        status, games = self.db.load_games_bulk([1, 2])
+        self.assertEqual(status, DB_STATUS.OK)
+        saves = []
+        for game in games.values():
+            game.cur_state.cur_turn = 3
+            game.last_play = datetime(2013, 2, 2)
+            saves.append(self.db.prepare_save(game))
+        # modified after prepare_save, not saved
+        games[1].cur_state.cur_turn = 8
+        unknown = Game(creator_id=1, name='unknown', level=3,
+                       private=False, password='', num_players=2,
+                       extensions={}, init_state=True)
+        unknown.id_ = 666
+        saves.append(self.db.prepare_save(unknown))
+
+        status, results = self.db.save_games(saves)
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertEqual([status for status, _ in results],
+                         [DB_STATUS.OK, DB_STATUS.OK, DB_STATUS.NO_ROWS])
+        for game_id, (dummy, state_id) in zip([1, 2], results):
+            status, state = self.db.load_state(state_id)
+            self.assertEqual(state.cur_turn, 3)
+            status, game = self.db.load_game(game_id)
+            self.assertEqual(game.last_play, datetime(2013, 2, 2))
+        conn = self.db._connect()
+        turns = conn.execute(('SELECT cur_turn FROM games '
+                              'WHERE id IN (1, 2);')).fetchall()
+        self.db._release(conn)
+        self.assertEqual(turns, [(3, ), (3, )])
+
+        # test DB_ERROR
+        self.db.set_unittest_to_fail(True)
+        status, dummy = self.db.save_games(saves)
+        self.assertEqual(status, DB_STATUS.ERROR)
+        self.assertEqual(dummy, None)
+        self.db.set_unittest_to_fail(False)
+
+        _LOGGER.info('===END TEST_SAVE_GAMES===')
+
+    def test_state_codec(self):
+        """ methods tested:
+        encode_state
+        decode_state
+        state_memory_size
+        rewrite_legacy_states
+        """
+        _LOGGER.info('===BEGIN TEST_STATE_CODEC===')
+
+        state = GameState(3)
+        state.add_player(1, 'manu', ['terran'] * 3)
+        state.cur_turn = 4
+        for codec in (STATE_CODECS.NONE, STATE_CODECS.ZLIB,
+                      STATE_CODECS.LZMA):
+            for serializer in (STATE_SERIALIZERS.PICKLE,
+                               STATE_SERIALIZERS.BINARY):
+                blob = engine.db.encode_state(state, codec, serializer)
+                self.assertTrue(engine.db.is_encoded_state(blob))
+                decoded = engine.db.decode_state(blob)
+                self.assertEqual(decoded.cur_turn, 4)
+                self.assertEqual(decoded.get_player(1).name, 'manu')
+                # sized from the serialized data, not the compressed one
+                data = engine.db._SERIALIZE[serializer](state)
+                self.assertEqual(
+                    engine.db.state_memory_size(blob),
+                    len(data) * engine.db.STATE_MEMORY_RATIOS[serializer])
+
+        # format version 1, without serializer
+        data = pickle.dumps(state)
+        blob = (engine.db._STATE_HEADERS[1].pack(b'ECS', 1, STATE_CODECS.NONE,
+                                                 len(data)) + data)
+        self.assertEqual(engine.db.decode_state(blob).cur_turn, 4)
+
+        # legacy raw pickles
+        legacy = pickle.dumps(state)
+        self.assertFalse(engine.db.is_encoded_state(legacy))
+        self.assertEqual(engine.db.decode_state(legacy).cur_turn, 4)
+        self.assertEqual(engine.db.state_memory_size(legacy),
+                         len(legacy) * engine.db.STATE_MEMORY_RATIOS[
+                             STATE_SERIALIZERS.PICKLE])
+
+        # corrupted blobs
+        blob = engine.db.encode_state(state, STATE_CODECS.ZLIB)
+        self.assertRaises(ValueError, engine.db.decode_state, blob[:-4])
+        self.assertRaises(ValueError, engine.db.decode_state,
+                          blob[:3] + bytes([99]) + blob[4:])
+
+        ## rewrite legacy states
+        game = Game(creator_id=1, name='codec test', level=3,
+                    private=False, password='', num_players=2,
+                    extensions={}, init_state=True)
+        status, game = self.db.create_game(game, [1, 2])
+        self.assertEqual(status, DB_STATUS.OK)
+        status, dummy = self.db.save_state(game)
+        self.assertEqual(status, DB_STATUS.OK)
+
+        conn = self.db._connect()
+        legacy_ids = []
+        for turn in range(5):
+            game.cur_state.cur_turn = turn
+            cursor = conn.execute('INSERT INTO state VALUES (NULL, ?, ?);',
+                                  (game.id_, pickle.dumps(game.cur_state)))
+            legacy_ids.append(cursor.lastrowid)
+        conn.commit()
+        # the test data also has legacy states
+        blobs = conn.execute(('SELECT pickle FROM state '
+                              'WHERE pickle IS NOT NULL;')).fetchall()
+        num_legacy = len([blob for blob, in blobs
+                          if not engine.db.is_encoded_state(blob)])
+        # unreadable rows are left as is
+        corrupt = [pickle.dumps(game.cur_state)[:-10],
+                   b'cengine.no_such_module\nState\n.',
+                   b'cengine.data_types\nNoSuchState\n.']
+        for blob in corrupt:
+            conn.execute('INSERT INTO state VALUES (NULL, ?, ?);',
+                         (game.id_, blob))
+        conn.commit()
+        self.db._release(conn)
+        self.assertTrue(num_legacy >= len(legacy_ids))
+
+        status, state = self.db.load_state(legacy_ids[2])
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertEqual(state.cur_turn, 2)
+
+        status, rewritten = self.db.rewrite_legacy_states(batch_size=2)
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertEqual(rewritten, num_legacy)
+        status, rewritten = self.db.rewrite_legacy_states()
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertEqual(rewritten, 0)
+
+        conn = self.db._connect()
+        blobs = conn.execute(('SELECT pickle FROM state '
+                              'WHERE pickle IS NOT NULL '
+                              'ORDER BY id;')).fetchall()
+        self.db._release(conn)
+        self.assertEqual([blob for blob, in blobs
+                          if not engine.db.is_encoded_state(blob)], corrupt)
+        for turn, state_id in enumerate(legacy_ids):
+            status, state = self.db.load_state(state_id)
+            self.assertEqual(status, DB_STATUS.OK)
+            self.assertEqual(state.cur_turn, turn)
+
+        # test DB_ERROR
+        self.db.set_unittest_to_fail(True)
+        status, dummy = self.db.rewrite_legacy_states()
+        self.assertEqual(status, DB_STATUS.ERROR)
+        self.assertEqual(dummy, None)
+        self.db.set_unittest_to_fail(False)
+
+        ## binary serializer
+        db = engine.db.DBInterface(True,
+                                   state_serializer=STATE_SERIALIZERS.BINARY)
+        status, game = db.create_game(game, [1, 2])
+        self.assertEqual(status, DB_STATUS.OK)
+        game.cur_state.cur_turn = 7
+        status, state_id = db.save_state(game)
+        self.assertEqual(status, DB_STATUS.OK)
+        status, state = db.load_state(state_id)
+        self.assertEqual(status, DB_STATUS.OK)
+        self.assertEqual(state.__getstate__().keys(),
+                         game.cur_state.__getstate__().keys())
+        self.assertEqual(state.cur_turn, 7)
+        del db
+
+        _LOGGER.info('===END TEST_STATE_CODEC===')
+
+    # statements reading a whole table on purpose
+    _FULL_SCANS = ('SELECT id, name, desc FROM extensions',
+                   'SELECT diff, name FROM timezones',
+                   'SELECT id, name FROM players ORDER BY name')
+
+    def test_query_plans(self):
+        """ check that the queries of all the methods use indexes """
+        _LOGGER.info('===BEGIN TEST_QUERY_PLANS===')
+
+        # one connection, to trace all the statements
+        db = engine.db.DBInterface(True, pool_size=1, snapshot_every=2)
+        statements = []
+        conn = db._connect()
+        conn.set_trace_callback(statements.append)
+        db._release(conn)
+
+        game = Game(creator_id=1, name='query plans test', level=3,
+                    private=False, password='', num_players=2,
+                    extensions={1: 'rare_technologies'}, init_state=True)
+        status, game = db.create_game(game, [1, 2])
+        self.assertEqual(status, DB_STATUS.OK)
+        for turn in range(4):
+            game.cur_state.cur_actions = [Action('turn', turn, turn + 1)]
+            status, dummy = db.save_state(game)
+            self.assertEqual(status, DB_STATUS.OK)
+        db.save_game(game)
+        db.load_game(game.id_)
+        db.get_game_players_ids(game.id_)
+        db.get_game_ext(game.id_)
+        db.get_game_states_ids(game.id_)
+        db.load_games_bulk([1, 2, game.id_])
+        db.get_my_games_summaries(1)
+        db.get_pub_priv_games_summaries()
+        db.get_pub_priv_games_ids()
+        db.get_my_games_ids(1)
+        db.create_player('plans', 'plans@test.com', 'plans', 0)
+        status, player = db.load_player(1)
+        db.update_player(player, {'email': 'plans2@test.com'})
+        db.auth_player('plans@test.com', 'plans')
+        db.get_players_infos()
+        for state_id in game.states_ids:
+            db.load_state(state_id)
+        db.rewrite_legacy_states()
+        db.get_extensions_infos()
+        db.get_timezones()
+
+        conn = db._connect()
+        conn.set_trace_callback(None)
+        checked = 0
+        for statement in statements:
+            if not statement.lstrip().upper().startswith(('SELECT', 'INSERT',
+                                                          'UPDATE',
+                                                          'DELETE')):
+                continue
+            if statement.startswith(self._FULL_SCANS):
+                continue
+            plan = [row[3] for row in
+                    conn.execute('EXPLAIN QUERY PLAN ' + statement)]
+            # subqueries evaluated once are scanned
+            subqueries = [detail.split()[-1] for detail in plan
+                          if detail.startswith(('CO-ROUTINE', 'MATERIALIZE'))]
+            for detail in plan:
+                if detail.startswith('SCAN '):
+                    self.assertIn(detail.split()[1], subqueries,
+                                  'full scan: {}\n{}'.format(detail,
+                                                              statement))
+            checked += 1
+        db._release(conn)
+        del db
+        self.assertTrue(checked > 30)
+
+        _LOGGER.info('===END TEST_QUERY_PLANS===')
+
     def test_constants(self):
         """ methods tested:
         get_extensions_infos
@@ -0,0 +1,122 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import pickle
+import unittest
+from engine.data_types import Hex
+from engine.galaxy import Galaxy, LINKS, NO_HEX, distance, hex_sides
+import engine.util
+
+engine.util.init_logging(test_mode=True)
+_LOGGER = logging.getLogger('ecbb.tests')
+
+ALL = (True, ) * 6
+NONE = (False, ) * 6
+# wormhole on side 0 only
+EAST = (True, False, False, False, False, False)
+
+class GalaxyTests(unittest.TestCase):
+    """ test the galaxy map """
+    def test_place(self):
+        """ methods tested:
+        Galaxy.place
+        Galaxy.neighbor
+        Galaxy.neighbors
+        Galaxy.free_positions
+        """
+        _LOGGER.info('===BEGIN TEST_PLACE===')
+
+        galaxy = Galaxy()
+        center = galaxy.place(Hex(1, ALL, []), 0, 0)
+        self.assertEqual(center, 0)
+        self.assertEqual(galaxy.neighbors(center), [])
+        self.assertEqual(len(galaxy.free_positions(center)), 6)
+
+        east = galaxy.place(Hex(2, ALL, []), 1, 0)
+        north_east = galaxy.place(Hex(3, ALL, []), 1, -1)
+        self.assertEqual(galaxy.neighbor(center, 0), east)
+        self.assertEqual(galaxy.neighbor(east, 3), center)
+        self.assertEqual(galaxy.neighbor(center, 1), north_east)
+        self.assertEqual(galaxy.neighbor(center, 2), NO_HEX)
+        # the two outer hexes touch each other too
+        self.assertEqual(sorted(galaxy.neighbors(east)), [center, north_east])
+        self.assertEqual(sorted(galaxy.neighbors(north_east)), [center, east])
+        self.assertEqual(len(galaxy.free_positions(center)), 4)
+        self.assertNotIn((1, 0), galaxy.free_positions(center))
+
+        self.assertEqual(galaxy.hex_at((1, -1)).id_, 3)
+        self.assertEqual(galaxy.index_of(2), east)
+        self.assertEqual(galaxy.position(east), (1, 0))
+        self.assertIsNone(galaxy.hex_at((5, 5)))
+        self.assertIn((1, 0), galaxy)
+        self.assertEqual(len(galaxy), 3)
+
+        self.assertRaises(ValueError, galaxy.place, Hex(4, ALL, []), 1, 0)
+        self.assertRaises(ValueError, galaxy.place, Hex(2, ALL, []), 2, 0)
+        self.assertEqual(distance((0, 0), (2, -1)), 2)
+        self.assertEqual(distance((-1, 2), (1, -1)), 3)
+
+        _LOGGER.info('===END TEST_PLACE===')
+
+    def test_links(self):
+        """ methods tested:
+        Galaxy.link
+        Galaxy.connected
+        Galaxy.rotate
+        """
+        _LOGGER.info('===BEGIN TEST_LINKS===')
+
+        galaxy = Galaxy()
+        center = galaxy.place(Hex(1, ALL, []), 0, 0)
+        east = galaxy.place(Hex(2, EAST, []), 1, 0)
+        west = galaxy.place(Hex(3, NONE, []), -1, 0)
+
+        # the east hex has its wormhole on its east side
+        self.assertEqual(galaxy.link(center, 0), LINKS.HALF)
+        self.assertEqual(galaxy.link(east, 3), LINKS.HALF)
+        self.assertEqual(galaxy.link(center, 3), LINKS.HALF)
+        self.assertEqual(galaxy.connected(center), [])
+        self.assertEqual(galaxy.connected(center, half=True), [east, west])
+
+        # turned by half a turn, the wormhole faces the center
+        version = galaxy.version
+        galaxy.rotate(east, 3)
+        self.assertTrue(galaxy.version > version)
+        self.assertEqual(galaxy.link(center, 0), LINKS.FULL)
+        self.assertEqual(galaxy.link(east, 3), LINKS.FULL)
+        self.assertEqual(galaxy.connected(center), [east])
+        self.assertEqual(galaxy.connected(east), [center])
+        self.assertEqual(galaxy.hexes[east].rotation, 3)
+        self.assertEqual(hex_sides(EAST, 3), 1 << 3)
+
+        # a hex placed next to a rotated hex
+        south_east = galaxy.place(Hex(4, ALL, []), 1, 1)
+        self.assertEqual(galaxy.link(south_east, 2), LINKS.HALF)
+        self.assertEqual(galaxy.link(south_east, 3), LINKS.NONE)
+        galaxy.rotate(east, 5)
+        self.assertEqual(galaxy.link(south_east, 2), LINKS.FULL)
+        self.assertEqual(galaxy.link(center, 0), LINKS.HALF)
+
+        # rebuilt from its hexes
+        copied = pickle.loads(pickle.dumps(galaxy))
+        for index in range(len(galaxy)):
+            self.assertEqual([copied.link(index, side) for side in range(6)],
+                             [galaxy.link(index, side) for side in range(6)])
+        self.assertEqual(Galaxy(galaxy.hexes).connected(east), [south_east])
+
+        _LOGGER.info('===END TEST_LINKS===')
@@ -16,8 +16,13 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from datetime import datetime
+import io
 import logging
+import queue
+import threading
+import time
 import unittest
+from engine.data_types import Action
 import engine.db
 from engine.game_manager import GamesManager
 import engine.util
@@ -57,6 +62,185 @@ class GMTests(unittest.TestCase):
 
         _LOGGER.info('===END TEST_UTIL===')
 
+    def test_log_tracing(self):
+        """ methods tested:
+        engine.util.log
+        engine.util.set_log_sampling
+        """
+        _LOGGER.info('===BEGIN TEST_LOG_TRACING===')
+
+        class Collector(logging.Handler):
+            """ keep the records of the call traces """
+            def __init__(self):
+                logging.Handler.__init__(self)
+                self.records = []
+
+            def emit(self, record):
+                self.records.append(record)
+
+        @engine.util.log
+        def traced(value):
+            """ traced function """
+            return nested(value * 2)
+
+        @engine.util.log(sample=0.25)
+        def nested(value):
+            """ sampled function """
+            return value
+
+        handler = Collector()
+        trace_logger = logging.getLogger('ecbb.util')
+        trace_logger.addHandler(handler)
+        try:
+            self.assertEqual(traced.__name__, 'traced')
+            for value in range(4):
+                self.assertEqual(traced(value), value * 2)
+            messages = [record.getMessage() for record in handler.records]
+            # 4 calls of traced, 1 of nested, in and out
+            self.assertEqual(len(messages), 10)
+            self.assertTrue(messages[0].startswith(' in_)GMTests.'))
+            self.assertTrue(messages[1].startswith('  in_)'))
+
+            # truncated reprs
+            handler.records = []
+            traced('x' * 1000)
+            self.assertTrue(len(handler.records[0].getMessage()) < 200)
+
+            # runtime sampling rates, and nothing formatted when disabled
+            engine.util.set_log_sampling({traced.__qualname__: 0})
+            handler.records = []
+            traced(1)
+            self.assertEqual(handler.records, [])
+            engine.util.set_log_sampling({traced.__qualname__: 1})
+            trace_logger.setLevel(logging.INFO)
+            traced(1)
+            self.assertEqual(handler.records, [])
+        finally:
+            trace_logger.setLevel(logging.NOTSET)
+            trace_logger.removeHandler(handler)
+
+        _LOGGER.info('===END TEST_LOG_TRACING===')
+
+    def test_timings(self):
+        """ methods tested:
+        engine.util.collect_timings
+        engine.util.timed_span
+        """
+        _LOGGER.info('===BEGIN TEST_TIMINGS===')
+
+        # not collected outside of a request
+        self.gm.get_my_games(1)
+
+        with engine.util.collect_timings() as timings:
+            db_ok, game = self.gm.load_game(2)
+            self.gm.get_my_games(1)
+        self.assertTrue(db_ok)
+        # load_game calls load_games and get_player, counted once
+        self.assertEqual(timings.counts['gm'], 2)
+        self.assertTrue(timings.counts['db'] >= 3)
+        self.assertTrue(0 < timings.durations['db'] <= timings.durations['gm'])
+
+        # a span per request
+        with engine.util.collect_timings() as timings:
+            self.gm.get_my_games(1)
+        self.assertEqual(timings.counts, {'gm': 1, 'db': 1})
+
+        _LOGGER.info('===END TEST_TIMINGS===')
+
+    def test_log_queue(self):
+        """ methods tested:
+        engine.util.start_log_queue
+        BoundedQueueHandler.emit
+        BoundedQueueHandler.enqueue
+        BatchingQueueListener.handle_batch
+        """
+        _LOGGER.info('===BEGIN TEST_LOG_QUEUE===')
+
+        class Blocker(logging.Handler):
+            """ block the listener thread until released """
+            def __init__(self):
+                logging.Handler.__init__(self)
+                self.started = threading.Event()
+                self.unblock = threading.Event()
+
+            def emit(self, record):
+                self.started.set()
+                self.unblock.wait(5)
+
+        class Broken(logging.Handler):
+            """ a handler failing on every record """
+            def handle(self, record):
+                raise RuntimeError('broken handler')
+
+        # with SAMPLE, the queue is half full after 2 records, then one
+        # record in sample_every is queued
+        for overflow, dropped in ((engine.util.OVERFLOW.DROP, 6),
+                                  (engine.util.OVERFLOW.SAMPLE, 7),
+                                  (engine.util.OVERFLOW.BLOCK, 6)):
+            stream = io.StringIO()
+            blocker = Blocker()
+            logger = logging.getLogger('ecbb.tests.queue{}'.format(overflow))
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            logger.addHandler(logging.StreamHandler(stream))
+            logger.addHandler(blocker)
+            (handler, listener) = engine.util.start_log_queue(
+                logger, queue_size=4, overflow=overflow, block_timeout=0.01)
+            self.assertEqual(logger.handlers, [handler])
+
+            logger.info('first')
+            self.assertTrue(blocker.started.wait(5))
+            # the listener is blocked on 'first', the queue fills up
+            for i in range(10):
+                logger.info('record %d', i)
+            self.assertEqual(handler.dropped, dropped)
+            blocker.unblock.set()
+            listener.stop()
+            lines = stream.getvalue().splitlines()
+            self.assertEqual(len(lines), 11 - dropped)
+            self.assertEqual(lines[:2], ['first', 'record 0'])
+            # the queued records are written in one batch
+            self.assertEqual(listener.batches, 2)
+
+        self.assertTrue(engine.util.log_queue_stats()['dropped'] >= 19)
+
+        # a dropped record isn't formatted
+        class Formatted(object):
+            """ count the formatting of a log argument """
+            count = 0
+
+            def __str__(self):
+                Formatted.count += 1
+                return 'formatted'
+
+        handler = engine.util.BoundedQueueHandler(queue.Queue(1))
+        handler.handle(logging.makeLogRecord({'msg': 'first'}))
+        handler.handle(logging.makeLogRecord({'msg': '%s',
+                                              'args': (Formatted(),)}))
+        self.assertEqual(handler.dropped, 1)
+        self.assertEqual(Formatted.count, 0)
+
+        # a failing handler doesn't stop the listener
+        stream = io.StringIO()
+        logger = logging.getLogger('ecbb.tests.queue_broken')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(Broken())
+        logger.addHandler(logging.StreamHandler(stream))
+        (handler, listener) = engine.util.start_log_queue(logger)
+        raise_exceptions = logging.raiseExceptions
+        logging.raiseExceptions = False
+        try:
+            logger.info('one')
+            handler.queue.join()
+            logger.info('two')
+            listener.stop()
+        finally:
+            logging.raiseExceptions = raise_exceptions
+        self.assertEqual(stream.getvalue().splitlines(), ['one', 'two'])
+
+        _LOGGER.info('===END TEST_LOG_QUEUE===')
+
     def test_load_game(self):
         """ methods tested:
         get_game
@@ -130,19 +314,10 @@ class GMTests(unittest.TestCase):
         engine.db.change_db_fail(False)
 
         # test load_game, selective db failure
-        engine.db.change_db_fail(True, 'load_player')
-        db_ok, game = self.gm.load_game(in_progress_gid, force=True)
-        self.assertFalse(db_ok)
-        engine.db.change_db_fail(True, 'get_game_players_ids')
-        db_ok, game = self.gm.load_game(in_progress_gid, force=True)
-        self.assertFalse(db_ok)
-        engine.db.change_db_fail(True, 'get_game_ext')
-        db_ok, game = self.gm.load_game(in_progress_gid, force=True)
-        self.assertFalse(db_ok)
-        engine.db.change_db_fail(True, 'get_game_states_ids')
+        engine.db.change_db_fail(True, 'load_players')
         db_ok, game = self.gm.load_game(in_progress_gid, force=True)
         self.assertFalse(db_ok)
-        engine.db.change_db_fail(True, 'load_state')
+        engine.db.change_db_fail(True, 'load_games_bulk')
         db_ok, game = self.gm.load_game(in_progress_gid, force=True)
         self.assertFalse(db_ok)
         engine.db.change_db_fail(False)
@@ -153,6 +328,294 @@ class GMTests(unittest.TestCase):
 
         _LOGGER.info('===END TEST_LOAD_GAME_FAILED===')
 
+    def test_load_games(self):
+        """ methods tested:
+        load_games
+        """
+        _LOGGER.info('===BEGIN TEST_LOAD_GAMES===')
+
+        not_started_gid = 1
+        in_progress_gid = 2
+        not_a_gid = 666
+
+        # load one game, then the others with the loaded one from memory
+        db_ok, game = self.gm.load_game(in_progress_gid)
+        self.assertTrue(db_ok)
+        db_ok, games = self.gm.load_games([not_started_gid, in_progress_gid,
+                                           not_a_gid])
+        self.assertTrue(db_ok)
+        self.assertEqual(sorted(games), [not_started_gid, in_progress_gid])
+        self.assertTrue(games[in_progress_gid] is game)
+        self.assertEqual(games[not_started_gid].players_ids, [1, 2])
+        self.assertEqual(games[not_started_gid].states_ids, [1])
+        self.assertEqual(games[not_started_gid].cur_state.num_players, 2)
+
+        # all games in memory, no db access
+        engine.db.change_db_fail(True)
+        db_ok, games = self.gm.load_games([not_started_gid, in_progress_gid])
+        self.assertTrue(db_ok)
+        self.assertEqual(len(games), 2)
+        db_ok, games = self.gm.load_games([not_started_gid], force=True)
+        self.assertFalse(db_ok)
+        self.assertEqual(games, None)
+        engine.db.change_db_fail(False)
+
+        # cold load: the players of all the games are loaded at once
+        self.gm._web_players.clear()
+        engine.db.change_db_fail(True, 'load_player')
+        db_ok, games = self.gm.load_games([1, 2, 4], force=True)
+        engine.db.change_db_fail(False)
+        self.assertTrue(db_ok)
+        self.assertEqual(len(games), 3)
+        self.assertEqual(sorted(self.gm._web_players), [1, 2])
+
+        _LOGGER.info('===END TEST_LOAD_GAMES===')
+
+    def test_games_cache(self):
+        """ methods tested:
+        load_games
+        mark_dirty
+        pin_game
+        unpin_game
+        cache_stats
+        """
+        _LOGGER.info('===BEGIN TEST_GAMES_CACHE===')
+
+        gm = GamesManager(test_mode=True, max_games=2)
+        db_ok, games = gm.load_games([1, 2, 4])
+        self.assertTrue(db_ok)
+        self.assertEqual(len(games), 3)
+        stats = gm.cache_stats()
+        self.assertEqual(stats['games'], 2)
+        self.assertEqual(stats['misses'], 3)
+        self.assertEqual(stats['evictions'], 1)
+        # sized from the state blob read from the db
+        self.assertTrue(games[1].state_bytes > 0)
+        self.assertEqual(stats['bytes'], sum(games[game_id].state_bytes
+                                             for game_id in (2, 4)))
+
+        # the evicted dirty game is saved
+        db_ok, game = gm.load_game(2)
+        game.last_play = datetime(2012, 12, 21)
+        gm.mark_dirty(2)
+        gm.pin_game(4)
+        db_ok, game = gm.load_game(1)
+        self.assertEqual(gm.cache_stats()['write_backs'], 1)
+        gm.unpin_game(4)
+        db_ok, game = gm.load_game(2)
+        self.assertEqual(game.last_play, datetime(2012, 12, 21))
+        self.assertEqual(game.states_ids, [2, 5])
+
+        # the game put isn't evicted by the write back of a dirty game
+        gm = GamesManager(test_mode=True, max_games=1)
+        db_ok, game = gm.load_game(1)
+        gm.mark_dirty(1)
+        db_ok, game = gm.load_game(2)
+        self.assertTrue(db_ok)
+        self.assertEqual(gm.get_game(2), game)
+        stats = gm.cache_stats()
+        self.assertEqual(stats['games'], 1)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['write_backs'], 1)
+
+        # a game locked by another thread isn't written back
+        locked = threading.Event()
+        unlock = threading.Event()
+
+        def play():
+            """ hold the game lock as during a player turn """
+            with gm.game_lock(2):
+                locked.set()
+                unlock.wait(5)
+
+        gm.mark_dirty(2)
+        player = threading.Thread(target=play)
+        player.start()
+        self.assertTrue(locked.wait(5))
+        db_ok, game = gm.load_game(1)
+        unlock.set()
+        player.join()
+        self.assertEqual(sorted(gm._games._games), [1, 2])
+        self.assertTrue(gm._games.is_dirty(2))
+        self.assertEqual(gm.cache_stats()['write_backs'], 1)
+
+        _LOGGER.info('===END TEST_GAMES_CACHE===')
+
+    def test_write_behind(self):
+        """ methods tested:
+        save_game
+        save_game_async
+        flush
+        close
+        with write-behind
+        """
+        _LOGGER.info('===BEGIN TEST_WRITE_BEHIND===')
+
+        gm = GamesManager(test_mode=True, write_behind=True)
+        db_ok, games = gm.load_games([1, 2, 4])
+        self.assertTrue(db_ok)
+        states_ids = {game_id: list(game.states_ids)
+                      for game_id, game in games.items()}
+
+        # many players end their turn at the same time
+        futures = []
+        def end_turns(game):
+            for turn in range(5):
+                game.cur_state.cur_turn = turn
+                gm.mark_dirty(game.id_)
+                futures.append(gm.save_game_async(game))
+        threads = [threading.Thread(target=end_turns, args=(game, ))
+                   for game in games.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        gm.flush()
+
+        self.assertEqual(len(futures), 15)
+        for future in futures:
+            self.assertEqual(future.result(), (True, True))
+        stats = gm.write_behind_stats()
+        self.assertEqual(stats['saves'], 15)
+        self.assertTrue(stats['batches'] <= 15)
+        cache_stats = gm.cache_stats()
+        self.assertEqual(cache_stats['pinned'], 0)
+        self.assertEqual(cache_stats['dirty'], 0)
+
+        # the saves of a game are in order
+        for game_id, game in games.items():
+            new_ids = game.states_ids[len(states_ids[game_id]):]
+            self.assertEqual(len(new_ids), 5)
+            self.assertEqual(new_ids, sorted(new_ids))
+            status, state = gm._db.load_state(new_ids[-1])
+            self.assertEqual(state.cur_turn, 4)
+
+        # synchronous save through the queue
+        game = games[2]
+        game.last_play = datetime(2013, 1, 1)
+        self.assertEqual(gm.save_game(game), (True, True))
+        db_ok, game = gm.load_game(2, force=True)
+        self.assertEqual(game.last_play, datetime(2013, 1, 1))
+
+        # the state id is appended with the game lock held: deferred while
+        # the caller holds it
+        with gm.game_lock(2):
+            count = len(game.states_ids)
+            saved = gm.save_game_async(game)
+            saved.result()
+            self.assertEqual(len(game.states_ids), count)
+            self.assertEqual(gm.save_game(game), (True, True))
+            self.assertEqual(len(game.states_ids), count + 2)
+        saved = gm.save_game_async(game)
+        gm.flush()
+        self.assertEqual(len(game.states_ids), count + 3)
+        self.assertEqual(game.states_ids, sorted(game.states_ids))
+
+        # unknown game
+        game.id_ = 666
+        self.assertEqual(gm.save_game(game), (True, False))
+
+        # a state which can't be serialized
+        game = games[4]
+        game.cur_state.cur_actions.append(lambda: None)
+        gm.mark_dirty(4)
+        self.assertEqual(gm.save_game_async(game).result(), (False, False))
+        self.assertFalse(gm._games.is_pinned(4))
+        self.assertTrue(gm._games.is_dirty(4))
+        game.cur_state.cur_actions.pop()
+
+        gm.close()
+        self.assertEqual(gm.save_game_async(games[1]).result(),
+                         (False, False))
+        self.assertTrue(gm.cache_stats()['dirty'] >= 1)
+
+        _LOGGER.info('===END TEST_WRITE_BEHIND===')
+
+    def test_concurrency(self):
+        """ many threads sharing a games manager, methods tested:
+        load_game
+        get_player
+        game_lock
+        save_game
+        """
+        _LOGGER.info('===BEGIN TEST_CONCURRENCY===')
+
+        num_threads = 16
+        # count the db loads, slowed down to let the threads race
+        loads = []
+        load_games_bulk = self.gm._db.load_games_bulk
+        def counted_load_games_bulk(games_ids):
+            loads.extend(games_ids)
+            time.sleep(0.01)
+            return load_games_bulk(games_ids)
+        self.gm._db.load_games_bulk = counted_load_games_bulk
+        players_loads = []
+        load_player = self.gm._db.load_player
+        def counted_load_player(player_id):
+            players_loads.append(player_id)
+            time.sleep(0.01)
+            return load_player(player_id)
+        self.gm._db.load_player = counted_load_player
+        load_players = self.gm._db.load_players
+        def counted_load_players(players_ids):
+            players_loads.extend(players_ids)
+            time.sleep(0.01)
+            return load_players(players_ids)
+        self.gm._db.load_players = counted_load_players
+
+        barrier = threading.Barrier(num_threads)
+        results = []
+        errors = []
+        def run(thread_id):
+            try:
+                barrier.wait()
+                game_id = (1, 2, 4)[thread_id % 3]
+                results.append(self.gm.load_game(game_id))
+                self.assertNotEqual(self.gm.get_player(1), None)
+                for dummy in range(5):
+                    with self.gm.game_lock(game_id):
+                        game = self.gm.get_game(game_id)
+                        game.cur_state.cur_turn += 1
+                        self.assertEqual(self.gm.save_game(game),
+                                         (True, True))
+            except Exception as err:
+                errors.append(err)
+
+        turns = {}
+        for game_id in (1, 2, 4):
+            db_ok, state = self.gm._db.load_state(
+                self.gm._db.get_game_states_ids(game_id)[1][-1])
+            turns[game_id] = state.cur_turn
+        del loads[:]
+        self.gm._web_players.clear()
+
+        threads = [threading.Thread(target=run, args=(thread_id, ))
+                   for thread_id in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        # a single db load per game and per player
+        self.assertEqual(sorted(loads), [1, 2, 4])
+        self.assertEqual(sorted(players_loads), [1, 2])
+        self.assertTrue(all(db_ok for db_ok, dummy in results))
+        self.assertEqual(len(set(id(game) for dummy, game in results)), 3)
+
+        # the turns of a game were serialized
+        for game_id in (1, 2, 4):
+            game = self.gm.get_game(game_id)
+            plays = 5 * len([thread_id for thread_id in range(num_threads)
+                             if (1, 2, 4)[thread_id % 3] == game_id])
+            self.assertEqual(game.cur_state.cur_turn, turns[game_id] + plays)
+            self.assertEqual(len(set(game.states_ids)), len(game.states_ids))
+            db_ok, state = self.gm._db.load_state(game.states_ids[-1])
+            self.assertEqual(state.cur_turn, game.cur_state.cur_turn)
+        self.assertEqual(len(self.gm._game_locks), 0)
+
+        _LOGGER.info('===END TEST_CONCURRENCY===')
+
     def test_get_my_games(self):
         """ methods tested:
         get_my_games
@@ -166,6 +629,12 @@ class GMTests(unittest.TestCase):
         db_ok, games = self.gm.get_my_games(player_1_id)
         self.assertTrue(db_ok)
         self.assertEqual(len(games),  3) # not started, in-progress, private
+        self.assertEqual([game.name for game in games],
+                         ['my test game', 'my in-progress test game',
+                          'my private test game'])
+        # listed without being loaded
+        with self.assertRaises(KeyError):
+            self.gm.get_game(games[0].id_)
 
         engine.db.change_db_fail(True)
         db_ok, games = self.gm.get_my_games(player_1_id)
@@ -241,6 +710,99 @@ class GMTests(unittest.TestCase):
 
         _LOGGER.info('===END TEST_SAVE_GAME===')
 
+    def test_undo_actions(self):
+        """ methods tested:
+        undo_actions
+        save_game
+        """
+        _LOGGER.info('===BEGIN TEST_UNDO_ACTIONS===')
+
+        db_ok, game = self.gm.load_game(2)
+        self.assertTrue(db_ok)
+        state = game.cur_state
+        state.add_player(1, 'manu', ['terran'])
+        state.get_player(1).money = 5
+        state.cur_player = 1
+        saved_actions = list(state.cur_actions)
+        turn = [Action(('money', 1), 5, 3), Action(('money', 1), 3, 2)]
+        self.assertEqual(state.apply_turn(turn, 1), (True, None))
+
+        # the last action, then the rest of the turn
+        self.assertEqual(self.gm.undo_actions(2, 2), (False, []))
+        self.assertEqual(self.gm.undo_actions(2, 1), (True, [turn[1]]))
+        self.assertEqual(state.get_player(1).money, 3)
+        self.assertEqual(self.gm.undo_actions(2, 1, None), (True, [turn[0]]))
+        self.assertEqual(state.get_player(1).money, 5)
+        self.assertEqual(state.cur_actions, saved_actions)
+        self.assertEqual(self.gm.undo_actions(2, 1), (False, []))
+        self.assertEqual(self.gm.undo_actions(666, 1), (False, []))
+
+        # the saved actions are no longer undone
+        state.apply_turn(turn, 1)
+        db_ok, upd_ok = self.gm.save_game(game)
+        self.assertTrue(db_ok and upd_ok)
+        self.assertEqual(self.gm.undo_actions(2, 1), (False, []))
+        self.assertEqual(state.get_player(1).money, 2)
+
+        # player 2 plays, player 1 can't undo the actions of player 2
+        state.add_player(2, 'adri', ['hydran'])
+        state.get_player(2).money = 5
+        state.apply_turn([Action('cur_player', 1, 2)], 1)
+        turn = [Action(('money', 2), 5, 4)]
+        state.apply_turn(turn, 2)
+        self.assertEqual(self.gm.undo_actions(2, 1), (False, []))
+        self.assertEqual(state.get_player(2).money, 4)
+        self.assertEqual(self.gm.undo_actions(2, 2), (True, turn))
+        self.assertEqual(state.get_player(2).money, 5)
+
+        _LOGGER.info('===END TEST_UNDO_ACTIONS===')
+
+    def test_play_turn(self):
+        """ methods tested:
+        play_turn
+        undo_actions
+        the game is kept in memory during a player turn
+        """
+        _LOGGER.info('===BEGIN TEST_PLAY_TURN===')
+
+        gm = GamesManager(test_mode=True, max_games=1)
+        db_ok, game = gm.load_game(2)
+        self.assertTrue(db_ok)
+        state = game.cur_state
+        state.add_player(1, 'manu', ['terran'])
+        state.get_player(1).money = 5
+        state.cur_player = 1
+        turn = [Action(('money', 1), 5, 3)]
+        self.assertEqual(gm.play_turn(2, 2, turn), (False, 0))
+        self.assertFalse(gm._games.is_pinned(2))
+        self.assertEqual(gm.play_turn(2, 1, turn), (True, None))
+        self.assertTrue(gm._games.is_pinned(2))
+        self.assertTrue(gm._games.is_dirty(2))
+
+        # not evicted nor written back in the middle of the turn
+        db_ok, other = gm.load_game(1)
+        self.assertIs(gm._games.peek(2), game)
+        self.assertEqual(gm.cache_stats()['write_backs'], 0)
+
+        # undone, nothing of the turn is applied: no longer pinned
+        self.assertEqual(gm.undo_actions(2, 1), (True, turn))
+        self.assertFalse(gm._games.is_pinned(2))
+        self.assertNotIn(1, gm._games)
+
+        # a whole turn, written back once evicted
+        self.assertEqual(gm.play_turn(2, 1, turn + [
+            Action('cur_player', 1, None)]), (True, None))
+        self.assertFalse(gm._games.is_pinned(2))
+        db_ok, other = gm.load_game(4)
+        self.assertNotIn(2, gm._games)
+        self.assertEqual(gm.cache_stats()['write_backs'], 1)
+        self.assertEqual(gm.play_turn(2, 1, turn), (False, None))
+        db_ok, game = gm.load_game(2)
+        self.assertEqual(game.cur_state.get_player(1).money, 3)
+        self.assertEqual(game.cur_state.cur_player, None)
+
+        _LOGGER.info('===END TEST_PLAY_TURN===')
+
     def test_create_game(self):
         """ methods tested:
         create_game
@@ -288,8 +850,8 @@ class GMTests(unittest.TestCase):
         self.assertEqual(new_game.states_ids, new_game_reload.states_ids)
         self.assertEqual(new_game.last_valid_state_id,
                          new_game_reload.last_valid_state_id)
-        self.assertEqual(new_game.cur_state.__dict__,
-                         new_game_reload.cur_state.__dict__)
+        self.assertEqual(new_game.cur_state.__getstate__(),
+                         new_game_reload.cur_state.__getstate__())
 
         # db error creating a new game
         engine.db.change_db_fail(True)
@@ -307,6 +869,7 @@ class GMTests(unittest.TestCase):
         """ methods tested:
         load_player
         get_player
+        players_stats
         """
         _LOGGER.info('===BEGIN TEST_GETLOAD_PLAYER===')
 
@@ -314,8 +877,15 @@ class GMTests(unittest.TestCase):
         not_player_id = 666
 
         # check ok get_player
+        before = self.gm.players_stats()
         player = self.gm.get_player(player_id_1)
         self.assertEqual(player.id_, player_id_1)
+        self.assertEqual(self.gm.get_player(player_id_1), player)
+        after = self.gm.players_stats()
+        self.assertEqual(after['hits'] + after['misses'],
+                         before['hits'] + before['misses'] + 2)
+        self.assertTrue(after['hits'] > before['hits'])
+        self.assertTrue(after['players'] >= 1)
 
         # check missing get_player
         dummy = self.gm.get_player(not_player_id)
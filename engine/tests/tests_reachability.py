@@ -0,0 +1,141 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import random
+import unittest
+from engine.data_types import Hex
+from engine.galaxy import DIRECTIONS, Galaxy
+from engine.reachability import Reachability, UNREACHABLE
+import engine.util
+
+engine.util.init_logging(test_mode=True)
+_LOGGER = logging.getLogger('ecbb.tests')
+
+ALL = (True, ) * 6
+# wormholes on sides 0 and 3 only
+LINE = (True, False, False, True, False, False)
+
+def line_galaxy(length):
+    """ a galaxy of hexes (0, 0), (1, 0), ... linked east to west """
+    galaxy = Galaxy()
+    for q in range(length):
+        galaxy.place(Hex(q, LINE, []), q, 0)
+    return galaxy
+
+class ReachabilityTests(unittest.TestCase):
+    """ test the reachability cache """
+    def test_reachable(self):
+        """ methods tested:
+        Reachability.reachable
+        Reachability.can_reach
+        Reachability.ships_changed
+        """
+        _LOGGER.info('===BEGIN TEST_REACHABLE===')
+
+        galaxy = line_galaxy(5)
+        reach = Reachability(galaxy)
+        self.assertEqual(reach.reachable(0, 2), {0: 0, 1: 1, 2: 2})
+        self.assertEqual(reach.reachable(2, 1), {1: 1, 2: 0, 3: 1})
+        self.assertEqual((reach.hits, reach.misses), (0, 2))
+        reach.reachable(0, 2)
+        self.assertEqual((reach.hits, reach.misses), (1, 2))
+
+        # pinned in hex 1
+        blockers = frozenset([1])
+        self.assertEqual(reach.reachable(0, 3, blockers), {0: 0, 1: 1})
+        self.assertEqual(reach.reachable(1, 3, blockers), {1: 0})
+        self.assertFalse(reach.can_reach(0, 2, 3, blockers))
+        self.assertTrue(reach.can_reach(0, 3, 3))
+        self.assertFalse(reach.can_reach(0, 4, 3))
+
+        # the ships of hex 1 moved: only the searches it blocked are dropped
+        misses = reach.misses
+        reach.ships_changed(1)
+        reach.reachable(0, 2)
+        self.assertEqual(reach.misses, misses)
+        reach.reachable(0, 3, blockers)
+        self.assertEqual(reach.misses, misses + 1)
+
+        # a full cache evicts the least recently used search
+        reach = Reachability(galaxy, max_searches=2)
+        reach.reachable(0, 1)
+        reach.reachable(1, 1)
+        reach.reachable(0, 1)
+        reach.reachable(2, 1)
+        misses = reach.misses
+        reach.reachable(0, 1)
+        self.assertEqual(reach.misses, misses)
+        reach.reachable(1, 1)
+        self.assertEqual(reach.misses, misses + 1)
+
+        _LOGGER.info('===END TEST_REACHABLE===')
+
+    def test_map_changes(self):
+        """ methods tested:
+        Reachability.reachable
+        Reachability.distance
+        """
+        _LOGGER.info('===BEGIN TEST_MAP_CHANGES===')
+
+        galaxy = line_galaxy(5)
+        reach = Reachability(galaxy)
+        self.assertEqual(reach.distance(0, 4), 4)
+        self.assertEqual(reach.distance(4, 0), 4)
+        far = reach.reachable(3, 1)
+        near = reach.reachable(0, 2)
+
+        # turned, hex 4 is no longer linked, the searches far from it are
+        # kept
+        galaxy.rotate(4, 1)
+        self.assertEqual(reach.distance(0, 4), UNREACHABLE)
+        self.assertIs(reach.reachable(0, 2), near)
+        self.assertIsNot(reach.reachable(3, 1), far)
+        self.assertEqual(reach.reachable(3, 1), {2: 1, 3: 0})
+
+        # a new hex west of hex 0
+        galaxy.place(Hex(5, ALL, []), -1, 0)
+        self.assertEqual(reach.reachable(0, 2), {0: 0, 1: 1, 2: 2, 5: 1})
+        self.assertEqual(reach.distance(5, 3), 4)
+        self.assertEqual(reach.distance(5, 4), UNREACHABLE)
+        self.assertEqual(reach.distance(5, 4, half=True), 5)
+
+        # the cached searches always give the result of a new search
+        rand = random.Random(4)
+        positions = [(q, r) for q in range(-3, 4) for r in range(-3, 4)]
+        rand.shuffle(positions)
+        galaxy = Galaxy()
+        reach = Reachability(galaxy)
+        for hex_id, (q, r) in enumerate(positions):
+            wormholes = tuple(rand.random() < 0.6 for _ in DIRECTIONS)
+            galaxy.place(Hex(hex_id, wormholes, []), q, r, rand.randrange(6))
+            galaxy.rotate(rand.randrange(len(galaxy)), rand.randrange(6))
+            for _ in range(5):
+                start = rand.randrange(len(galaxy))
+                drive = rand.randint(1, 4)
+                blockers = frozenset(rand.sample(range(len(galaxy)),
+                                                 min(2, len(galaxy))))
+                cached = reach.reachable(start, drive, blockers)
+                self.assertEqual(cached, Reachability(galaxy).reachable(
+                    start, drive, blockers))
+                end = rand.randrange(len(galaxy))
+                self.assertEqual(reach.can_reach(start, end, drive),
+                                 end in Reachability(galaxy).reachable(
+                                     start, drive))
+        self.assertTrue(reach.hits > 0)
+
+        _LOGGER.info('===END TEST_MAP_CHANGES===')
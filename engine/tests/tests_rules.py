@@ -0,0 +1,346 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import pickle
+import unittest
+from engine.data_types import Action, GameState, Hex, Ship
+import engine.rules
+import engine.serializer
+import engine.util
+
+engine.util.init_logging(test_mode=True)
+_LOGGER = logging.getLogger('ecbb.tests')
+
+ALL = (True, ) * 6
+# wormholes on sides 0 and 3 only
+LINE = (True, False, False, True, False, False)
+
+def new_state():
+    """ a two players state, the galaxy is a line of three hexes with the
+    ships of player 2 in the last one, player 1 playing
+    """
+    state = GameState(2)
+    for player_id in (1, 2):
+        state.add_player(player_id, 'player {}'.format(player_id),
+                         ['terran', 'hydran'])
+        player = state.get_player(player_id)
+        (player.money, player.science, player.materials) = (5, 14, 5)
+        player.influence = 10
+    for hex_id in (1, 2, 3, 4):
+        state.hexes[hex_id] = Hex(hex_id, LINE, [])
+    for ship_id, owner, type_ in ((1, 1, 'interceptor'),
+                                  (2, 1, 'interceptor'),
+                                  (3, 2, 'cruiser'),
+                                  (4, 1, 'starbase')):
+        state.ships[ship_id] = Ship(ship_id, owner, type_)
+    (valid, index) = state.apply_game_turn([
+        Action(('hex', 1), 'stack', ('pos', 0, 0, 0)),
+        Action(('hex', 2), 'stack', ('pos', 1, 0, 0)),
+        Action(('hex', 3), 'stack', ('pos', 2, 0, 0)),
+        Action(('ship', 1), 'reserve', ('hex', 1)),
+        Action(('ship', 3), 'reserve', ('hex', 3)),
+        Action('cur_player', None, 1)])
+    assert valid, index
+    state.cur_actions = []
+    state.clear_undo()
+    return state
+
+def play(state, player_id, actions):
+    """ apply the actions of a player turn, of a game turn when player_id is
+    None
+    """
+    if player_id is None:
+        return state.apply_game_turn(actions)
+    return state.apply_turn(actions, player_id)
+
+def summary(state):
+    """ return: the values of a state changed by the actions """
+    return (state.cur_turn, state.cur_player,
+            [player.__getstate__() for player in state.players.values()],
+            [hex_.__getstate__() for hex_ in state.hexes.values()],
+            [ship.__getstate__() for ship in state.ships.values()])
+
+class RulesTests(unittest.TestCase):
+    """ test the action engine """
+    def test_player_turn(self):
+        """ methods tested:
+        GameState.apply_turn
+        GameState.is_action_valid
+        """
+        _LOGGER.info('===BEGIN TEST_PLAYER_TURN===')
+
+        state = new_state()
+        player = state.get_player(1)
+        # the example turn of the Action docstring
+        turn = [Action(('influence', 1), 'track', 'action'),
+                Action(('science', 1), 14, 11),
+                Action(('materials', 1), 5, 6),
+                Action(('materials', 1), 6, 0),
+                Action(('ship', 2), 'reserve', ('hex', 1)),
+                Action(('ship', 4), 'reserve', ('hex', 2)),
+                Action('cur_player', 1, 2)]
+        self.assertEqual(state.apply_turn(turn, 1), (True, None))
+        self.assertEqual((player.science, player.materials), (11, 0))
+        self.assertEqual((player.influence, player.actions), (9, 1))
+        self.assertEqual(state.ships[4].hex_id, 2)
+        self.assertEqual(state.cur_player, 2)
+        self.assertEqual(state.cur_actions, turn)
+
+        # not enough materials for the second ship: nothing is applied
+        state = new_state()
+        player = state.get_player(1)
+        turn = [Action(('materials', 1), 5, 0),
+                Action(('ship', 2), 'reserve', ('hex', 1)),
+                Action(('ship', 4), 'reserve', ('hex', 2))]
+        self.assertEqual(state.apply_turn(turn, 1), (False, 2))
+        self.assertEqual(player.materials, 5)
+        self.assertEqual(state.ships[2].hex_id, None)
+        self.assertEqual(state.cur_actions, [])
+
+        # each action is checked on the state left by the previous ones
+        self.assertEqual(state.apply_turn(
+            [Action(('money', 1), 5, 2), Action(('money', 1), 5, 1)], 1),
+            (False, 1))
+        self.assertEqual(state.apply_turn(
+            [Action(('influence', 1), 'track', ('hex', 2)),
+             Action(('influence', 2), 'track', ('hex', 2))], 1), (False, 1))
+        # the elements of the other players and of the game
+        game = engine.rules.Turn.of_game(state)
+        self.assertFalse(state.is_action_valid(
+            Action(('money', 2), 5, 4), 1))
+        self.assertTrue(game.add(Action(('money', 2), 5, 4)))
+        self.assertFalse(state.is_action_valid(Action('turn', 0, 1), 1))
+        self.assertTrue(game.add(Action('turn', 0, 1)))
+        self.assertFalse(game.add(Action('turn', 1, 3)))
+        # unknown elements and zones
+        for action in (Action(1, 'reserve', 'hex 2'),
+                       Action(('ship', 9), 'reserve', ('hex', 1)),
+                       Action(('ship', 2), 'reserve', ('hex', 4)),
+                       Action(('hex', 4), 'stack', ('pos', 1)),
+                       Action(('money', 1), 5, 'six')):
+            self.assertFalse(state.is_action_valid(action, 1))
+        self.assertRaises(ValueError, state.apply_action,
+                          Action(1, 'reserve', 'hex 2'))
+
+        _LOGGER.info('===END TEST_PLAYER_TURN===')
+
+    def test_cur_player(self):
+        """ methods tested:
+        GameState.apply_turn
+        GameState.apply_game_turn
+        only the cur_player plays
+        """
+        _LOGGER.info('===BEGIN TEST_CUR_PLAYER===')
+
+        state = new_state()
+        turn = [Action(('money', 2), 5, 4)]
+        self.assertEqual(state.apply_turn(turn, 2), (False, 0))
+        self.assertFalse(state.is_action_valid(turn[0], 2))
+
+        # player 1 passes, then can't play
+        self.assertEqual(state.apply_turn(
+            [Action(('money', 1), 5, 4), Action('cur_player', 1, 2),
+             Action(('money', 1), 4, 3)], 1), (False, 2))
+        self.assertEqual(state.apply_turn(
+            [Action(('money', 1), 5, 4), Action('cur_player', 1, 2)], 1),
+            (True, None))
+        self.assertEqual(state.apply_turn([Action(('money', 1), 4, 3)], 1),
+                         (False, 0))
+        self.assertEqual(state.get_player(1).money, 4)
+        self.assertEqual(state.apply_turn(turn, 2), (True, None))
+
+        # no player, only through apply_game_turn
+        state.cur_player = None
+        turn = [Action(('money', 1), 4, 9)]
+        self.assertEqual(state.apply_turn(turn, None), (False, 0))
+        self.assertFalse(state.is_action_valid(turn[0], None))
+        self.assertEqual(state.get_player(1).money, 4)
+        self.assertEqual(state.apply_game_turn(turn), (True, None))
+        self.assertEqual(state.get_player(1).money, 9)
+
+        _LOGGER.info('===END TEST_CUR_PLAYER===')
+
+    def test_galaxy_actions(self):
+        """ methods tested:
+        GameState.is_action_valid
+        GameState.apply_action
+        with the galaxy and the ships
+        """
+        _LOGGER.info('===BEGIN TEST_GALAXY_ACTIONS===')
+
+        state = new_state()
+        galaxy = state.galaxy
+        self.assertEqual(len(galaxy), 3)
+
+        # interceptors move one hex, pinned by the cruiser of player 2
+        move = Action(('ship', 1), ('hex', 1), ('hex', 2))
+        self.assertTrue(state.is_action_valid(move, 1))
+        self.assertFalse(state.is_action_valid(
+            Action(('ship', 1), ('hex', 1), ('hex', 3)), 1))
+        self.assertFalse(state.is_action_valid(
+            Action(('ship', 1), ('hex', 2), ('hex', 3)), 1))
+        state.apply_action(move)
+        self.assertTrue(state.is_action_valid(
+            Action(('ship', 1), ('hex', 2), ('hex', 3)), 1))
+        state.apply_action(Action(('ship', 3), ('hex', 3), ('hex', 2)))
+        self.assertEqual(state.blockers(1), frozenset([galaxy.index_of(2)]))
+        self.assertFalse(state.is_action_valid(
+            Action(('ship', 1), ('hex', 2), ('hex', 3)), 1))
+        state.cur_player = 2
+        self.assertFalse(state.is_action_valid(move, 2))
+        self.assertFalse(state.is_action_valid(
+            Action(('ship', 3), ('hex', 2), ('hex', 3)), 2))
+        state.cur_player = 1
+
+        # explored next to the galaxy, then turned
+        explore = Action(('hex', 4), 'stack', ('pos', 3, 0, 1))
+        self.assertFalse(state.is_action_valid(
+            Action(('hex', 4), 'stack', ('pos', 5, 0, 0)), 1))
+        self.assertFalse(state.is_action_valid(
+            Action(('hex', 4), 'stack', ('pos', 2, 0, 0)), 1))
+        self.assertTrue(state.is_action_valid(explore, 1))
+        state.apply_action(explore)
+        self.assertEqual(galaxy.hex_at((3, 0)).id_, 4)
+        rotate = Action(('hex', 4), ('pos', 3, 0, 1), ('pos', 3, 0, 0))
+        self.assertTrue(state.is_action_valid(rotate, 1))
+        self.assertFalse(state.is_action_valid(
+            Action(('hex', 4), ('pos', 3, 0, 1), ('pos', 4, 0, 0)), 1))
+        self.assertEqual(state.reachability.distance(galaxy.index_of(1),
+                                                     galaxy.index_of(4)),
+                         0xffff)
+        state.apply_action(rotate)
+        self.assertEqual(state.reachability.distance(galaxy.index_of(1),
+                                                     galaxy.index_of(4)), 3)
+
+        # put back in the stack, the galaxy is rebuilt
+        state.apply_action(Action(('hex', 4), ('pos', 3, 0, 0), 'stack'))
+        self.assertIsNot(state.galaxy, galaxy)
+        self.assertEqual(len(state.galaxy), 3)
+        self.assertEqual(state.hexes[4].q, None)
+
+        # the caches are not stored, the galaxy is rebuilt when loaded
+        for copied in (pickle.loads(pickle.dumps(state)),
+                       engine.serializer.decode(
+                           engine.serializer.encode(state))):
+            self.assertEqual(len(copied.galaxy), 3)
+            self.assertEqual(copied.ships[1].hex_id, 2)
+            self.assertEqual(copied.get_player(1).money, 5)
+            self.assertFalse(copied.is_action_valid(
+                Action(('ship', 1), ('hex', 2), ('hex', 3)), 1))
+
+        _LOGGER.info('===END TEST_GALAXY_ACTIONS===')
+
+    def test_replay(self):
+        """ methods tested:
+        GameState.apply_action
+        the actions of the turns rebuild the state
+        """
+        _LOGGER.info('===BEGIN TEST_REPLAY===')
+
+        state = new_state()
+        start = engine.serializer.encode(state)
+        turns = [(1, [Action(('influence', 1), 'track', 'action'),
+                      Action(('influence', 1), 'track', ('hex', 1)),
+                      Action(('money', 1), 5, 3),
+                      Action('cur_player', 1, 2)]),
+                 (2, [Action(('influence', 2), 'track', ('hex', 3)),
+                      Action(('ship', 3), ('hex', 3), ('hex', 2)),
+                      Action('cur_player', 2, None)]),
+                 (None, [Action(('influence', 1), 'action', 'track'),
+                         Action('turn', 0, 1)])]
+        for player_id, actions in turns:
+            self.assertEqual(play(state, player_id, actions), (True, None))
+
+        replayed = engine.serializer.decode(start)
+        for action in state.cur_actions:
+            replayed.apply_action(action)
+        self.assertEqual(summary(replayed), summary(state))
+        self.assertEqual(replayed.hexes[3].influence, 2)
+        self.assertEqual(replayed.cur_turn, 1)
+
+        _LOGGER.info('===END TEST_REPLAY===')
+
+    def test_undo(self):
+        """ methods tested:
+        Action.inverse
+        GameState.undo
+        GameState.clear_undo
+        """
+        _LOGGER.info('===BEGIN TEST_UNDO===')
+
+        state = new_state()
+        before = summary(state)
+        turns = [[Action(('influence', 1), 'track', 'action'),
+                  Action(('materials', 1), 5, 0),
+                  Action(('ship', 2), 'reserve', ('hex', 1)),
+                  Action(('ship', 1), ('hex', 1), ('hex', 2))],
+                 [Action(('money', 1), 5, 3)]]
+        for actions in turns:
+            self.assertEqual(state.apply_turn(actions, 1), (True, None))
+        self.assertEqual(state.undo_size(1), 5)
+        self.assertEqual(state.undo_size(2), 0)
+        after = summary(state)
+
+        # one action, then the others, not more
+        self.assertEqual(state.undo(1, 1), (True, [turns[1][0]]))
+        self.assertEqual(state.get_player(1).money, 5)
+        self.assertEqual(len(state.cur_actions), 4)
+        self.assertEqual(state.undo(1, 5), (False, []))
+        self.assertEqual(state.undo(2, 1), (False, []))
+        (undo_ok, undone) = state.undo(1)
+        self.assertTrue(undo_ok)
+        self.assertEqual(len(undone), 4)
+        self.assertEqual(undone[0].element, ('ship', 1))
+        self.assertEqual(summary(state), before)
+        self.assertEqual(state.cur_actions, [])
+        self.assertEqual(state.undo(1, 1), (False, []))
+
+        # replayed again, the state is the same
+        for actions in turns:
+            state.apply_turn(actions, 1)
+        self.assertEqual(summary(state), after)
+        inverse = turns[0][3].inverse()
+        self.assertEqual((inverse.old_zone, inverse.new_zone),
+                         (('hex', 2), ('hex', 1)))
+
+        # the end of the turn can't be undone, nor the actions of the next
+        # player by player 1
+        self.assertEqual(state.apply_turn([Action('cur_player', 1, 2)], 1),
+                         (True, None))
+        self.assertEqual(state.undo_size(1), 0)
+        self.assertEqual(state.apply_turn([Action(('money', 2), 5, 4)], 2),
+                         (True, None))
+        self.assertEqual(state.undo(1, 1), (False, []))
+        self.assertEqual(state.undo(1), (True, []))
+        self.assertEqual(state.get_player(2).money, 4)
+        self.assertEqual(state.undo_size(2), 1)
+
+        # nor the actions of the game
+        self.assertEqual(state.apply_game_turn([Action('turn', 0, 1)]),
+                         (True, None))
+        self.assertEqual(state.undo_size(2), 0)
+        self.assertEqual(state.cur_turn, 1)
+
+        # the saved actions can't be undone
+        state.apply_turn([Action(('money', 2), 4, 3)], 2)
+        state.clear_undo()
+        self.assertEqual(state.undo(2, 1), (False, []))
+        self.assertEqual(state.get_player(2).money, 3)
+        self.assertNotIn('_undo', state.__getstate__())
+
+        _LOGGER.info('===END TEST_UNDO===')
@@ -0,0 +1,195 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import copy
+import logging
+import marshal
+import pickle
+import unittest
+from engine.data_types import Action, GameState, Hex, Planet, PopSlot
+import engine.serializer
+from engine.serializer import FIELD_KINDS, Field, Schema
+import engine.util
+
+engine.util.init_logging(test_mode=True)
+_LOGGER = logging.getLogger('ecbb.tests')
+
+def new_state():
+    """ a state with players and actions """
+    state = GameState(3)
+    state.cur_turn = 2
+    for player_id in (1, 2, 3):
+        state.add_player(player_id, 'player {}'.format(player_id),
+                         ['terran', 'hydran', 'planta'])
+    state.get_player(2).race = 'hydran'
+    state.players_order = [3, 1, 2]
+    state.cur_actions = [Action(1, 'reserve', 'hex 2'),
+                         Action('science', 14, 11)]
+    return state
+
+class Versioned(object):
+    """ a class whose schema got a new field """
+    pass
+
+class LegacyPickle(object):
+    """ pickled like the objects of the states pickled before __slots__ """
+    def __init__(self, cls, attrs):
+        self.cls = cls
+        self.attrs = attrs
+
+    def __reduce_ex__(self, protocol):
+        return (object.__new__, (self.cls, ), self.attrs)
+
+class SerializerTests(unittest.TestCase):
+    """ test the binary serializer of the game states """
+    def test_encode_decode(self):
+        """ methods tested:
+        encode
+        decode
+        """
+        _LOGGER.info('===BEGIN TEST_ENCODE_DECODE===')
+
+        state = new_state()
+        data = engine.serializer.encode(state)
+        self.assertTrue(len(data) < len(pickle.dumps(state)))
+        decoded = engine.serializer.decode(data)
+        self.assertEqual(type(decoded), GameState)
+        self.assertEqual(decoded.players_order, [3, 1, 2])
+        self.assertEqual(sorted(decoded.players), [1, 2, 3])
+        self.assertEqual(decoded.get_player(2).__getstate__(),
+                         state.get_player(2).__getstate__())
+        self.assertEqual([action.__getstate__()
+                          for action in decoded.cur_actions],
+                         [action.__getstate__()
+                          for action in state.cur_actions])
+        self.assertEqual(set(decoded.__getstate__()),
+                         set(state.__getstate__()))
+
+        # nested objects
+        hex_ = Hex(4, (True, False, True, True, False, False),
+                   [Planet(1, [PopSlot(1, 'money', True),
+                               PopSlot(2, 'grey', False)])])
+        hex_.influence = 2
+        decoded = engine.serializer.decode(engine.serializer.encode(hex_, Hex),
+                                           Hex)
+        self.assertEqual(decoded.wormholes, hex_.wormholes)
+        self.assertEqual(decoded.influence, 2)
+        self.assertEqual(decoded.planets[0].slots[1].type_, 'grey')
+        self.assertEqual(decoded.planets[0].slots[0].star, True)
+        self.assertEqual((decoded.q, decoded.r), (None, None))
+
+        # hexes stored before their coordinates
+        decoded = engine.serializer.decode(
+            marshal.dumps((1, 5, None, (True, ) * 6, [], 2)), Hex)
+        self.assertEqual((decoded.id_, decoded.rotation), (5, 2))
+        self.assertEqual((decoded.q, decoded.r), (None, None))
+
+        # errors
+        self.assertRaises(TypeError, engine.serializer.encode, hex_)
+        self.assertRaises(ValueError, engine.serializer.decode, data[:-3])
+        self.assertRaises(ValueError, engine.serializer.decode,
+                          marshal.dumps((99, 1, 2)))
+        self.assertRaises(ValueError, engine.serializer.decode,
+                          marshal.dumps((1, 1, 2)))
+
+        _LOGGER.info('===END TEST_ENCODE_DECODE===')
+
+    def test_versions(self):
+        """ methods tested:
+        Schema.compile
+        Schema.flatten
+        Schema.unflatten
+        """
+        _LOGGER.info('===BEGIN TEST_VERSIONS===')
+
+        fields = [Field('id_'),
+                  Field('name'),
+                  Field('tags', default=list, since=2),
+                  Field('actions', FIELD_KINDS.LIST, Action, since=2),
+                  Field('owner', since=3, default='nobody')]
+        self.assertRaises(ValueError, Schema, Versioned, 2, fields)
+
+        schema = Schema(Versioned, 3, fields)
+        schema.compile()
+        obj = Versioned()
+        obj.__dict__.update(id_=1, name='v3', tags=['a'],
+                            actions=[Action(1, 2, 3)], owner='manu')
+        record = schema.flatten(obj)
+        self.assertEqual(record[0], 3)
+        decoded = schema.unflatten(record)
+        self.assertEqual(decoded.owner, 'manu')
+        self.assertEqual(decoded.actions[0].new_zone, 3)
+
+        # records written by the older versions of the schema
+        decoded = schema.unflatten((1, 2, 'v1'))
+        self.assertEqual(decoded.__dict__, {'id_': 2, 'name': 'v1',
+                                            'tags': [], 'actions': [],
+                                            'owner': 'nobody'})
+        decoded = schema.unflatten((2, 3, 'v2', ['b'], [(1, 4, 5, 6)]))
+        self.assertEqual(decoded.tags, ['b'])
+        self.assertEqual(decoded.actions[0].old_zone, 5)
+        self.assertEqual(decoded.owner, 'nobody')
+
+        self.assertRaises(ValueError, schema.unflatten, (4, 1, 'v4'))
+        self.assertRaises(ValueError, schema.unflatten, (2, 1, 'v2'))
+
+        _LOGGER.info('===END TEST_VERSIONS===')
+
+    def test_slots(self):
+        """ methods tested:
+        Slotted.__getstate__
+        Slotted.__setstate__
+        """
+        _LOGGER.info('===BEGIN TEST_SLOTS===')
+
+        state = new_state()
+        for obj in [state, state.get_player(1), state.cur_actions[0],
+                    Hex(1, (), [Planet(1, [PopSlot(1, 'grey', False)])])]:
+            self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertRaises(AttributeError, setattr, state, 'unknown', 1)
+
+        for copied in (pickle.loads(pickle.dumps(state)),
+                       copy.deepcopy(state)):
+            self.assertEqual(set(copied.__getstate__()),
+                             set(name for name in GameState.__slots__
+                                 if not name.startswith('_')))
+            self.assertEqual(copied.get_player(2).race, 'hydran')
+            self.assertEqual([action.__getstate__()
+                              for action in copied.cur_actions],
+                             [action.__getstate__()
+                              for action in state.cur_actions])
+
+        # states pickled before the slots, with a removed attribute
+        legacy = pickle.dumps(LegacyPickle(Action, {'element': 1,
+                                                    'old_zone': 'reserve',
+                                                    'new_zone': 'hex 2',
+                                                    'removed': True}))
+        action = pickle.loads(legacy)
+        self.assertEqual(type(action), Action)
+        self.assertEqual(action.__getstate__(), {'element': 1,
+                                                 'old_zone': 'reserve',
+                                                 'new_zone': 'hex 2'})
+
+        # attributes added since the pickle get their defaults
+        legacy = pickle.dumps(LegacyPickle(GameState, {'id_': 3,
+                                                       'cur_turn': 4}))
+        state = pickle.loads(legacy)
+        self.assertEqual((state.id_, state.cur_turn), (3, 4))
+        self.assertEqual((state.cur_player, state.hexes, state.ships),
+                         (None, {}, {}))
+
+        _LOGGER.info('===END TEST_SLOTS===')
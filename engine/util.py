@@ -15,27 +15,210 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import atexit
+from contextlib import contextmanager
+import contextvars
+import functools
+import itertools
 import logging
+import logging.handlers
 import os
+import queue
+import reprlib
 import sys
+import threading
+import time
+import traceback
 
-_ind_level = 0
+# call tracing of the log decorator, at DEBUG level
+_trace_logger = logging.getLogger('ecbb.util')
+# indentation level of the call traces, per thread and per asyncio task
+_depth = contextvars.ContextVar('ecbb_log_depth', default=0)
 _IND_STR = ' '
-def log(fun):
-    """ a simple decorator to display functions calls with params/return """
+# the traced arguments and return values are truncated
+_repr = reprlib.Repr()
+_repr.maxstring = 80
+_repr.maxother = 80
+# function qualified name -> sampling rate, overrides the decorator rate
+_sample_rates = {}
+
+class _LazyRepr(object):
+    """ truncated repr of a value, computed only if the trace is emitted """
+    __slots__ = ('_value', )
+
+    def __init__(self, value):
+        self._value = value
+
+    def __str__(self):
+        return _repr.repr(self._value)
+
+def set_log_sampling(rates):
+    """ change the sampling rates of the call traces at runtime.
+    args: rates {function qualified name (str), e.g. 'DBInterface.load_state':
+                 rate (float), 1 to trace every call, 0 to trace none}
+    """
+    _sample_rates.update(rates)
+
+def log(fun=None, sample=1.0):
+    """ a decorator to display functions calls with params/return.
+    almost free when the 'ecbb.util' logger doesn't log DEBUG messages: the
+    arguments are formatted only if the trace is emitted.
+    usage:
+      @engine.util.log
+      @engine.util.log(sample=0.1): trace one call every ten calls
+    """
+    if fun is None:
+        return lambda fun: log(fun, sample)
+
+    name = fun.__qualname__
+    calls = itertools.count()
+
     def _logger(*args, **kargs):
         """ inner function """
-        global _ind_level
-        _ind_level += 1
-
-        app_logger = logging.getLogger('ecbb.util')
-        app_logger.debug("{}in_){} [{}] [[{}]]".format(_IND_STR*_ind_level, fun,
-                                                       args, kargs))
-        ret = fun(*args, **kargs)
-        app_logger.debug("{}out){} [{}]".format(_IND_STR*_ind_level, fun, ret))
-        _ind_level -= 1
-        return ret
-    return _logger
+        if not _trace_logger.isEnabledFor(logging.DEBUG):
+            return fun(*args, **kargs)
+        rate = _sample_rates.get(name, sample)
+        if rate < 1 and (rate <= 0 or next(calls) % round(1 / rate) != 0):
+            return fun(*args, **kargs)
+
+        depth = _depth.get() + 1
+        token = _depth.set(depth)
+        indent = _IND_STR * depth
+        _trace_logger.debug('%sin_)%s [%s] [[%s]]', indent, name,
+                            _LazyRepr(args), _LazyRepr(kargs))
+        try:
+            ret = fun(*args, **kargs)
+            _trace_logger.debug('%sout)%s [%s]', indent, name,
+                                _LazyRepr(ret))
+            return ret
+        finally:
+            _depth.reset(token)
+    return functools.wraps(fun)(_logger)
+
+# durations of the spans timed during the current request, see
+# collect_timings
+_timings = contextvars.ContextVar('ecbb_timings', default=None)
+
+class Timings(object):
+    """
+    Durations of the spans timed during a request, per span name (e.g.
+    'gm', 'db', 'render'):
+      self.durations {name (str): seconds (float)}
+      self.counts {name (str): number of spans (int)}
+    """
+    def __init__(self):
+        self.durations = {}
+        self.counts = {}
+        # names of the spans in progress
+        self._open = set()
+
+    def add(self, name, elapsed):
+        """ add a span of elapsed seconds """
+        self.durations[name] = self.durations.get(name, 0) + elapsed
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+@contextmanager
+def collect_timings():
+    """ collect the spans timed in the current thread/task.
+    usage:
+      with engine.util.collect_timings() as timings:
+          ...
+    """
+    timings = Timings()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+def add_timing(name, elapsed):
+    """ add a span to the timings being collected, if any """
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(name, elapsed)
+
+def timed_span(name):
+    """ a decorator timing the calls of a function as spans of name, when
+    timings are collected. a span of name called within a span of the same
+    name isn't counted.
+    usage: @engine.util.timed_span('gm')
+    """
+    def decorator(fun):
+        """ returned decorator """
+        def span(*args, **kargs):
+            """ inner function """
+            timings = _timings.get()
+            if timings is None or name in timings._open:
+                return fun(*args, **kargs)
+            timings._open.add(name)
+            start = time.perf_counter()
+            try:
+                return fun(*args, **kargs)
+            finally:
+                timings._open.discard(name)
+                timings.add(name, time.perf_counter() - start)
+        return functools.wraps(fun)(span)
+    return decorator
+
+class KeyedLocks(object):
+    """
+    A reentrant lock per key, e.g. per game id. The locks are created on
+    demand and forgotten once no thread holds or waits for them.
+
+    usage:
+      with locks(game_id):
+         ...
+      with locks(*games_ids):
+         ...
+      with locks(game_id, blocking=False) as locked:
+         if locked:
+            ...
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [RLock, number of threads holding or waiting for it]
+        self._locks = {}
+
+    def __len__(self):
+        """ return: number of keys locked or waited for """
+        with self._lock:
+            return len(self._locks)
+
+    @contextmanager
+    def __call__(self, *keys, blocking=True):
+        """ acquire the locks of keys, always in the same order to avoid
+        deadlocks between threads locking several keys.
+        without blocking, the locks are acquired only if none of them is
+        held by another thread.
+        yield: True if the locks are held
+        """
+        keys = sorted(set(keys))
+        with self._lock:
+            entries = []
+            for key in keys:
+                entry = self._locks.setdefault(key, [threading.RLock(), 0])
+                entry[1] += 1
+                entries.append(entry)
+        acquired = []
+        try:
+            for entry in entries:
+                if not entry[0].acquire(blocking):
+                    break
+                acquired.append(entry)
+            locked = len(acquired) == len(entries)
+            if not locked:
+                for entry in reversed(acquired):
+                    entry[0].release()
+                acquired = []
+            yield locked
+        finally:
+            for entry in reversed(acquired):
+                entry[0].release()
+            with self._lock:
+                for key, entry in zip(keys, entries):
+                    entry[1] -= 1
+                    if entry[1] == 0:
+                        del self._locks[key]
 
 def enum(**enums):
     """ to define c-like enums.
@@ -44,9 +227,14 @@ def enum(**enums):
     return type('Enum', (), enums)
 
 _already_called = False
-def init_logging(test_mode=False):
+def init_logging(test_mode=False, log_queue=None):
     """ put logging into a log file, use different loggers for the different
     modules in the application, the main logger beeing called 'eclipsebb'
+    args:
+     test_mode (bool)
+     log_queue (dict): keyword arguments of start_log_queue to write the logs
+                       from a listener thread, None to write them in the
+                       logging threads. Always used in test mode.
     """
     # called by every tests, but must be executed only once
     global _already_called
@@ -70,9 +258,13 @@ def init_logging(test_mode=False):
         logger = logging.getLogger('ecbb')
         logger.setLevel(logging.DEBUG)
 
-        # during tests empty the log file first
+        # during tests empty the log file first, a log file per worker
+        # process when the tests run in parallel (pytest-xdist)
         mode = 'w'
-        log_file = os.path.join(shared_path, 'eclipsebb.log')
+        worker = os.environ.get('PYTEST_XDIST_WORKER')
+        log_name = ('eclipsebb.log' if worker is None
+                    else 'eclipsebb-{}.log'.format(worker))
+        log_file = os.path.join(shared_path, log_name)
         file_hand = logging.FileHandler(log_file, mode=mode)
         file_hand.setLevel(logging.DEBUG)
 
@@ -80,3 +272,211 @@ def init_logging(test_mode=False):
                                   '[%(name)s]:%(message)s'))
         file_hand.setFormatter(form)
         logger.addHandler(file_hand)
+
+        start_log_queue(logger, **(log_queue or {}))
+    elif log_queue is not None:
+        # handlers configured by pyramid from the .ini file
+        start_log_queue(logging.getLogger(), **log_queue)
+
+# what to do with a record when the log queue is full
+OVERFLOW = enum(DROP=0, BLOCK=1, SAMPLE=2)
+DEFAULT_LOG_QUEUE_SIZE = 10000
+DEFAULT_LOG_BATCH = 256
+# longest wait of a logging thread with the BLOCK policy
+DEFAULT_BLOCK_TIMEOUT = 0.05
+# with the SAMPLE policy, once the queue is half full, only one record in
+# sample_every below WARNING is queued
+DEFAULT_SAMPLE_EVERY = 10
+
+# (handler, listener) started by start_log_queue
+_log_queues = []
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler putting the records in a bounded queue.Queue, a logging
+    thread never waits (DROP, SAMPLE) or waits at most block_timeout (BLOCK)
+    when the queue is full, the records not queued are counted in
+    self.dropped.
+    """
+    def __init__(self, queue_, overflow=OVERFLOW.DROP,
+                 block_timeout=DEFAULT_BLOCK_TIMEOUT,
+                 sample_every=DEFAULT_SAMPLE_EVERY):
+        logging.handlers.QueueHandler.__init__(self, queue_)
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.sample_every = max(1, sample_every)
+        self.dropped = 0
+        self._sampled = itertools.count()
+        self._dropped_lock = threading.Lock()
+
+    def emit(self, record):
+        """ prepare and queue a record, a record dropped by the overflow
+        policy isn't formatted
+        """
+        try:
+            if self._rejected(record):
+                self._drop()
+                return
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def _rejected(self, record):
+        """ the record would be dropped (DROP, SAMPLE) with the queue in its
+        current state
+        """
+        if self.overflow == OVERFLOW.BLOCK:
+            return False
+        if self.queue.full():
+            return True
+        return (self.overflow == OVERFLOW.SAMPLE
+                and record.levelno < logging.WARNING
+                and self.queue.qsize() * 2 >= self.queue.maxsize
+                and next(self._sampled) % self.sample_every != 0)
+
+    def _drop(self):
+        """ count a record not queued """
+        with self._dropped_lock:
+            self.dropped += 1
+
+    def enqueue(self, record):
+        """ queue a prepared record according to the overflow policy """
+        try:
+            if self.overflow == OVERFLOW.BLOCK:
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            self._drop()
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """
+    QueueListener handling the records in batches of up to max_batch: the
+    records of a batch are written to a StreamHandler/FileHandler with a
+    single write and a single flush.
+    """
+    def __init__(self, queue_, *handlers, max_batch=DEFAULT_LOG_BATCH,
+                 respect_handler_level=True):
+        logging.handlers.QueueListener.__init__(
+            self, queue_, *handlers,
+            respect_handler_level=respect_handler_level)
+        self.max_batch = max(1, max_batch)
+        self.batches = 0
+
+    def stop(self):
+        """ write the queued records and stop the thread, can be called
+        more than once
+        """
+        if self._thread is not None:
+            logging.handlers.QueueListener.stop(self)
+
+    def enqueue_sentinel(self):
+        """ the sentinel must not be dropped when the queue is full, but
+        can't be queued if the listener thread is dead
+        """
+        while self._thread is not None and self._thread.is_alive():
+            try:
+                self.queue.put(self._sentinel, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _monitor(self):
+        """ listener thread loop """
+        stop = False
+        while not stop:
+            batch = [self.dequeue(True)]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            records = [record for record in batch
+                       if record is not self._sentinel]
+            stop = len(records) != len(batch)
+            try:
+                if len(records) != 0:
+                    self.handle_batch(records)
+            except Exception:
+                # the listener must survive a broken handler
+                traceback.print_exc(file=sys.stderr)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def handle_batch(self, records):
+        """ pass a batch of records to the handlers """
+        self.batches += 1
+        records = [self.prepare(record) for record in records]
+        for handler in self.handlers:
+            selected = records
+            if self.respect_handler_level:
+                selected = [record for record in records
+                            if record.levelno >= handler.level]
+            # subclasses (e.g. rotating files) have their own emit logic
+            if type(handler) in (logging.StreamHandler, logging.FileHandler):
+                self._write_stream(handler, selected)
+                continue
+            for record in selected:
+                try:
+                    handler.handle(record)
+                except Exception:
+                    handler.handleError(record)
+
+    @staticmethod
+    def _write_stream(handler, records):
+        """ write records to a stream handler, then flush it once """
+        records = [record for record in records if handler.filter(record)]
+        if len(records) == 0:
+            return
+        lines = []
+        for record in records:
+            try:
+                lines.append(handler.format(record) + handler.terminator)
+            except Exception:
+                handler.handleError(record)
+        handler.acquire()
+        try:
+            if handler.stream is None:
+                # FileHandler opened on the first record
+                handler.stream = handler._open()
+            handler.stream.write(''.join(lines))
+            handler.flush()
+        except Exception:
+            handler.handleError(records[-1])
+        finally:
+            handler.release()
+
+def start_log_queue(logger, queue_size=DEFAULT_LOG_QUEUE_SIZE,
+                    overflow=OVERFLOW.DROP, max_batch=DEFAULT_LOG_BATCH,
+                    block_timeout=DEFAULT_BLOCK_TIMEOUT,
+                    sample_every=DEFAULT_SAMPLE_EVERY):
+    """ move the handlers of a logger behind a bounded queue, they are then
+    called by a listener thread. The listener is stopped at exit, after
+    writing the queued records.
+    args:
+     logger (logging.Logger)
+     queue_size (int): maximum number of queued records
+     overflow (OVERFLOW): policy when the queue is full
+     max_batch (int): maximum number of records written at once
+    return: (BoundedQueueHandler, BatchingQueueListener)
+    """
+    log_queue = queue.Queue(queue_size)
+    handlers = list(logger.handlers)
+    handler = BoundedQueueHandler(log_queue, overflow, block_timeout,
+                                  sample_every)
+    listener = BatchingQueueListener(log_queue, *handlers, max_batch=max_batch)
+    for old_handler in handlers:
+        logger.removeHandler(old_handler)
+    logger.addHandler(handler)
+    listener.start()
+    atexit.register(listener.stop)
+    _log_queues.append((handler, listener))
+    return (handler, listener)
+
+def log_queue_stats():
+    """ return: dict of the log queues counters """
+    return {'queued': sum(handler.queue.qsize()
+                          for handler, _ in _log_queues),
+            'dropped': sum(handler.dropped for handler, _ in _log_queues),
+            'batches': sum(listener.batches for _, listener in _log_queues)}
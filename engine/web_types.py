@@ -49,6 +49,46 @@ class Timezones(object):
         self.list_tz = timezones
         self.dict_tz = OrderedDict(timezones)
 
+class GameSummary(object):
+    """ The infos needed to display a game in a list, read from the db
+    without loading the game states.
+
+    attributes:
+      self.players: [(id_1 (int), name_1 (str), tz_id_1 (int)),
+                     ...,
+                     (id_n, name_n, tz_id_n)] in joining order
+      self.extensions: {id (int): name (str)}
+      self.cur_state_id: id of the last saved state, -1 if none
+    """
+    def __init__(self, id_, name, level, private, started, start_date,
+                 last_play, num_players, creator_id, cur_turn, cur_state_id,
+                 players, extensions):
+        self.id_ = id_
+        self.name = name
+        self.level = level
+        self.private = private
+        self.started = started
+        self.start_date = start_date
+        self.last_play = last_play
+        self.num_players = num_players
+        self.creator_id = creator_id
+        self.cur_turn = cur_turn
+        self.cur_state_id = cur_state_id
+        self.players = players
+        self.extensions = extensions
+
+    @property
+    def players_ids(self):
+        """ the ids of the players who joined the game """
+        return [player[0] for player in self.players]
+
+    def get_player(self, player_id):
+        """ return (id_, name, tz_id) of the player, None if not joined """
+        for player in self.players:
+            if player[0] == player_id:
+                return player
+        return None
+
 class Game(object):
     """ The base game offers functions to query the game state, to apply
     player actions and to export a game state in json.
@@ -90,9 +130,15 @@ class Game(object):
         # used to revert to the state at the beginning of a player
         # turn if one of its actions is not valid
         self.last_valid_state_id = None
+        # approximate memory used by the state, computed from the state
+        # blob last written to or read from the DB, see
+        # engine.db.state_memory_size, None if unknown
+        self.state_bytes = None
 
         if init_state:
             self.cur_state = GameState(num_players)
+        else:
+            self.cur_state = None
 
     @classmethod
     def from_db(cls, **kargs):
@@ -0,0 +1,175 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+import time
+from engine.db import DB_STATUS
+
+# a batch is written once it holds max_batch saves, or max_delay seconds
+# after its first save
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_DELAY = 0.005
+
+# put in the queue to stop the writer thread
+_STOP = object()
+
+class WriteBehind(object):
+    """
+    Group commit of the games saves: a single writer thread drains the
+    queue of pending saves and writes them in batches, one transaction (and
+    one fsync) per batch, with DBInterface.save_games.
+
+    The state and the row of a game are serialized by submit, in the caller
+    thread, so the game can be modified while its save is pending.
+
+    submit returns a concurrent.futures.Future whose result is
+    (db_status, state_id). The writer thread doesn't hold the games locks,
+    it doesn't modify the games: the written callback given to submit
+    receives the state_id before the future is resolved, the callbacks
+    being called in the order the saves were submitted.
+
+    attributes:
+      self.batches (int): number of transactions written
+      self.saves (int): number of saves written
+    """
+    def __init__(self, db, max_batch=DEFAULT_MAX_BATCH,
+                 max_delay=DEFAULT_MAX_DELAY):
+        self._logger = logging.getLogger('ecbb.write_behind')
+        self._db = db
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+
+        self.batches = 0
+        self.saves = 0
+
+        self._thread = threading.Thread(target=self._run,
+                                        name='ecbb-write-behind',
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, game, written=None):
+        """ queue the save of the current state and row of a game.
+        args:
+         game (Game object)
+         written (function): called by the writer thread with (db_status,
+                             state_id (int) or None) once the save is
+                             written, e.g. to append state_id to the game
+                             states_ids
+        return: Future of (db_status, state_id (int) or None)
+        """
+        future = Future()
+        save = self._db.prepare_save(game)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Write-behind queue closed')
+            self._queue.put((game, save, written, future))
+        return future
+
+    def flush(self):
+        """ wait until all the saves submitted so far are written """
+        self._queue.join()
+
+    def close(self):
+        """ write the pending saves and stop the writer thread """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self):
+        """ return: dict of the write-behind counters """
+        return {'pending': self._queue.qsize(),
+                'batches': self.batches,
+                'saves': self.saves}
+
+    def _next_batch(self):
+        """ wait for a save, then collect the saves coming in the next
+        max_delay seconds, up to max_batch.
+        return: ([(game, save, written, future), ...], stop (bool))
+        """
+        item = self._queue.get()
+        if item is _STOP:
+            return ([], True)
+        batch = [item]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return (batch, True)
+            batch.append(item)
+        return (batch, False)
+
+    def _run(self):
+        """ writer thread loop """
+        stop = False
+        while not stop:
+            (batch, stop) = self._next_batch()
+            if len(batch) != 0:
+                self._write(batch)
+            if stop:
+                # the _STOP item
+                self._queue.task_done()
+
+    def _write(self, batch):
+        """ write a batch of saves, call their written callbacks and resolve
+        their futures.
+        args: batch [(game, save, written, future), ...]
+        """
+        error = None
+        try:
+            (status, results) = self._db.save_games([save for _, save, _, _
+                                                     in batch])
+            if status != DB_STATUS.OK:
+                results = [(status, None)] * len(batch)
+            self.batches += 1
+            self.saves += len(batch)
+        except Exception as err:
+            self._logger.exception('Error while writing a batch of saves')
+            error = err
+            results = [(DB_STATUS.ERROR, None)] * len(batch)
+        try:
+            for (game, _, written, future), (status, state_id) in zip(batch,
+                                                                      results):
+                if written is not None:
+                    try:
+                        written(status, state_id)
+                    except Exception:
+                        msg = 'Error after the save of game {}'.format(
+                            game.id_)
+                        self._logger.exception(msg)
+                if error is None:
+                    future.set_result((status, state_id))
+                else:
+                    future.set_exception(error)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
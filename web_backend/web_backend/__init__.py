@@ -16,11 +16,74 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import pyramid
+import pyramid.settings
 from pyramid.config import Configurator
 from pyramid_beaker import session_factory_from_settings            
+from engine.db import STATE_CODECS, STATE_SERIALIZERS
 from engine.game_manager import GamesManager
 import engine.util
 
+def db_settings(settings):
+    """ read the database options from the .ini settings:
+     eclipsebb.state_codec = none|zlib|lzma
+     eclipsebb.state_serializer = pickle|binary
+     eclipsebb.pragma.<name> = <value>, see engine.db.DEFAULT_PRAGMAS
+     eclipsebb.checkpoint_interval = seconds, or none
+     eclipsebb.slow_query_threshold = seconds, see engine.db_stats
+     eclipsebb.db_path = database file, default to the DBInterface one
+    return: dict of DBInterface keyword arguments
+    """
+    kwargs = {}
+    db_path = settings.get('eclipsebb.db_path')
+    if db_path is not None and db_path.strip() != '':
+        kwargs['db_path'] = db_path.strip()
+    pragmas = {key[len('eclipsebb.pragma.'):]: value.strip()
+               for key, value in settings.items()
+               if key.startswith('eclipsebb.pragma.')}
+    if len(pragmas) != 0:
+        kwargs['pragmas'] = pragmas
+    interval = settings.get('eclipsebb.checkpoint_interval')
+    if interval is not None:
+        if interval.strip().lower() == 'none':
+            kwargs['checkpoint_interval'] = None
+        else:
+            kwargs['checkpoint_interval'] = float(interval)
+    threshold = settings.get('eclipsebb.slow_query_threshold')
+    if threshold is not None:
+        kwargs['slow_query_threshold'] = float(threshold)
+    codec = settings.get('eclipsebb.state_codec')
+    if codec is not None:
+        kwargs['state_codec'] = getattr(STATE_CODECS, codec.upper())
+    serializer = settings.get('eclipsebb.state_serializer')
+    if serializer is not None:
+        kwargs['state_serializer'] = getattr(STATE_SERIALIZERS,
+                                             serializer.upper())
+    return kwargs
+
+def log_queue_settings(settings):
+    """ read the logging options from the .ini settings:
+     eclipsebb.log_queue = true|false, write the logs from a listener thread
+     eclipsebb.log_queue.size = maximum number of queued records
+     eclipsebb.log_queue.overflow = drop|block|sample, when the queue is full
+     eclipsebb.log_queue.max_batch = maximum number of records written at once
+    return: dict of start_log_queue keyword arguments, None if disabled
+    """
+    if not pyramid.settings.asbool(settings.get('eclipsebb.log_queue',
+                                                False)):
+        return None
+    kwargs = {}
+    size = settings.get('eclipsebb.log_queue.size')
+    if size is not None:
+        kwargs['queue_size'] = int(size)
+    overflow = settings.get('eclipsebb.log_queue.overflow')
+    if overflow is not None:
+        kwargs['overflow'] = getattr(engine.util.OVERFLOW,
+                                     overflow.strip().upper())
+    max_batch = settings.get('eclipsebb.log_queue.max_batch')
+    if max_batch is not None:
+        kwargs['max_batch'] = int(max_batch)
+    return kwargs
+
 def includeme(config):
     """ pyramid way of defining routes
     """
@@ -33,6 +96,12 @@ def includeme(config):
     config.add_route('joingame', '/joingame')
     config.add_route('creategame', '/creategame')
     config.add_route('editprofile', '/editprofile')
+    config.add_route('metrics', '/metrics')
+
+    # Server-Timing headers and per-route timings
+    config.include('web_backend.timing')
+    # who can read /metrics
+    config.include('web_backend.metrics')
 
 def main(global_config, **settings):
     """ This function returns a Pyramid WSGI application.
@@ -44,9 +113,14 @@ def main(global_config, **settings):
         test_mode = True
 
     # init logging
-    engine.util.init_logging(test_mode)
+    engine.util.init_logging(test_mode,
+                             log_queue=log_queue_settings(settings))
 
-    gm = GamesManager(test_mode)
+    # group commit of the games saves
+    write_behind = pyramid.settings.asbool(settings.get('eclipsebb.write_behind',
+                                                        False))
+    gm = GamesManager(test_mode, db_settings=db_settings(settings),
+                      write_behind=write_behind)
     settings['gm'] = gm
 
     config = Configurator(settings=settings)
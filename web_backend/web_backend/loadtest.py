@@ -0,0 +1,454 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Load test of the web application: concurrent simulated players register,
+log in, then browse and play with think times. The application is called
+in-process through WSGI, served by a local waitress (--serve, to size its
+threads) or reached at an url (--url):
+  python -m web_backend.loadtest [--ini development.ini] [--db PATH]
+                                 [--players N] [--iterations N]
+                                 [--think SECONDS] [--ramp-up SECONDS]
+                                 [--serve --threads N | --url URL]
+                                 [--output FILE]
+The throughput, the latency percentiles and the error rate are reported
+per route.
+"""
+
+import argparse
+import http.client
+import http.cookies
+import io
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+PASSWORD = 'loadtest'
+
+# valid timezones, see engine/db.sql
+TIMEZONES = (-300, 0, 60, 120, 540)
+
+# action -> weight of the actions played after the login
+ACTIONS = (('mygames', 40), ('joingame', 25), ('creategame', 15),
+           ('editprofile', 10), ('home', 10))
+
+# statuses of the successful responses
+_OK = (200, 302)
+
+class Client(object):
+    """ an http client keeping its cookies, call request """
+    def __init__(self):
+        self.cookies = http.cookies.SimpleCookie()
+
+    def _cookie_header(self):
+        """ return: the Cookie header value, None without cookies """
+        if len(self.cookies) == 0:
+            return None
+        return '; '.join('{}={}'.format(name, morsel.value)
+                         for name, morsel in self.cookies.items())
+
+    def _store_cookies(self, headers):
+        """ keep the cookies of the Set-Cookie headers """
+        for name, value in headers:
+            if name.lower() == 'set-cookie':
+                self.cookies.load(value)
+
+    def request(self, method, path, form=None):
+        """ send a request, the redirections are not followed.
+        args:
+         method (str): GET or POST
+         path (str)
+         form {name (str): value}: urlencoded body of a POST
+        return: (status (int), body (bytes))
+        """
+        raise NotImplementedError
+
+class WSGIClient(Client):
+    """ call a WSGI application in-process """
+    def __init__(self, app):
+        super(WSGIClient, self).__init__()
+        self._app = app
+
+    def request(self, method, path, form=None):
+        body = b''
+        if form is not None:
+            body = urllib.parse.urlencode(form).encode('utf-8')
+        (path, _, query) = path.partition('?')
+        environ = {'REQUEST_METHOD': method,
+                   'SCRIPT_NAME': '',
+                   'PATH_INFO': path,
+                   'QUERY_STRING': query,
+                   'SERVER_NAME': 'localhost',
+                   'SERVER_PORT': '80',
+                   'SERVER_PROTOCOL': 'HTTP/1.1',
+                   'REMOTE_ADDR': '127.0.0.1',
+                   'HTTP_HOST': 'localhost',
+                   'CONTENT_LENGTH': str(len(body)),
+                   'wsgi.version': (1, 0),
+                   'wsgi.url_scheme': 'http',
+                   'wsgi.input': io.BytesIO(body),
+                   'wsgi.errors': sys.stderr,
+                   'wsgi.multithread': True,
+                   'wsgi.multiprocess': False,
+                   'wsgi.run_once': False}
+        if form is not None:
+            environ['CONTENT_TYPE'] = 'application/x-www-form-urlencoded'
+        cookie = self._cookie_header()
+        if cookie is not None:
+            environ['HTTP_COOKIE'] = cookie
+
+        response = {}
+        def start_response(status, headers, exc_info=None):
+            """ WSGI start_response """
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+
+        app_iter = self._app(environ, start_response)
+        try:
+            data = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        self._store_cookies(response['headers'])
+        return (response['status'], data)
+
+class HTTPClient(Client):
+    """ send the requests to a server, on a keep-alive connection """
+    def __init__(self, host, port):
+        super(HTTPClient, self).__init__()
+        self._conn = http.client.HTTPConnection(host, port, timeout=60)
+
+    def request(self, method, path, form=None):
+        headers = {}
+        body = None
+        if form is not None:
+            body = urllib.parse.urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        cookie = self._cookie_header()
+        if cookie is not None:
+            headers['Cookie'] = cookie
+        try:
+            self._conn.request(method, path, body, headers)
+            response = self._conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            # reconnect on the next request
+            self._conn.close()
+            raise
+        self._store_cookies(response.getheaders())
+        return (response.status, data)
+
+    def close(self):
+        """ close the connection """
+        self._conn.close()
+
+class LoadStats(object):
+    """ latencies and errors per route, thread-safe """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # route -> [latency in seconds, ...]
+        self._latencies = {}
+        # route -> number of errors
+        self._errors = {}
+
+    def record(self, route, latency, error):
+        """ add a request of a route """
+        with self._lock:
+            self._latencies.setdefault(route, []).append(latency)
+            if error:
+                self._errors[route] = self._errors.get(route, 0) + 1
+
+    @staticmethod
+    def _percentile(latencies, q):
+        """ return: the q-quantile of sorted latencies, nearest rank """
+        return latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+
+    def summary(self, duration):
+        """ args: duration (float): wall time of the run in seconds
+        return: {route (str): {'count', 'errors', 'error_rate', 'rps',
+                               'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'}},
+                and the totals of all the routes under 'all'
+        """
+        with self._lock:
+            routes = {route: sorted(latencies)
+                      for route, latencies in self._latencies.items()}
+            errors = dict(self._errors)
+        routes['all'] = sorted(latency for latencies in routes.values()
+                               for latency in latencies)
+        errors['all'] = sum(errors.values())
+
+        summary = {}
+        for route, latencies in routes.items():
+            if len(latencies) == 0:
+                continue
+            count = len(latencies)
+            summary[route] = {
+                'count': count,
+                'errors': errors.get(route, 0),
+                'error_rate': errors.get(route, 0) / count,
+                'rps': count / duration if duration > 0 else 0.0,
+                'p50_ms': self._percentile(latencies, 0.5) * 1000,
+                'p95_ms': self._percentile(latencies, 0.95) * 1000,
+                'p99_ms': self._percentile(latencies, 0.99) * 1000,
+                'max_ms': latencies[-1] * 1000}
+        return summary
+
+class Player(object):
+    """ a simulated player, play runs its flow """
+    def __init__(self, client, stats, name, rand, think):
+        self.client = client
+        self.stats = stats
+        self.name = name
+        self.email = '{}@loadtest.test'.format(name.replace(' ', '-'))
+        self.rand = rand
+        self.think = think
+        self.player_id = None
+        self.tz_id = rand.choice(TIMEZONES)
+
+    def _call(self, route, method, path, form=None, expected=_OK):
+        """ send a request and record it under method + route.
+        return: the response body (bytes), None on error
+        """
+        start = time.perf_counter()
+        try:
+            (status, body) = self.client.request(method, path, form)
+        except (http.client.HTTPException, OSError):
+            (status, body) = (None, None)
+        self.stats.record('{} {}'.format(method, route),
+                          time.perf_counter() - start,
+                          status not in expected)
+        return body if status in expected else None
+
+    def _pause(self):
+        """ think time, exponentially distributed around self.think """
+        if self.think > 0:
+            time.sleep(min(self.rand.expovariate(1 / self.think),
+                           self.think * 5))
+
+    def register(self):
+        """ fill the registration form """
+        self._call('register', 'GET', '/register')
+        self._pause()
+        self._call('register', 'POST', '/register',
+                   {'name': self.name, 'email': self.email,
+                    'password': PASSWORD, 'password2': PASSWORD,
+                    'timezone': self.tz_id}, expected=(302, ))
+
+    def login(self):
+        """ log in, then see the home page """
+        self._call('login', 'POST', '/login',
+                   {'email': self.email, 'password': PASSWORD},
+                   expected=(302, ))
+        self._call('home', 'GET', '/')
+
+    def logout(self):
+        """ log out """
+        self._call('logout', 'GET', '/logout', expected=(302, ))
+
+    def creategame(self):
+        """ create a game with free slots """
+        body = self._call('creategame', 'GET', '/creategame')
+        if body is None:
+            return
+        if self.player_id is None:
+            match = re.search(rb'name="player0">\s*<option value="(\d+)"',
+                              body)
+            if match is None:
+                self.stats.record('GET creategame', 0, True)
+                return
+            self.player_id = int(match.group(1))
+        self._pause()
+        form = {'name': "{}'s game".format(self.name),
+                'num_players': self.rand.randint(2, 5),
+                'player0': self.player_id,
+                'level': self.rand.randint(1, 4)}
+        for num in range(1, 5):
+            form['player{}'.format(num)] = -1
+        self._call('creategame', 'POST', '/creategame', form,
+                   expected=(302, ))
+
+    def editprofile(self):
+        """ change the timezone """
+        if self._call('editprofile', 'GET', '/editprofile') is None:
+            return
+        self._pause()
+        self.tz_id = self.rand.choice([tz_id for tz_id in TIMEZONES
+                                       if tz_id != self.tz_id])
+        self._call('editprofile', 'POST', '/editprofile',
+                   {'email': self.email, 'password': '', 'password2': '',
+                    'timezone': self.tz_id}, expected=(302, ))
+
+    def mygames(self):
+        """ list the player games """
+        self._call('mygames', 'GET', '/mygames')
+
+    def joingame(self):
+        """ list the games to join """
+        self._call('joingame', 'GET', '/joingame')
+
+    def home(self):
+        """ back to the home page """
+        self._call('home', 'GET', '/')
+
+    def play(self, iterations):
+        """ register, log in, play iterations actions, log out """
+        self.register()
+        self._pause()
+        self.login()
+        actions = [action for action, _ in ACTIONS]
+        weights = [weight for _, weight in ACTIONS]
+        for _ in range(iterations):
+            self._pause()
+            getattr(self, self.rand.choices(actions, weights)[0])()
+        self.logout()
+
+def run(make_client, players=10, iterations=20, think=0.5, ramp_up=0.0,
+        seed=0, prefix=None):
+    """ run the simulated players, one thread each.
+    args:
+     make_client: callable returning a new Client
+     players (int): number of concurrent players
+     iterations (int): actions played by each player after the login
+     think (float): mean think time between the requests, in seconds
+     ramp_up (float): the players start over ramp_up seconds
+     seed (int): seed of the players random generators
+     prefix (str): prefix of the players names, unique per run by default
+    return: (duration in seconds, LoadStats)
+    """
+    if prefix is None:
+        prefix = 'load{:x}'.format(int(time.time() * 1000))
+    stats = LoadStats()
+    clients = []
+    threads = []
+    for num in range(players):
+        client = make_client()
+        clients.append(client)
+        player = Player(client, stats, '{} {}'.format(prefix, num),
+                        random.Random(seed * 100003 + num), think)
+        delay = ramp_up * num / players
+
+        def play(player=player, delay=delay):
+            """ thread of a player """
+            time.sleep(delay)
+            player.play(iterations)
+
+        threads.append(threading.Thread(target=play, daemon=True))
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    for client in clients:
+        if hasattr(client, 'close'):
+            client.close()
+    return (duration, stats)
+
+def report(summary):
+    """ return: a text report of LoadStats.summary, by route """
+    lines = [('{:<18} {:>7} {:>7} {:>7} {:>8} {:>8} {:>8} {:>8} '
+              '{:>8}').format('route', 'count', 'errors', 'err %', 'req/s',
+                              'p50 ms', 'p95 ms', 'p99 ms', 'max ms')]
+    for route in sorted(summary, key=lambda route: (route == 'all', route)):
+        stats = summary[route]
+        lines.append(('{:<18} {:>7} {:>7} {:>7.2f} {:>8.1f} {:>8.1f} '
+                      '{:>8.1f} {:>8.1f} {:>8.1f}').format(
+                          route, stats['count'], stats['errors'],
+                          stats['error_rate'] * 100, stats['rps'],
+                          stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+                          stats['max_ms']))
+    return '\n'.join(lines)
+
+def load_app(ini, db_path=None):
+    """ build the application of an .ini file, on the database file
+    db_path or on a test database.
+    """
+    from paste.deploy.loadwsgi import appconfig
+    from web_backend import main
+
+    settings = appconfig('config:{}'.format(ini), 'main', relative_to='.')
+    if db_path is None:
+        return main({'test_mode': True}, **settings)
+    settings['eclipsebb.db_path'] = db_path
+    return main({}, **settings)
+
+def serve(app, threads):
+    """ serve an application with waitress on a free local port, in a
+    daemon thread.
+    return: the waitress server, its port is server.effective_port
+    """
+    import waitress.server
+
+    server = waitress.server.create_server(app, host='127.0.0.1', port=0,
+                                           threads=threads)
+    threading.Thread(target=server.run, daemon=True).start()
+    return server
+
+def main(argv=None):
+    """ parse the command line, run the load test and print the report """
+    parser = argparse.ArgumentParser(description='load test the web server')
+    parser.add_argument('--ini', default='development.ini')
+    parser.add_argument('--db', default=None,
+                        help=('database file, see engine.bench.dataset, '
+                              'default to a test database'))
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--think', type=float, default=0.5)
+    parser.add_argument('--ramp-up', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--serve', action='store_true',
+                        help='serve the application with a local waitress')
+    target.add_argument('--url', default=None,
+                        help='server to load, e.g. http://127.0.0.1:6543')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='waitress threads, with --serve')
+    parser.add_argument('--output', default=None,
+                        help='write the summary in this JSON file')
+    args = parser.parse_args(argv)
+
+    if args.url is not None:
+        url = urllib.parse.urlsplit(args.url)
+        make_client = lambda: HTTPClient(url.hostname, url.port or 80)
+    else:
+        app = load_app(args.ini, args.db)
+        if args.serve:
+            server = serve(app, args.threads)
+            port = server.effective_port
+            make_client = lambda: HTTPClient('127.0.0.1', port)
+        else:
+            make_client = lambda: WSGIClient(app)
+
+    (duration, stats) = run(make_client, args.players, args.iterations,
+                            args.think, args.ramp_up, args.seed)
+    summary = stats.summary(duration)
+    print(report(summary))
+    print('{} players in {:.1f}s'.format(args.players, duration))
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump({'duration': duration, 'players': args.players,
+                       'iterations': args.iterations, 'think': args.think,
+                       'routes': summary}, output, indent=2, sort_keys=True)
+    if args.serve:
+        server.close()
+    return 1 if summary.get('all', {}).get('errors', 0) != 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import resource
+import engine.util
+
+# Metrics of the server in the prometheus text format, served by the
+# /metrics view to the hosts of eclipsebb.metrics.hosts and to the players
+# of eclipsebb.metrics.admins, nobody by default.
+#
+# Behind a reverse proxy every request comes from the proxy address: the
+# client address is read from the eclipsebb.metrics.forwarded_header set by
+# the proxies of eclipsebb.metrics.proxies, the header of the other hosts
+# is ignored.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+DEFAULT_FORWARDED_HEADER = 'X-Forwarded-For'
+
+class Access(object):
+    """
+    Who can read the metrics, from the .ini settings:
+     eclipsebb.metrics.hosts = client addresses, separated by spaces
+     eclipsebb.metrics.admins = player ids, separated by spaces
+     eclipsebb.metrics.proxies = addresses of the trusted reverse proxies
+     eclipsebb.metrics.forwarded_header = header set by the proxies with
+                                          the client address, the last one
+                                          of the list (X-Forwarded-For)
+    """
+    def __init__(self, settings):
+        """ raise: ValueError if a setting is malformed """
+        self.hosts = frozenset(settings.get('eclipsebb.metrics.hosts',
+                                            '').split())
+        admins = settings.get('eclipsebb.metrics.admins', '').split()
+        try:
+            self.admins = frozenset(int(id_) for id_ in admins)
+        except ValueError:
+            raise ValueError(('eclipsebb.metrics.admins must be player ids, '
+                              'not {!r}').format(' '.join(admins)))
+        self.proxies = frozenset(settings.get('eclipsebb.metrics.proxies',
+                                              '').split())
+        self.forwarded_header = settings.get(
+            'eclipsebb.metrics.forwarded_header',
+            DEFAULT_FORWARDED_HEADER).strip()
+
+    def client_addr(self, request):
+        """ return: the address of the client, forwarded by a proxy """
+        if request.remote_addr not in self.proxies:
+            return request.remote_addr
+        forwarded = request.headers.get(self.forwarded_header, '')
+        clients = [addr.strip() for addr in forwarded.split(',')]
+        # the proxy appends the address it got the request from
+        return clients[-1] or None
+
+    def is_allowed(self, request):
+        """ return: True if the request comes from a metrics host, or from
+        a logged in admin player
+        """
+        if self.client_addr(request) in self.hosts:
+            return True
+        return bool(request.session.get('auth', False)
+                    and request.session.get('player_id') in self.admins)
+
+def is_allowed(request):
+    """ return: True if the request can read the metrics, see Access """
+    return request.registry.metrics_access.is_allowed(request)
+
+def includeme(config):
+    """ read the access to the metrics from the settings, a malformed
+    setting fails the configuration
+    """
+    config.registry.metrics_access = Access(config.get_settings())
+
+def _escape(value):
+    """ escape a label value """
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+def _format_value(value):
+    """ prometheus float format """
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metrics(object):
+    """ metric families, written in the order they are added """
+    def __init__(self):
+        # name -> [type, help, [(sample name, labels, value), ...]]
+        self._families = {}
+
+    def _family(self, name, type_, help_):
+        """ return: the samples of a family, created if needed """
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = [type_, help_, []]
+        return family[2]
+
+    def gauge(self, name, help_, value, **labels):
+        """ add a gauge sample """
+        self._family(name, 'gauge', help_).append((name, labels, value))
+
+    def counter(self, name, help_, value, **labels):
+        """ add a counter sample """
+        self._family(name, 'counter', help_).append((name, labels, value))
+
+    def histogram(self, name, help_, histogram, **labels):
+        """ add the samples of an engine.db_stats.Histogram """
+        samples = self._family(name, 'histogram', help_)
+        for bound, count in histogram.cumulative():
+            samples.append((name + '_bucket',
+                            dict(labels, le=_format_value(float(bound))),
+                            count))
+        samples.append((name + '_sum', labels, histogram.sum))
+        samples.append((name + '_count', labels, histogram.count))
+
+    def render(self):
+        """ return: the metrics in the prometheus text format (str) """
+        lines = []
+        for name, (type_, help_, samples) in self._families.items():
+            lines.append('# HELP {} {}'.format(name, help_))
+            lines.append('# TYPE {} {}'.format(name, type_))
+            for sample, labels, value in samples:
+                if len(labels) != 0:
+                    sample += '{{{}}}'.format(','.join(
+                        '{}="{}"'.format(key, _escape(label))
+                        for key, label in sorted(labels.items())))
+                lines.append('{} {}'.format(sample, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+def process_rss():
+    """ return: resident memory of the process in bytes """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # peak RSS, in KiB on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def collect(gm, request_stats=None):
+    """ gather the metrics of the games manager and of the requests.
+    args:
+     gm (GamesManager)
+     request_stats (web_backend.timing.RequestStats), None if not timed
+    return: Metrics
+    """
+    metrics = Metrics()
+
+    cache = gm.cache_stats()
+    metrics.gauge('ecbb_games_cached', 'Games in memory', cache['games'])
+    metrics.gauge('ecbb_games_cached_bytes',
+                  'Approximate memory used by the games', cache['bytes'])
+    metrics.gauge('ecbb_games_pinned', 'Games pinned in memory',
+                  cache['pinned'])
+    metrics.gauge('ecbb_games_dirty', 'Games modified and not saved',
+                  cache['dirty'])
+    for name in ('hits', 'misses', 'evictions', 'write_backs'):
+        metrics.counter('ecbb_games_cache_{}_total'.format(name),
+                        'Games cache {}'.format(name.replace('_', ' ')),
+                        cache[name])
+    lookups = cache['hits'] + cache['misses']
+    metrics.gauge('ecbb_games_cache_hit_ratio', 'Games cache hit ratio',
+                  cache['hits'] / lookups if lookups else 0.0)
+
+    players = gm.players_stats()
+    metrics.gauge('ecbb_players_cached', 'Players in memory',
+                  players['players'])
+    metrics.counter('ecbb_players_cache_hits_total', 'Players cache hits',
+                    players['hits'])
+    metrics.counter('ecbb_players_cache_misses_total',
+                    'Players cache misses', players['misses'])
+    lookups = players['hits'] + players['misses']
+    metrics.gauge('ecbb_players_cache_hit_ratio', 'Players cache hit ratio',
+                  players['hits'] / lookups if lookups else 0.0)
+
+    pool = gm.pool_stats()
+    metrics.gauge('ecbb_db_connections', 'Opened DB connections',
+                  pool['size'])
+    metrics.gauge('ecbb_db_connections_idle', 'Idle DB connections',
+                  pool['idle'])
+    metrics.gauge('ecbb_db_connections_max', 'DB connections pool capacity',
+                  pool['max_size'])
+
+    db_stats = gm.db_stats()
+    for method, stats in sorted(db_stats.methods().items()):
+        metrics.histogram('ecbb_db_method_seconds',
+                          'Wall time of the DB methods', stats.time,
+                          method=method)
+        metrics.histogram('ecbb_db_acquire_seconds',
+                          'Time waiting for a DB connection', stats.acquire,
+                          method=method)
+        metrics.counter('ecbb_db_method_errors_total',
+                        'DB methods calls failed', stats.errors,
+                        method=method)
+        metrics.counter('ecbb_db_statements_total', 'SQL statements run',
+                        stats.statements, method=method)
+    metrics.gauge('ecbb_db_slow_queries', 'Slow statements kept',
+                  len(db_stats.slow_queries()))
+    metrics.histogram('ecbb_state_blob_bytes',
+                      'Sizes of the state blobs written and read',
+                      db_stats.state_sizes())
+
+    write_behind = gm.write_behind_stats()
+    if write_behind is not None:
+        metrics.gauge('ecbb_write_behind_pending', 'Saves waiting to be '
+                      'written', write_behind['pending'])
+        metrics.counter('ecbb_write_behind_batches_total',
+                        'Transactions written', write_behind['batches'])
+        metrics.counter('ecbb_write_behind_saves_total', 'Saves written',
+                        write_behind['saves'])
+
+    logs = engine.util.log_queue_stats()
+    metrics.gauge('ecbb_log_queue_records', 'Log records queued',
+                  logs['queued'])
+    metrics.counter('ecbb_log_queue_dropped_total', 'Log records dropped',
+                    logs['dropped'])
+
+    if request_stats is not None:
+        for route, stats in sorted(request_stats.routes().items()):
+            metrics.histogram('ecbb_request_seconds',
+                              'Wall time of the requests', stats.total,
+                              route=route)
+            metrics.histogram('ecbb_request_render_seconds',
+                              'Templates render time of the requests',
+                              stats.render, route=route)
+            metrics.counter('ecbb_request_errors_total',
+                            'Requests failed', stats.errors, route=route)
+
+    metrics.gauge('process_resident_memory_bytes',
+                  'Resident memory size in bytes', process_rss())
+    return metrics
@@ -1,10 +1,6 @@
 # -*- coding: utf-8 -*- 
 <%inherit file="menu.mako"/>
 
-<% 
-gm =  request.registry.settings['gm']
-%>
-
 <h1>Join game</h1>
 
 <table>
@@ -33,10 +29,10 @@ gm =  request.registry.settings['gm']
 <td rowspan="${game.num_players}">${game.num_players}</td>
 
 <%
-    player = gm.get_player(game.creator_id)
-    tz_desc = timezones.dict_tz[player.tz_id]
+    player_id, player_name, tz_id = game.get_player(game.creator_id)
+    tz_desc = timezones.dict_tz[tz_id]
 %>
-<td>${player.name}</td>
+<td>${player_name}</td>
 <td>${tz_desc}</td>
 <td rowspan="${game.num_players}">${game.start_date}</td>
 <td rowspan="${game.num_players}">/
@@ -47,14 +43,14 @@ ${ext} /
 </tr>
 
     % for i in range(game.num_players):
-      % if i < len(game.players_ids):
-        % if game.players_ids[i] != game.creator_id:
+      % if i < len(game.players):
+        % if game.players[i][0] != game.creator_id:
 <%
-          player = gm.get_player(game.players_ids[i])
-          tz_desc = timezones.dict_tz[player.tz_id]
+          player_id, player_name, tz_id = game.players[i]
+          tz_desc = timezones.dict_tz[tz_id]
 %>
 <tr>
-<td>${player.name}</td>
+<td>${player_name}</td>
 <td>${tz_desc}</td>
 </tr>
         % endif
@@ -98,10 +94,10 @@ ${ext} /
 <td rowspan="${game.num_players}">${game.num_players}</td>
 
 <%
-    player = gm.get_player(game.creator_id)
-    tz_desc = timezones.dict_tz[player.tz_id]
+    player_id, player_name, tz_id = game.get_player(game.creator_id)
+    tz_desc = timezones.dict_tz[tz_id]
 %>
-<td>${player.name}</td>
+<td>${player_name}</td>
 <td>${tz_desc}</td>
 <td rowspan="${game.num_players}">${game.start_date}</td>
 <td rowspan="${game.num_players}">/
@@ -112,13 +108,13 @@ ${ext} /
 </tr>
 
     % for i in range(1, game.num_players):
-      % if i < len(game.players_ids):
+      % if i < len(game.players):
 <%
-        player = gm.get_player(game.players_ids[i])
-        tz_desc = timezones.dict_tz[player.tz_id]
+        player_id, player_name, tz_id = game.players[i]
+        tz_desc = timezones.dict_tz[tz_id]
 %>
 <tr>
-<td>${player.name}</td>
+<td>${player_name}</td>
 <td>${tz_desc}</td>
 </tr>
       % else:
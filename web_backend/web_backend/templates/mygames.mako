@@ -30,8 +30,8 @@ my_player = gm.get_player(request.session['player_id'])
   % for game in my_games:
 
 <%
-    web_player = gm.get_player(game.creator_id)
-    game_player = game.cur_state.get_player(game.creator_id)
+    # race wishes are stored in the game state, not loaded for the list
+    player_id, player_name, tz_id = game.get_player(game.creator_id)
 %>
 
 <tr>
@@ -42,21 +42,13 @@ my_player = gm.get_player(request.session['player_id'])
   <td rowspan="${game.num_players}">${game.num_players}</td>
   <td rowspan="${game.num_players}">${game.start_date}</td>
   <td rowspan="${game.num_players}">${game.last_play}</td>
-  <td rowspan="${game.num_players}">${game.cur_state.cur_turn}</td>
-  <td rowspan="${game.num_players}">${game.cur_state.id_}</td>
-  <td>${web_player.name}</td>
-    % if game_player is None:
-      % if my_player.id_ == web_player.id_:
-        <td><a>Choose races</a></td>
-      % else:
-        <td>Race wishes not done</td>
-      % endif
+  <td rowspan="${game.num_players}">${game.cur_turn}</td>
+  <td rowspan="${game.num_players}">${game.cur_state_id}</td>
+  <td>${player_name}</td>
+    % if my_player.id_ == player_id:
+  <td><a>Choose races</a></td>
     % else:
-      % if self.race is not None:
-	<td>${game_player.race}</td>
-      % else:
-	<td>Race wishes done</td>
-      % endif
+  <td>Race wishes not done</td>
     % endif
   <td rowspan="${game.num_players}">/
     % for ext in game.extensions.values():
@@ -67,26 +59,17 @@ my_player = gm.get_player(request.session['player_id'])
 
     ## loop through remaining players
     % for i in range(game.num_players):
-      % if i < len(game.players_ids):
-        % if game.players_ids[i] != game.creator_id:
+      % if i < len(game.players):
 <%
-            web_player = gm.get_player(game.players_ids[i])
-            game_player = game.cur_state.get_player(game.players_ids[i])
+          player_id, player_name, tz_id = game.players[i]
 %>
+        % if player_id != game.creator_id:
 <tr>
-  <td>${web_player.name}</td>
-          % if game_player is None:
-            % if my_player.id_ == web_player.id_:
-              <td><a>Choose races</a></td>
-            % else:
-              <td>Race wishes not done</td>
-            % endif
+  <td>${player_name}</td>
+          % if my_player.id_ == player_id:
+  <td><a>Choose races</a></td>
           % else:
-            % if self.race is not None:
-	      <td>${game_player.race}</td>
-            % else:
-	      <td>Race wishes done</td>
-            % endif
+  <td>Race wishes not done</td>
           % endif
 </tr>
         % endif
@@ -83,6 +83,104 @@ class ViewTests(unittest.TestCase):
 
         _LOGGER.info('===END TEST_VIEW_HOME===')
 
+    def test_timing(self):
+        """ test the Server-Timing header and the per-route timings """
+        _LOGGER.info('===BEGIN TEST_TIMING===')
+
+        self._gen_test('/login', tests_true=['Login successful.'],
+                       post={'email': 'test@test.com', 'password': 'test'})
+        res = self.testapp.get('/mygames')
+        timing = res.headers['Server-Timing']
+        self.assertTrue(timing.startswith('total;dur='))
+        self.assertTrue('gm;dur=' in timing)
+        self.assertTrue('db;dur=' in timing)
+        self.assertTrue('render;dur=' in timing)
+
+        summary = self.testapp.app.registry.request_stats.summary()
+        self.assertEqual(summary['mygames']['count'], 1)
+        self.assertTrue(summary['mygames']['db_queries_mean'] >= 1)
+        self.assertTrue(summary['login']['p95'] > 0)
+
+        _LOGGER.info('===END TEST_TIMING===')
+
+    def test_metrics(self):
+        """ test the prometheus metrics and their access """
+        _LOGGER.info('===BEGIN TEST_METRICS===')
+
+        self._gen_test('/login', tests_true=['Login successful.'],
+                       post={'email': 'test@test.com', 'password': 'test'})
+        self.testapp.get('/mygames')
+        res = self.testapp.get('/metrics',
+                               extra_environ={'REMOTE_ADDR': '127.0.0.1'})
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        self.assertTrue('# TYPE ecbb_games_cache_hits_total counter'
+                        in res.text)
+        self.assertTrue('ecbb_db_method_seconds_bucket{le="+Inf",'
+                        'method="auth_player"} 1' in res.text)
+        self.assertTrue('ecbb_request_seconds_count{route="mygames"} 1'
+                        in res.text)
+        self.assertTrue('process_resident_memory_bytes ' in res.text)
+
+        # forbidden to the other hosts, unless logged in as an admin
+        from web_backend.metrics import Access
+        self.testapp.get('/metrics', status=403,
+                         extra_environ={'REMOTE_ADDR': '10.0.0.1'})
+        registry = self.testapp.app.registry
+        settings = dict(registry.settings)
+        settings['eclipsebb.metrics.admins'] = '1'
+        registry.metrics_access = Access(settings)
+        self.testapp.get('/metrics', status=200,
+                         extra_environ={'REMOTE_ADDR': '10.0.0.1'})
+
+        # nobody by default
+        registry.metrics_access = Access({})
+        self.testapp.get('/metrics', status=403,
+                         extra_environ={'REMOTE_ADDR': '127.0.0.1'})
+
+        # behind a proxy, the forwarded client address
+        settings = {'eclipsebb.metrics.hosts': '10.0.0.2',
+                    'eclipsebb.metrics.proxies': '127.0.0.1'}
+        registry.metrics_access = Access(settings)
+        self.testapp.get('/metrics', status=200,
+                         headers={'X-Forwarded-For': '1.2.3.4, 10.0.0.2'},
+                         extra_environ={'REMOTE_ADDR': '127.0.0.1'})
+        self.testapp.get('/metrics', status=403,
+                         headers={'X-Forwarded-For': '10.0.0.2, 1.2.3.4'},
+                         extra_environ={'REMOTE_ADDR': '127.0.0.1'})
+        self.testapp.get('/metrics', status=403,
+                         extra_environ={'REMOTE_ADDR': '127.0.0.1'})
+        # only trusted from the proxies
+        self.testapp.get('/metrics', status=403,
+                         headers={'X-Forwarded-For': '10.0.0.2'},
+                         extra_environ={'REMOTE_ADDR': '10.0.0.3'})
+
+        # malformed admins fail at configuration time
+        self.assertRaises(ValueError, Access,
+                          {'eclipsebb.metrics.admins': '1 admin'})
+
+        _LOGGER.info('===END TEST_METRICS===')
+
+    def test_loadtest(self):
+        """ test the load test harness in-process """
+        _LOGGER.info('===BEGIN TEST_LOADTEST===')
+
+        from web_backend import loadtest
+
+        app = self.testapp.app
+        (duration, stats) = loadtest.run(lambda: loadtest.WSGIClient(app),
+                                         players=3, iterations=10, think=0,
+                                         prefix='test load')
+        summary = stats.summary(duration)
+        self.assertEqual(summary['POST register']['count'], 3)
+        self.assertEqual(summary['POST login']['count'], 3)
+        self.assertEqual(summary['all']['count'],
+                         sum(route['count'] for name, route
+                             in summary.items() if name != 'all'))
+        self.assertEqual(summary['all']['errors'], 0)
+        self.assertTrue('POST login' in loadtest.report(summary))
+
+        _LOGGER.info('===END TEST_LOADTEST===')
+
     def test_view_logout(self):
         """ test by using TestApp """
         _LOGGER.info('===BEGIN TEST_VIEW_LOGOUT===')
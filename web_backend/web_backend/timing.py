@@ -0,0 +1,189 @@
+"""
+Copyright (C) 2012-2013  manu, adri
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import threading
+import time
+from pyramid.events import BeforeRender
+import pyramid.settings
+from pyramid.tweens import EXCVIEW
+from engine.db_stats import Histogram
+import engine.util
+
+# Timing of the requests: a tween measures each request, with the time
+# spent in the GamesManager calls ('gm' spans), in the DB methods ('db'
+# spans) and in the mako templates, from the BeforeRender event to the end
+# of the request. The timings are sent in a Server-Timing header and
+# aggregated per route in registry.request_stats.
+
+# the per-route summary is logged every log_interval seconds
+DEFAULT_LOG_INTERVAL = 300.0
+
+class RouteStats(object):
+    """ the histograms of a route, in seconds """
+    def __init__(self):
+        self.total = Histogram()
+        self.gm = Histogram()
+        self.db = Histogram()
+        self.render = Histogram()
+        self.db_queries = 0
+        self.errors = 0
+
+class RequestStats(object):
+    """
+    Timings of the requests, per route name. Thread-safe, queryable with
+    routes() / summary(), dumpable with report().
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def record(self, route, total, timings, error):
+        """ add a request to the histograms of its route.
+        args:
+         route (str): route name
+         total (float): wall time of the request in seconds
+         timings (engine.util.Timings): spans of the request
+         error (bool): the request failed, 5xx or exception
+        """
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = RouteStats()
+            stats.total.observe(total)
+            stats.gm.observe(timings.durations.get('gm', 0))
+            stats.db.observe(timings.durations.get('db', 0))
+            stats.render.observe(timings.durations.get('render', 0))
+            stats.db_queries += timings.counts.get('db', 0)
+            if error:
+                stats.errors += 1
+
+    def routes(self):
+        """ return: {route name (str): RouteStats}, a copy """
+        with self._lock:
+            return dict(self._routes)
+
+    def summary(self):
+        """ return: {route name (str): {'count', 'errors', 'p50', 'p95',
+                     'p99', 'gm_mean', 'db_mean', 'db_queries_mean',
+                     'render_mean'}}, the times in seconds
+        """
+        summary = {}
+        with self._lock:
+            for route, stats in self._routes.items():
+                count = stats.total.count
+                summary[route] = {'count': count,
+                                  'errors': stats.errors,
+                                  'p50': stats.total.quantile(0.5),
+                                  'p95': stats.total.quantile(0.95),
+                                  'p99': stats.total.quantile(0.99),
+                                  'gm_mean': stats.gm.mean(),
+                                  'db_mean': stats.db.mean(),
+                                  'db_queries_mean': stats.db_queries / count,
+                                  'render_mean': stats.render.mean()}
+        return summary
+
+    def report(self):
+        """ return: a text report, the slowest routes (p95) first """
+        lines = [('{:<16} {:>7} {:>6} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} '
+                  '{:>9}').format('route', 'count', 'errors', 'p50 ms',
+                                  'p95 ms', 'p99 ms', 'gm ms', 'db ms',
+                                  'rdr ms', 'queries')]
+        summary = self.summary()
+        for route in sorted(summary, key=lambda route: summary[route]['p95'],
+                            reverse=True):
+            stats = summary[route]
+            lines.append(('{:<16} {:>7} {:>6} {:>8.1f} {:>8.1f} {:>8.1f} '
+                          '{:>8.1f} {:>8.1f} {:>8.1f} {:>9.1f}').format(
+                              route, stats['count'], stats['errors'],
+                              stats['p50'] * 1000, stats['p95'] * 1000,
+                              stats['p99'] * 1000, stats['gm_mean'] * 1000,
+                              stats['db_mean'] * 1000,
+                              stats['render_mean'] * 1000,
+                              stats['db_queries_mean']))
+        return '\n'.join(lines)
+
+def server_timing(total, timings):
+    """ return: the Server-Timing header value of a request """
+    metrics = ['total;dur={:.2f}'.format(total * 1000)]
+    for name in ('gm', 'db', 'render'):
+        if name in timings.durations:
+            metrics.append('{};dur={:.2f}'.format(
+                name, timings.durations[name] * 1000))
+    metrics.append('db-queries;desc="{}"'.format(timings.counts.get('db', 0)))
+    return ', '.join(metrics)
+
+def route_name(request):
+    """ return: name of the route matched by a request """
+    route = getattr(request, 'matched_route', None)
+    if route is None:
+        return 'notfound'
+    return route.name
+
+def timing_tween_factory(handler, registry):
+    """ the tween timing the requests """
+    logger = logging.getLogger('ecbb.timing')
+    stats = registry.request_stats
+    interval = float(registry.settings.get('eclipsebb.timing.log_interval',
+                                           DEFAULT_LOG_INTERVAL))
+    last_log = [time.monotonic()]
+
+    def timing_tween(request):
+        """ time a request """
+        start = time.perf_counter()
+        error = True
+        with engine.util.collect_timings() as timings:
+            request.timings = timings
+            try:
+                response = handler(request)
+                error = response.status_int >= 500
+            finally:
+                end = time.perf_counter()
+                render_start = getattr(request, 'render_start', None)
+                if render_start is not None:
+                    timings.add('render', end - render_start)
+                stats.record(route_name(request), end - start, timings,
+                             error)
+        response.headers['Server-Timing'] = server_timing(end - start,
+                                                          timings)
+
+        now = time.monotonic()
+        if now - last_log[0] >= interval:
+            last_log[0] = now
+            logger.info('Requests timings per route:\n{}'.format(
+                stats.report()))
+        return response
+
+    return timing_tween
+
+def before_render(event):
+    """ the templates render from now until the end of the request """
+    request = event.get('request')
+    if request is not None:
+        request.render_start = time.perf_counter()
+
+def includeme(config):
+    """ register the timing tween, over the exception view tween to also
+    time the failed requests.
+    enabled unless the eclipsebb.timing setting is false.
+    """
+    settings = config.get_settings()
+    if not pyramid.settings.asbool(settings.get('eclipsebb.timing', True)):
+        return
+    config.registry.request_stats = RequestStats()
+    config.add_subscriber(before_render, BeforeRender)
+    config.add_tween('web_backend.timing.timing_tween_factory', over=EXCVIEW)
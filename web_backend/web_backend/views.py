@@ -17,8 +17,10 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
 from validate_email import validate_email
-from pyramid.httpexceptions import HTTPFound
+from pyramid.httpexceptions import HTTPFound, HTTPForbidden
+from pyramid.response import Response
 from pyramid.view import view_config
+import web_backend.metrics
 
 _LOGGER = logging.getLogger('ecbb.views')
 
@@ -161,6 +163,21 @@ def view_home(request):
     """ entry point for the users """
     return {'auth': is_auth(request)}
 
+@view_config(route_name='metrics')
+def view_metrics(request):
+    """ server metrics in the prometheus text format, for the metrics hosts
+    and the admin players only
+    """
+    if not web_backend.metrics.is_allowed(request):
+        return HTTPForbidden()
+
+    gm =  request.registry.settings['gm']
+    metrics = web_backend.metrics.collect(
+        gm, getattr(request.registry, 'request_stats', None))
+    return Response(metrics.render(),
+                    content_type=web_backend.metrics.CONTENT_TYPE,
+                    charset='utf-8')
+
 @view_config(route_name='login')
 def view_login(request):
     """ allow players to login """